@@ -1,6 +1,38 @@
 import struct
 import os
+import sys
+import re
+import mmap
+import heapq
+import itertools
+import tempfile
 import datetime
+import threading
+import contextlib
+import functools
+import time
+import zlib
+import hashlib
+import lzma
+import unicodedata
+import collections
+import bisect
+import atexit
+import json
+import cProfile
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: tables are only guarded within one process
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # analytics and the vectorized report need numpy
+    np = None
 
 # ---------------- Struct definitions (little-endian '<') ----------------
 BOOK_STRUCT = struct.Struct("<i100s100s100si50s50s20si")
@@ -10,6 +42,161 @@ BORROW_STRUCT = struct.Struct("<ii10s10s10s20sf200s")
 BOOK_FILE = "books.dat"
 MEMBER_FILE = "members.dat"
 BORROW_FILE = "borrows.dat"
+TABLES = ((BOOK_FILE, BOOK_STRUCT), (MEMBER_FILE, MEMBER_STRUCT), (BORROW_FILE, BORROW_STRUCT))
+# table names the command-line tools accept
+TABLE_NAMES = {"books": TABLES[0], "members": TABLES[1], "borrows": TABLES[2]}
+
+# A deleted record keeps its slot; its first int field is overwritten with this
+# value until compact_file() rewrites the table without it.
+TOMBSTONE = -2**31
+# IDs and counts are stored as 32-bit ints; the smallest one is the tombstone
+ID_MIN, INT_MAX = TOMBSTONE + 1, 2**31 - 1
+
+# ---------------- Metrics ----------------
+# Set LIBRARY_METRICS before starting to turn on instrumentation: "1", or a
+# file the metrics are written to at exit (.prom/.txt for Prometheus text
+# format, anything else JSON). Storage operations then record a latency
+# histogram per operation and counters (records scanned, bytes read and
+# written, fsyncs, decode time, cache hits, ...) labelled with the outermost
+# operation running in the thread, i.e. the menu action or server request.
+# LIBRARY_PROFILE=<operation> runs that operation under cProfile
+# (LIBRARY_PROFILE_MODE=tracemalloc for an allocation snapshot instead) and
+# writes profile-<operation>.prof/.txt. With neither set, @timed returns the
+# function unchanged and count() returns at once.
+METRICS_TARGET = os.environ.get("LIBRARY_METRICS", "")
+METRICS_ENABLED = METRICS_TARGET not in ("", "0")
+PROFILE_OPERATION = os.environ.get("LIBRARY_PROFILE", "")
+PROFILE_MODE = os.environ.get("LIBRARY_PROFILE_MODE", "cprofile")
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float("inf"))
+
+class Metrics:
+    def __init__(self):
+        self._guard = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._guard:
+            self.counters = collections.Counter()  # (name, operation) -> value
+            self.histograms = {}  # operation -> [count per bucket..., sum, count]
+
+    def add(self, name: str, value, operation: str):
+        with self._guard:
+            self.counters[(name, operation)] += value
+
+    def observe(self, operation: str, seconds: float):
+        with self._guard:
+            h = self.histograms.get(operation)
+            if h is None:
+                h = self.histograms[operation] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            h[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._guard:
+            counters = {}
+            for (name, operation), value in sorted(self.counters.items()):
+                counters.setdefault(name, {})[operation] = value
+            latency = {operation: {"buckets": dict(zip(map(str, LATENCY_BUCKETS), itertools.accumulate(h[:-2]))),
+                                   "sum": h[-2], "count": h[-1]}
+                       for operation, h in sorted(self.histograms.items())}
+        return {"counters": counters, "latency_seconds": latency}
+
+    def prometheus(self) -> str:
+        snap = self.snapshot()
+        lines = []
+        for name, by_operation in snap["counters"].items():
+            lines.append(f"# TYPE library_{name}_total counter")
+            for operation, value in by_operation.items():
+                lines.append(f'library_{name}_total{{op="{operation}"}} {value}')
+        lines.append("# TYPE library_operation_seconds histogram")
+        for operation, h in snap["latency_seconds"].items():
+            for le, n in h["buckets"].items():
+                le = "+Inf" if le == "inf" else le
+                lines.append(f'library_operation_seconds_bucket{{op="{operation}",le="{le}"}} {n}')
+            lines.append(f'library_operation_seconds_sum{{op="{operation}"}} {h["sum"]}')
+            lines.append(f'library_operation_seconds_count{{op="{operation}"}} {h["count"]}')
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+_operations = threading.local()
+
+def current_operation() -> str:
+    stack = getattr(_operations, "stack", None)
+    return stack[0] if stack else "-"
+
+def count(name: str, value=1):
+    if METRICS_ENABLED:
+        metrics.add(name, value, current_operation())
+
+def profile_call(name: str, fn, *args, mode: str = None, **kwargs):
+    """Run fn(*args, **kwargs) under cProfile, or tracemalloc with
+    mode="tracemalloc", and write profile-<name>.prof (.txt)."""
+    if (mode or PROFILE_MODE) == "tracemalloc":
+        tracemalloc.start(25)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with open(f"profile-{name}.txt", "w", encoding="utf-8") as f:
+                f.write(f"peak {peak} bytes\n")
+                for stat in snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(f"profile-{name}.prof")
+
+def timed(name: str):
+    # decorator: latency histogram and counter label for one operation
+    def wrap(fn):
+        if not METRICS_ENABLED and name != PROFILE_OPERATION:
+            return fn
+
+        @functools.wraps(fn)
+        def timed_call(*args, **kwargs):
+            stack = _operations.__dict__.setdefault("stack", [])
+            profile = name == PROFILE_OPERATION and name not in stack
+            stack.append(name)
+            started = time.perf_counter()
+            try:
+                if profile:
+                    return profile_call(name, fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+            finally:
+                stack.pop()
+                if METRICS_ENABLED:
+                    metrics.observe(name, time.perf_counter() - started)
+        return timed_call
+    return wrap
+
+@contextlib.contextmanager
+def span(name: str):
+    # time one phase of an operation (e.g. "generate_report.decode")
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(name, time.perf_counter() - started)
+
+def dump_metrics(path: str):
+    text = metrics.prometheus() if path.endswith((".prom", ".txt")) else \
+        json.dumps(metrics.snapshot(), ensure_ascii=False, indent=2) + "\n"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+def _fsync(fd: int):
+    count("fsyncs")
+    os.fsync(fd)
+
+if METRICS_ENABLED and METRICS_TARGET != "1":
+    atexit.register(dump_metrics, os.path.abspath(METRICS_TARGET))
 
 # ---------------- Helpers: packing/unpacking fixed-length strings ----------------
 def pack_str(s: str, length: int) -> bytes:
@@ -22,101 +209,2541 @@ def unpack_str(b: bytes) -> str:
     return b.decode("utf-8", errors="ignore").rstrip(" \x00")
 
 # ---------------- Input validators ----------------
-def get_int(prompt: str, minv=None, maxv=None) -> int:
+# parse_* apply the validation rules and raise ValueError with the message to
+# show; get_* prompt until parse_* accepts the input. Bulk import uses parse_*.
+def parse_int(v: str, minv=None, maxv=None) -> int:
+    v = v.strip()
+    if v == "":
+        raise ValueError("กรุณากรอกข้อมูล")
+    try:
+        n = int(v)
+    except ValueError:
+        raise ValueError(" ต้องกรอกตัวเลขจำนวนเต็มเท่านั้น — ลองใหม่") from None
+    if minv is not None and n < minv:
+        raise ValueError(f" ค่าต้อง >= {minv}")
+    if maxv is not None and n > maxv:
+        raise ValueError(f" ค่าต้อง <= {maxv}")
+    return n
+
+def parse_float(v: str, minv=None, maxv=None) -> float:
+    v = v.strip()
+    if v == "":
+        raise ValueError("กรุณากรอกข้อมูล")
+    try:
+        f = float(v)
+    except ValueError:
+        raise ValueError(" ต้องกรอกตัวเลข (ทศนิยมได้) เท่านั้น — ลองใหม่") from None
+    if minv is not None and f < minv:
+        raise ValueError(f" ค่าต้อง >= {minv}")
+    if maxv is not None and f > maxv:
+        raise ValueError(f" ค่าต้อง <= {maxv}")
+    return f
+
+def parse_date(s: str, allow_empty=False) -> str:
+    s = s.strip()
+    if allow_empty and s == "":
+        return ""
+    try:
+        # stored zero-padded: legacy files compare dates as bytes
+        return datetime.datetime.strptime(s, "%Y-%m-%d").date().isoformat()
+    except Exception:
+        raise ValueError(" รูปแบบวันที่ต้องเป็น YYYY-MM-DD เช่น 2025-09-07") from None
+
+def parse_str(s: str, maxlen: int, allow_empty=False) -> str:
+    s = s.rstrip()
+    if not allow_empty and s == "":
+        raise ValueError(" ห้ามเว้นว่าง — ลองใหม่")
+    return fit_str(s, maxlen)
+
+def fit_str(s: str, maxlen: int) -> str:
+    # cut to maxlen bytes of UTF-8 without splitting a character
+    return s.encode('utf-8')[:maxlen].decode('utf-8', 'ignore')
+
+def get_int(prompt: str, minv=None, maxv=None, allow_empty=False) -> int:
     while True:
-        v = input(prompt).strip()
-        if v == "":
-            print("กรุณากรอกข้อมูล")
-            continue
+        s = input(prompt)
+        if allow_empty and s.strip() == "":
+            return None
         try:
-            n = int(v)
-        except ValueError:
-            print(" ต้องกรอกตัวเลขจำนวนเต็มเท่านั้น — ลองใหม่")
-            continue
-        if minv is not None and n < minv:
-            print(f" ค่าต้อง >= {minv}")
-            continue
-        if maxv is not None and n > maxv:
-            print(f" ค่าต้อง <= {maxv}")
-            continue
-        return n
+            return parse_int(s, minv, maxv)
+        except ValueError as e:
+            print(e)
 
 def get_float(prompt: str, minv=None, maxv=None) -> float:
     while True:
-        v = input(prompt).strip()
-        if v == "":
-            print("กรุณากรอกข้อมูล")
-            continue
         try:
-            f = float(v)
-        except ValueError:
-            print(" ต้องกรอกตัวเลข (ทศนิยมได้) เท่านั้น — ลองใหม่")
-            continue
-        if minv is not None and f < minv:
-            print(f" ค่าต้อง >= {minv}")
-            continue
-        if maxv is not None and f > maxv:
-            print(f" ค่าต้อง <= {maxv}")
-            continue
-        return f
+            return parse_float(input(prompt), minv, maxv)
+        except ValueError as e:
+            print(e)
 
 def get_date(prompt: str, allow_empty=False) -> str:
     while True:
-        s = input(prompt).strip()
-        if allow_empty and s == "":
-            return ""
         try:
-            datetime.datetime.strptime(s, "%Y-%m-%d")
-            return s
-        except Exception:
-            print(" รูปแบบวันที่ต้องเป็น YYYY-MM-DD เช่น 2025-09-07")
+            return parse_date(input(prompt), allow_empty)
+        except ValueError as e:
+            print(e)
 
 def get_str(prompt: str, maxlen: int, allow_empty=False) -> str:
     while True:
-        s = input(prompt).rstrip()
-        if not allow_empty and s == "":
-            print(" ห้ามเว้นว่าง — ลองใหม่")
+        s = input(prompt)
+        try:
+            value = parse_str(s, maxlen, allow_empty)
+        except ValueError as e:
+            print(e)
             continue
-        if len(s.encode("utf-8")) > maxlen:
+        if value != s.rstrip():
             print(f" ความยาวเกิน {maxlen} bytes — จะถูกตัด")
-            s = s.encode('utf-8')[:maxlen].decode('utf-8', 'ignore')
-        return s
+        return value
 
-# ---------------- File operations ----------------
-def add_record(filename: str, st: struct.Struct, packed_tuple: tuple):
+# ---------------- Record columns ----------------
+# (name, kind, options) for every field of each record, in struct order. The
+# options are the same rules the add_* prompts use.
+BOOK_COLUMNS = (
+    ("book_id", "int", {"minv": ID_MIN, "maxv": INT_MAX}),
+    ("title", "str", {"maxlen": 100}),
+    ("author", "str", {"maxlen": 100, "allow_empty": True}),
+    ("publisher", "str", {"maxlen": 100, "allow_empty": True}),
+    ("year_pub", "int", {"minv": 0, "maxv": 9999}),
+    ("category", "str", {"maxlen": 50, "allow_empty": True}),
+    ("language", "str", {"maxlen": 50, "allow_empty": True}),
+    ("shelf_no", "str", {"maxlen": 20, "allow_empty": True}),
+    ("total_copies", "int", {"minv": 0, "maxv": INT_MAX}),
+)
+MEMBER_COLUMNS = (
+    ("member_id", "int", {"minv": ID_MIN, "maxv": INT_MAX}),
+    ("name", "str", {"maxlen": 100}),
+    ("birth_date", "date", {}),
+    ("gender", "str", {"maxlen": 1}),
+    ("address", "str", {"maxlen": 200, "allow_empty": True}),
+    ("mobile", "str", {"maxlen": 15, "allow_empty": True}),
+    ("email", "str", {"maxlen": 100, "allow_empty": True}),
+    ("reg_date", "date", {}),
+)
+BORROW_COLUMNS = (
+    ("member_id", "int", {"minv": ID_MIN, "maxv": INT_MAX}),
+    ("book_id", "int", {"minv": ID_MIN, "maxv": INT_MAX}),
+    ("date_out", "date", {}),
+    ("date_due", "date", {}),
+    ("date_return", "date", {"allow_empty": True}),
+    ("status", "str", {"maxlen": 20, "default": "Borrow"}),
+    ("fine", "float", {"minv": 0, "default": "0"}),
+    ("notes", "str", {"maxlen": 200, "allow_empty": True}),
+)
+TABLE_COLUMNS = {BOOK_STRUCT: BOOK_COLUMNS, MEMBER_STRUCT: MEMBER_COLUMNS, BORROW_STRUCT: BORROW_COLUMNS}
+
+def parse_row(st: struct.Struct, row: dict) -> tuple:
+    """Validate a {column: text} mapping and return the packed tuple for st.
+
+    Raises ValueError naming the offending column."""
+    packed = []
+    for name, kind, opts in TABLE_COLUMNS[st]:
+        value = row.get(name)
+        value = "" if value is None else str(value)
+        if value.strip() == "" and "default" in opts:
+            value = opts["default"]
+        try:
+            if kind == "int":
+                packed.append(parse_int(value, opts.get("minv"), opts.get("maxv")))
+            elif kind == "float":
+                packed.append(parse_float(value, opts.get("minv"), opts.get("maxv")))
+            elif kind == "date":
+                packed.append(pack_str(parse_date(value, opts.get("allow_empty", False)), 10))
+            else:
+                packed.append(pack_str(parse_str(value, opts["maxlen"], opts.get("allow_empty", False)), opts["maxlen"]))
+        except ValueError as e:
+            raise ValueError(f"{name}: {str(e).strip()}") from None
+    return tuple(packed)
+
+def format_row(st: struct.Struct, raw) -> dict:
+    return {name: value for (name, _, _), value in zip(TABLE_COLUMNS[st], decode_record(raw))}
+
+# ---------------- Locking ----------------
+# Each table has a lock file "<file>.lock" that guards the data file and all of
+# its sidecars (indexes, availability, ...). Readers hold it shared and writers
+# exclusive via fcntl.flock, so several processes (circulation desks, the
+# server's worker threads) can read at once while writes are serialized.
+# Locks are re-entrant per thread; asking for exclusive while holding shared
+# upgrades the lock for the duration of the inner block. flock does not
+# upgrade atomically (it drops the shared lock first), so another writer can
+# get in between: the upgrade re-validates by comparing the generation with
+# the one this thread last saw and raises ValueError (try again) if it moved,
+# because whatever the outer section read may be stale. Code that may need to
+# write takes exclusive up front; ensure_indexes()/ensure_availability() check
+# under a shared lock and take exclusive after releasing it, and their callers
+# run them before their own shared section, so upgrades only happen when an
+# outer caller already holds the lock. Releasing the last lock a thread holds
+# commits the WAL records it wrote (see Write-ahead log).
+# The lock file also holds a generation counter that every exclusive section
+# bumps, so a process can tell whether a table changed since it last read it,
+# and after it the data generation: the generation of the last section that
+# wrote the data file. Indexes and derived tables record the data generation
+# they were built from (see Indexes), so a write whose sidecar update never
+# happened is noticed even when the record count did not change.
+LOCK_GENERATION = struct.Struct("<Q")
+DATA_GENERATION_OFFSET = LOCK_GENERATION.size
+_lock_state = threading.local()
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+RETRY_MESSAGE = "ข้อมูลถูกแก้ไขโดยผู้ใช้อื่นระหว่างนี้ — กรุณาลองใหม่"
+
+def _lock_path(filename: str) -> str:
+    return filename + ".lock"
+
+def _flock(fd: int, exclusive: bool):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+def _read_generation(fd: int, offset: int = 0) -> int:
+    os.lseek(fd, offset, os.SEEK_SET)
+    data = os.read(fd, LOCK_GENERATION.size)
+    return LOCK_GENERATION.unpack(data)[0] if len(data) == LOCK_GENERATION.size else 0
+
+def _bump_generation(fd: int) -> int:
+    # returns the generation before the bump
+    generation = _read_generation(fd)
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, LOCK_GENERATION.pack(generation + 1))
+    return generation
+
+@contextlib.contextmanager
+def table_lock(filename: str, exclusive: bool = False):
+    key = os.path.abspath(filename)
+    held = getattr(_lock_state, "held", None)
+    if held is None:
+        held = _lock_state.held = {}
+    entry = held.get(key)
+    if entry is not None:
+        if exclusive and not entry[1]:
+            seen = entry[2]
+            _flock(entry[0], True)
+            entry[1] = True
+            entry[2] = _bump_generation(entry[0])
+            entry[3] = _read_generation(entry[0], DATA_GENERATION_OFFSET)
+            try:
+                if entry[2] != seen:
+                    raise ValueError(RETRY_MESSAGE)  # a writer got in during the upgrade
+                yield
+            finally:
+                _flock(entry[0], False)
+                entry[1] = False
+                entry[2] += 1  # the generation this section left
+        else:
+            yield
+        return
+
+    if fcntl is None:
+        with _process_locks_guard:
+            process_lock = _process_locks.setdefault(key, threading.RLock())
+        process_lock.acquire()
     os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
-    with open(filename, "ab") as f:
-        f.write(st.pack(*packed_tuple))
+    fd = os.open(_lock_path(filename), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _flock(fd, exclusive)
+        # [fd, exclusive, generation before the exclusive section (the one
+        # seen when shared), data generation]
+        held[key] = [fd, exclusive, _bump_generation(fd) if exclusive else _read_generation(fd),
+                     _read_generation(fd, DATA_GENERATION_OFFSET)]
+        try:
+            yield
+        finally:
+            del held[key]
+    finally:
+        os.close(fd)  # closing the descriptor releases the flock
+        if fcntl is None:
+            process_lock.release()
+        if not held:
+            # WAL records written under the lock become durable after it is
+            # released, also when the section ends with an exception
+            _flush_commits()
 
-def read_raw_records(filename: str, st: struct.Struct):
-    records = []
+def table_generation(filename: str) -> tuple:
+    """(generation before this thread's exclusive section or None, current
+    generation) of a table whose lock the calling thread holds."""
+    entry = _lock_state.held[os.path.abspath(filename)]
+    return (entry[2] if entry[1] else None), _read_generation(entry[0])
+
+def data_generation(filename: str) -> tuple:
+    """(data generation when this thread's exclusive section began or None,
+    current data generation) of a table whose lock the calling thread holds."""
+    entry = _lock_state.held[os.path.abspath(filename)]
+    return (entry[3] if entry[1] else None), _read_generation(entry[0], DATA_GENERATION_OFFSET)
+
+def mark_data_written(filename: str):
+    # the data file is about to change: make this exclusive section's
+    # generation its data generation (caller holds the lock exclusively)
+    fd = _lock_state.held[os.path.abspath(filename)][0]
+    generation = _read_generation(fd)
+    if _read_generation(fd, DATA_GENERATION_OFFSET) != generation:
+        os.lseek(fd, DATA_GENERATION_OFFSET, os.SEEK_SET)
+        os.write(fd, LOCK_GENERATION.pack(generation))
+
+def check_expected(old, expected):
+    # optimistic check for callers that read a record, prompted, and now write
+    if expected is not None and old != tuple(expected):
+        raise ValueError(RETRY_MESSAGE)
+
+# ---------------- On-disk formats ----------------
+# Version 1 (legacy): a data file is a bare array of st-packed records.
+# Version 2 (compact): FORMAT_HEADER, then fixed-size compact records where
+#   dates  are int32 day numbers since 1970-01-01 (NO_DATE when empty),
+#   status is one byte indexing STATUS_NAMES (0 = other text, in the heap),
+#   text   is an (offset, length) reference into the string heap
+#          "<file>.<generation>.heap"; strings of at most COMPACT_INLINE_MAX
+#          bytes (gender) stay inline.
+# table_format() detects the version from the header, and every read/write
+# path encodes/decodes through it, so the rest of the code works with legacy
+# tuples (NUL-padded bytes) whatever the version. Dates are stored canonically
+# (2025-9-7 reads back as 2025-09-07, a blank date as NULs). The heap is
+# append-only; whole-table
+# rewrites write a heap with a new generation, so a crash never pairs a data
+# file with the wrong heap.
+FORMAT_MAGIC = b"LDB2"
+FORMAT_HEADER = struct.Struct("<4sHHII")  # magic, version, header size, record size, heap generation
+NO_DATE = -2**31
+STATUS_NAMES = ("Borrow", "borrow", "Return", "return", "Returned", "Lost")
+STATUS_CODES = {name.encode("utf-8"): code for code, name in enumerate(STATUS_NAMES, 1)}
+COMPACT_INLINE_MAX = 8
+HEAP_MAX = 2**32 - 1
+HEAP_INTERN_MAX = 64  # strings up to this size are shared within one write
+EPOCH = datetime.date(1970, 1, 1)
+_formats = {}
+
+def day_number(date_str: str) -> int:
+    # "YYYY-MM-DD" -> days since 1970-01-01
+    return (datetime.datetime.strptime(date_str, "%Y-%m-%d").date() - EPOCH).days
+
+@functools.lru_cache(maxsize=65536)
+def _date_field(day: int, width: int) -> bytes:
+    if day == NO_DATE:
+        return bytes(width)
+    return (EPOCH + datetime.timedelta(days=day)).isoformat().encode("ascii").ljust(width, b"\x00")
+
+def heap_path(filename: str, generation: int) -> str:
+    return f"{filename}.{generation}.heap"
+
+class LegacyFormat:
+    version = 1
+    header_size = 0
+    heap = None
+
+    def __init__(self, st: struct.Struct):
+        self.st = st
+        self.size = st.size
+        self.layout = field_layout(st)
+
+    def encode(self, raw, heap_writer=None) -> bytes:
+        return self.st.pack(*raw)
+
+    def canonical(self, raw) -> tuple:
+        # raw as it reads back after encode()
+        return self.st.unpack(self.st.pack(*raw))
+
+    def decode_from(self, buf, offset: int) -> tuple:
+        return self.st.unpack_from(buf, offset)
+
+    def iter_decode(self, buf):
+        return self.st.iter_unpack(buf)
+
+    def raw_field(self, buf, offset: int, i: int):
+        field_offset, fst, _ = self.layout[i]
+        return fst.unpack_from(buf, offset + field_offset)[0]
+
+class StringHeap:
+    # read side of a heap file, memory-mapped and remapped when it has grown
+    def __init__(self, path: str):
+        self.path = path
+        self._mm = b""
+        self._guard = threading.Lock()
+
+    def read(self, offset: int, length: int) -> bytes:
+        if not length:
+            return b""
+        mm = self._mm
+        if offset + length > len(mm):
+            mm = self.view()
+        return mm[offset:offset + length]
+
+    def view(self):
+        # a mapping of the whole heap as it is now
+        if len(self._mm) < self.size():
+            with self._guard:
+                with open(self.path, "rb") as f:
+                    # earlier maps are left to the GC: other threads may still use them
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+class HeapWriter:
+    # heap bytes added by one write, starting at heap offset `base`; streamed
+    # to `out` when given (whole-table rewrites), else kept for the WAL
+    def __init__(self, base: int, out=None):
+        self.base = base
+        self.end = base
+        self.buf = bytearray()
+        self.out = out
+        self.known = {}
+
+    def add(self, data: bytes) -> tuple:
+        if not data:
+            return (0, 0)
+        ref = self.known.get(data)
+        if ref is not None:
+            return ref
+        ref = (self.end, len(data))
+        if self.end + len(data) > HEAP_MAX:
+            raise ValueError(" string heap เต็ม (4 GiB) — กรุณา compact ข้อมูล")
+        self.buf += data
+        self.end += len(data)
+        if len(data) <= HEAP_INTERN_MAX and len(self.known) < 100_000:
+            self.known[data] = ref
+        if self.out is not None and len(self.buf) >= 1 << 20:
+            self.flush()
+        return ref
+
+    def flush(self):
+        self.out.write(self.buf)
+        self.buf.clear()
+
+class CompactFormat:
+    version = 2
+
+    def __init__(self, st: struct.Struct, filename: str, header_size: int, generation: int):
+        self.st = st
+        self.header_size = header_size
+        self.generation = generation
+        self.heap = StringHeap(heap_path(filename, generation))
+        # plan: (how, first compact value, value count, legacy width, offset, Struct) per field
+        self.plan, codes, offset, j = [], "", 0, 0
+        for (name, kind, opts), (_, fst, _) in zip(TABLE_COLUMNS[st], field_layout(st)):
+            if kind == "date":
+                how, code = "date", "i"
+            elif kind == "str" and name == "status":
+                how, code = "status", "BIH"
+            elif kind == "str" and fst.size <= COMPACT_INLINE_MAX:
+                how, code = "inline", fst.format[1:]
+            elif kind == "str":
+                how, code = "text", "IH"
+            else:
+                how, code = "plain", fst.format[1:]
+            sub = struct.Struct("<" + code)
+            n = len(sub.unpack(bytes(sub.size)))
+            self.plan.append((how, j, n, fst.size, offset, sub))
+            codes += code
+            offset += sub.size
+            j += n
+        self.cst = struct.Struct("<" + codes)
+        self.size = self.cst.size
+
+    def header(self) -> bytes:
+        return FORMAT_HEADER.pack(FORMAT_MAGIC, self.version, self.header_size, self.size, self.generation)
+
+    def _value(self, how: str, values, width: int):
+        if how == "date":
+            return _date_field(values[0], width)
+        if how == "text":
+            return self.heap.read(values[0], values[1]).ljust(width, b"\x00")
+        if how == "status":
+            if values[0]:
+                return STATUS_NAMES[values[0] - 1].encode("utf-8").ljust(width, b"\x00")
+            return self.heap.read(values[1], values[2]).ljust(width, b"\x00")
+        return values[0]
+
+    def _decode(self, values) -> tuple:
+        return tuple(self._value(how, values[j:j + n], width) for how, j, n, width, _, _ in self.plan)
+
+    def encode(self, raw, heap_writer) -> bytes:
+        values = []
+        for (how, _, _, _, _, _), v in zip(self.plan, raw):
+            if how == "date":
+                text = unpack_str(v)
+                values.append(day_number(text) if text else NO_DATE)
+            elif how == "text":
+                values += heap_writer.add(v.rstrip(b"\x00"))
+            elif how == "status":
+                name = v.rstrip(b"\x00")
+                code = STATUS_CODES.get(name, 0)
+                values.append(code)
+                values += heap_writer.add(name) if not code else (0, 0)
+            else:
+                values.append(v)
+        return self.cst.pack(*values)
+
+    def decode_from(self, buf, offset: int) -> tuple:
+        return self._decode(self.cst.unpack_from(buf, offset))
+
+    def canonical(self, raw) -> tuple:
+        # raw as it reads back after encode(), without going through the heap
+        out = []
+        for (how, _, _, width, _, _), v in zip(self.plan, self.st.unpack(self.st.pack(*raw))):
+            if how == "date":
+                text = unpack_str(v)
+                v = _date_field(day_number(text) if text else NO_DATE, width)
+            out.append(v)
+        return tuple(out)
+
+    def iter_decode(self, buf):
+        # _decode() unrolled for scans: one heap mapping, no per-field calls
+        heap = self.heap.view()
+        statuses = {width: [b""] + [name.encode("utf-8").ljust(width, b"\x00") for name in STATUS_NAMES]
+                    for _, _, _, width, _, _ in self.plan}
+        steps = [(how, j, width, statuses[width]) for how, j, _, width, _, _ in self.plan]
+        date_field = _date_field
+        for v in self.cst.iter_unpack(buf):
+            out = []
+            for how, j, width, names in steps:
+                if how == "plain" or how == "inline":
+                    out.append(v[j])
+                elif how == "date":
+                    out.append(date_field(v[j], width))
+                elif how == "text":
+                    out.append(heap[v[j]:v[j] + v[j + 1]].ljust(width, b"\x00"))
+                elif v[j]:
+                    out.append(names[v[j]])
+                else:
+                    out.append(heap[v[j + 1]:v[j + 1] + v[j + 2]].ljust(width, b"\x00"))
+            yield tuple(out)
+
+    def raw_field(self, buf, offset: int, i: int):
+        how, _, _, width, field_offset, sub = self.plan[i]
+        return self._value(how, sub.unpack_from(buf, offset + field_offset), width)
+
+    def remember(self, heap_writer, buf, offset: int = 0):
+        # let an in-place rewrite reuse the heap strings of the record it replaces
+        values = self.cst.unpack_from(buf, offset)
+        for how, j, _, _, _, _ in self.plan:
+            ref = values[j:j + 2] if how == "text" else values[j + 1:j + 3] if how == "status" else None
+            if ref and ref[1]:
+                heap_writer.known.setdefault(self.heap.read(*ref), tuple(ref))
+
+    def numpy_dtype(self):
+        require_numpy()
+        names, formats, offsets = [], [], []
+        for (name, _, _), (how, _, _, _, offset, sub) in zip(TABLE_COLUMNS[self.st], self.plan):
+            if how == "text":
+                names += [name + "_off", name + "_len"]
+                formats += ["<u4", "<u2"]
+                offsets += [offset, offset + 4]
+            elif how == "status":
+                names += [name, name + "_off", name + "_len"]
+                formats += ["u1", "<u4", "<u2"]
+                offsets += [offset, offset + 1, offset + 5]
+            else:
+                names.append(name)
+                formats.append(f"S{sub.size}" if how == "inline" else "<" + sub.format[-1])
+                offsets.append(offset)
+        return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": self.size})
+
+def read_format_header(filename: str):
+    # (version, header size, record size, heap generation) of a versioned file, else None
+    try:
+        with open(filename, "rb") as f:
+            head = f.read(FORMAT_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(head) < FORMAT_HEADER.size or head[:4] != FORMAT_MAGIC:
+        return None
+    return FORMAT_HEADER.unpack(head)[1:]
+
+def table_format(filename: str, st: struct.Struct):
+    """The format object of filename, detected from its header (cached per file)."""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return LegacyFormat(st)
+    ident = (stat.st_ino, stat.st_dev)  # a rewrite replaces the file, so this changes
+    key = (os.path.abspath(filename), st)
+    cached = _formats.get(key)
+    if cached is not None and cached[0] == ident:
+        return cached[1]
+    header = read_format_header(filename)
+    if header is None:
+        fmt = LegacyFormat(st)
+    else:
+        version, header_size, record_size, generation = header
+        if version != 2:
+            raise ValueError(f"{filename}: ไม่รู้จักรูปแบบไฟล์เวอร์ชัน {version}")
+        fmt = CompactFormat(st, filename, header_size, generation)
+        if fmt.size != record_size:
+            raise ValueError(f"{filename}: ขนาด record ในไฟล์ไม่ตรงกับโครงสร้าง")
+    _formats[key] = (ident, fmt)
+    return fmt
+
+def _heap_writer(fmt):
+    return HeapWriter(fmt.heap.size()) if fmt.heap is not None else None
+
+def _write_heap(filename: str, fmt, heap_writer):
+    # log and append the strings an encode() added; caller holds the exclusive lock
+    if heap_writer is None or not heap_writer.buf:
+        return
+    data = bytes(heap_writer.buf)
+    log_write(filename, heap_writer.base, data, kind=WAL_HEAP)
+    with open(fmt.heap.path, "ab") as f:
+        f.write(data)
+
+def table_bytes(filename: str, st: struct.Struct) -> int:
+    # data file plus string heap
     if not os.path.exists(filename):
-        return records
-    size = st.size
+        return 0
+    fmt = table_format(filename, st)
+    return os.path.getsize(filename) + (fmt.heap.size() if fmt.heap is not None else 0)
+
+def _remove_stale_heaps(filename: str, keep=None):
+    folder = os.path.dirname(os.path.abspath(filename))
+    prefix = os.path.basename(filename) + "."
+    for name in os.listdir(folder):
+        if name.startswith(prefix) and name.endswith(".heap") and name != os.path.basename(heap_path(filename, keep)):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:  # still mapped elsewhere (Windows); removed by the next rewrite
+                pass
+
+# ---------------- File operations ----------------
+SCAN_PAGE = 8192  # slots iter_records() reads per hold of the table lock
+
+def add_record(filename: str, st: struct.Struct, packed_tuple: tuple) -> int:
+    return add_records(filename, st, [packed_tuple])
+
+@timed("add_records")
+def add_records(filename: str, st: struct.Struct, packed_tuples: list, update_indexes=True) -> int:
+    """Append all records as one logged write; returns the slot of the first one.
+
+    The rows are encoded into one buffer, logged to the WAL as a single record
+    and written with one write(); the change is durable once the log is fsynced
+    (group commit, when the table lock is released), and a crash leaves either
+    all of the records or none of them. Bulk loaders pass update_indexes=False;
+    indexes and derived tables (availability, ...) then notice they are stale
+    and rebuild once on their next use."""
+    with table_lock(filename, exclusive=True):
+        ensure_recovered(filename, st)
+        fmt = table_format(filename, st)
+        heap_writer = _heap_writer(fmt)
+        buf = b"".join(fmt.encode(r, heap_writer) for r in packed_tuples)
+        _write_heap(filename, fmt, heap_writer)
+        start = os.path.getsize(filename) if os.path.exists(filename) else 0
+        log_write(filename, start, buf)
+        with open(filename, "ab") as f:
+            f.write(buf)
+        count("bytes_written", len(buf))
+        first_slot = (start - fmt.header_size) // fmt.size
+        if update_indexes:
+            after_write(filename, st, [(first_slot + i, None, r) for i, r in enumerate(packed_tuples)],
+                        appended=len(packed_tuples))
+        else:
+            cache_drop(filename)
+    return first_slot
+
+def record_count(filename: str, st: struct.Struct) -> int:
+    if not os.path.exists(filename):
+        return 0
+    fmt = table_format(filename, st)
+    return max(0, (os.path.getsize(filename) - fmt.header_size) // fmt.size)
+
+def record_offset(fmt, slot: int) -> int:
+    return fmt.header_size + slot * fmt.size
+
+def read_record_at(filename: str, st: struct.Struct, slot: int):
+    with table_lock(filename):
+        cached = _cache_get(filename)
+        if cached is not None:
+            return cached.records.get(slot)
+        return _read_record_at(filename, st, slot)
+
+def _read_record_at(filename: str, st: struct.Struct, slot: int):
     with open(filename, "rb") as f:
+        fmt = table_format(filename, st)
+        f.seek(record_offset(fmt, slot))
+        chunk = f.read(fmt.size)
+        count("records_read")
+        count("bytes_read", len(chunk))
+        if len(chunk) != fmt.size or fmt.raw_field(chunk, 0, 0) == TOMBSTONE:
+            return None
+        return fmt.decode_from(chunk, 0)
+
+def is_tombstone(raw) -> bool:
+    return raw[0] == TOMBSTONE
+
+def iter_records(filename: str, st: struct.Struct):
+    # (slot, raw) for every live record, slot = position in the file; served
+    # from the record cache when it holds the table. Records are read
+    # SCAN_PAGE slots at a time under the lock, which is released before they
+    # are yielded, so a consumer that is slow or stops early does not keep
+    # writers out. Writes can land between pages: callers that need one
+    # consistent pass hold table_lock(filename) around the loop.
+    start = 0
+    while True:
+        with table_lock(filename):
+            cached = _cache_get(filename) if start == 0 else None
+            if cached is not None:
+                page, end = list(cached.records.items()), 0
+            else:
+                page, end = _file_records_page(filename, st, start, start + SCAN_PAGE)
+        yield from page
+        start += SCAN_PAGE
+        if start >= end:
+            return
+
+def _file_records_page(filename: str, st: struct.Struct, start: int, stop: int) -> tuple:
+    # ([(slot, raw)] of the live records in slots [start, stop), slots in the file)
+    with open_table(filename, st) as table:
+        return [(slot, raw) for slot, raw in enumerate(table.iter_raw(start, stop), start)
+                if not is_tombstone(raw)], len(table)
+
+def _iter_file_records(filename: str, st: struct.Struct):
+    with open_table(filename, st) as table:
+        for slot, raw in enumerate(table.iter_raw()):
+            if not is_tombstone(raw):
+                yield slot, raw
+
+@timed("read_raw_records")
+def read_raw_records(filename: str, st: struct.Struct):
+    with table_lock(filename):
+        return list(cached_records(filename, st).values())
+
+@timed("write_raw_records")
+def write_raw_records(filename: str, st: struct.Struct, records, version: int = None):
+    # whole-table rewrite: build a new file next to the old one and swap it in,
+    # so a crash leaves either the old table or the new one, never a truncated
+    # one. version: on-disk format of the new file (default: keep the current)
+    with table_lock(filename, exclusive=True):
+        ensure_recovered(filename, st)
+        checkpoint_table(filename)
+        old = table_format(filename, st)
+        version = version or old.version
+        tmp = filename + ".tmp"
+        heap_file = heap_writer = None
+        if version == 1:
+            fmt = LegacyFormat(st)
+        elif version == 2:
+            generation = old.generation + 1 if old.version == 2 else 1
+            fmt = CompactFormat(st, filename, FORMAT_HEADER.size, generation)
+            heap_file = open(fmt.heap.path, "wb")
+            heap_writer = HeapWriter(0, heap_file)
+        else:
+            raise ValueError(f"ไม่รู้จักรูปแบบไฟล์เวอร์ชัน {version}")
+        try:
+            with open(tmp, "wb") as f:
+                buf = bytearray(fmt.header() if version == 2 else b"")
+                for r in records:
+                    buf += fmt.encode(r, heap_writer)
+                    if len(buf) >= 1 << 20:
+                        f.write(buf)
+                        buf.clear()
+                f.write(buf)
+                f.flush()
+                _fsync(f.fileno())
+            if heap_file is not None:
+                heap_writer.flush()
+                heap_file.flush()
+                _fsync(heap_file.fileno())
+        finally:
+            if heap_file is not None:
+                heap_file.close()
+        mark_data_written(filename)
+        wal_for(filename).reset(-1)  # size unknown until the rename is durable
+        os.replace(tmp, filename)
+        _fsync_dir(filename)
+        wal_for(filename).reset(os.path.getsize(filename))
+        _remove_stale_heaps(filename, fmt.generation if version == 2 else None)
+        count("table_rewrites")
+        count("bytes_written", table_bytes(filename, st))
+        if isinstance(records, list):
+            cache_put(filename, {slot: fmt.canonical(r) for slot, r in enumerate(records)})
+        else:
+            cache_drop(filename)
+        rebuild_derived(filename, st)
+
+@timed("convert_table")
+def convert_table(filename: str, st: struct.Struct, version: int) -> tuple:
+    """Rewrite filename in on-disk format `version`; returns (bytes before, bytes after)."""
+    with table_lock(filename, exclusive=True):
+        ensure_recovered(filename, st)
+        before = table_bytes(filename, st)
+        write_raw_records(filename, st, (raw for _, raw in iter_records(filename, st)), version)
+        return before, table_bytes(filename, st)
+
+def _write_at(filename: str, offset: int, data: bytes):
+    count("bytes_written", len(data))
+    log_write(filename, offset, data)
+    sync_log(filename)
+    with open(filename, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+def write_record_at(filename: str, st: struct.Struct, slot: int, packed_tuple: tuple, expected=None):
+    # overwrite one fixed-size record in place: a single seek + write.
+    # expected = the record the caller last saw there (ValueError if it changed)
+    write_records_at(filename, st, [(slot, packed_tuple)], expected)
+
+@timed("write_records_at")
+def write_records_at(filename: str, st: struct.Struct, updates: list, expected=None) -> int:
+    # many in-place overwrites [(slot, packed_tuple)] in one pass: one lock,
+    # one file handle, one WAL commit; deleted slots are skipped. With
+    # `expected` (single update) the record must still be what the caller saw
+    if not updates:
+        return 0
+    changes = []
+    with table_lock(filename, exclusive=True):
+        ensure_recovered(filename, st)
+        fmt = table_format(filename, st)
+        heap_writer = _heap_writer(fmt)
+        writes = []
+        with open(filename, "r+b") as f:
+            for slot, packed_tuple in sorted(updates, key=lambda u: u[0]):
+                f.seek(record_offset(fmt, slot))
+                chunk = f.read(fmt.size)
+                old = None
+                if len(chunk) == fmt.size and fmt.raw_field(chunk, 0, 0) != TOMBSTONE:
+                    old = fmt.decode_from(chunk, 0)
+                if expected is not None:
+                    check_expected(old, expected)
+                if old is None:
+                    continue
+                if heap_writer is not None:
+                    fmt.remember(heap_writer, chunk)
+                writes.append((record_offset(fmt, slot), fmt.encode(packed_tuple, heap_writer)))
+                changes.append((slot, old, packed_tuple))
+            _write_heap(filename, fmt, heap_writer)
+            for offset, data in writes:
+                log_write(filename, offset, data)
+            sync_log(filename)
+            for offset, data in writes:
+                f.seek(offset)
+                f.write(data)
+            count("bytes_written", sum(len(data) for _, data in writes))
+        if changes:
+            after_write(filename, st, changes)
+    return len(changes)
+
+@timed("delete_record_at")
+def delete_record_at(filename: str, st: struct.Struct, slot: int, expected=None):
+    with table_lock(filename, exclusive=True):
+        ensure_recovered(filename, st)
+        old = read_record_at(filename, st, slot)
+        check_expected(old, expected)
+        if old is None:
+            return
+        _write_at(filename, record_offset(table_format(filename, st), slot), struct.pack("<i", TOMBSTONE))
+        after_write(filename, st, [(slot, old, None)])
+
+@timed("compact_file")
+def compact_file(filename: str, st: struct.Struct) -> int:
+    # rewrite the table without tombstones; returns the number of slots reclaimed
+    with table_lock(filename, exclusive=True):
+        before = record_count(filename, st)
+        live = read_raw_records(filename, st)
+        if len(live) == before:
+            return 0
+        write_raw_records(filename, st, live)
+    return before - len(live)
+
+# ---------------- Write-ahead log ----------------
+# Every change to a data file is first appended to "<file>.wal" as a physical
+# (offset, bytes) record with a CRC, then written to the data file itself
+# without fsync. An in-place overwrite (update, tombstone) waits until its log
+# record is fsynced before it touches the data file (sync_log), so a crash can
+# never leave an overwritten or torn record that recovery cannot redo. Appends
+# need not wait: recovery cuts the file back to the last logged extent. When a
+# thread releases its last table lock, it waits until the rest of its records
+# are fsynced; the first waiter fsyncs for everyone whose records are already
+# in the log (group commit), so concurrent writers share one fsync.
+# A checkpoint fsyncs the data file and empties the log; it runs whenever the
+# log grows past WAL_CHECKPOINT_BYTES, before whole-file rewrites and on exit.
+# The log always starts with a checkpoint record holding the data file size at
+# that point (-1 = unknown); recovery replays the valid records after it and
+# cuts off anything appended beyond the last logged extent.
+WAL_RECORD = struct.Struct("<IBqI")  # crc32, kind, offset, payload length
+WAL_WRITE = 1
+WAL_CHECKPOINT = 2
+WAL_HEAP = 3  # append to the string heap of a compact (version 2) table
+WAL_CHECKPOINT_BYTES = 8 * 1024 * 1024
+WAL_GROUP_COMMIT_WINDOW = 0.0  # seconds the fsync leader waits for more commits
+_wals = {}
+_wals_guard = threading.Lock()
+_recovered = set()
+
+def _wal_record(kind: int, offset: int, payload: bytes = b"") -> bytes:
+    head = WAL_RECORD.pack(0, kind, offset, len(payload))[4:]
+    crc = zlib.crc32(payload, zlib.crc32(head))
+    return struct.pack("<I", crc) + head + payload
+
+def _fsync_dir(filename: str):
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        _fsync(fd)
+    finally:
+        os.close(fd)
+
+class WriteAheadLog:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.path = filename + ".wal"
+        self._cond = threading.Condition()
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+        self._f = None
+        self.fsyncs = 0
+
+    def _file(self):
+        if self._f is None:
+            fresh = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._f = open(self.path, "ab")
+            if fresh:
+                size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+                self._f.write(_wal_record(WAL_CHECKPOINT, size))
+                self._f.flush()
+                _fsync(self._f.fileno())
+        return self._f
+
+    def append(self, offset: int, payload: bytes, kind: int = WAL_WRITE) -> int:
+        # caller holds the table's exclusive lock; returns the record's sequence number
+        f = self._file()
+        f.write(_wal_record(kind, offset, payload))
+        f.flush()
+        with self._cond:
+            self._appended += 1
+            return self._appended
+
+    def commit(self, lsn: int):
+        # block until record `lsn` is on disk, fsyncing on behalf of the group
+        with self._cond:
+            while self._synced < lsn:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                self._cond.release()
+                try:
+                    if WAL_GROUP_COMMIT_WINDOW:
+                        time.sleep(WAL_GROUP_COMMIT_WINDOW)
+                    target = self._appended
+                    _fsync(self._file().fileno())
+                    self.fsyncs += 1
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def reset(self, data_size: int):
+        # caller holds the table's exclusive lock and has made the data durable
+        f = self._file()
+        f.truncate(0)
+        f.write(_wal_record(WAL_CHECKPOINT, data_size))
+        f.flush()
+        _fsync(f.fileno())
+        self.fsyncs += 1
+        with self._cond:
+            self._synced = self._appended
+            self._cond.notify_all()
+
+    def records(self):
+        # (kind, offset, payload) of every intact record, stopping at a torn one
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                head = f.read(WAL_RECORD.size)
+                if len(head) != WAL_RECORD.size:
+                    return
+                crc, kind, offset, length = WAL_RECORD.unpack(head)
+                payload = f.read(length)
+                if len(payload) != length or zlib.crc32(payload, zlib.crc32(head[4:])) != crc:
+                    return
+                yield kind, offset, payload
+
+def wal_for(filename: str) -> WriteAheadLog:
+    key = os.path.abspath(filename)
+    with _wals_guard:
+        wal = _wals.get(key)
+        if wal is None:
+            wal = _wals[key] = WriteAheadLog(filename)
+        return wal
+
+def log_write(filename: str, offset: int, data: bytes, kind: int = WAL_WRITE):
+    # log a data-file (or heap) write; the commit happens when the table lock is
+    # released, or earlier through sync_log()
+    mark_data_written(filename)
+    wal = wal_for(filename)
+    lsn = wal.append(offset, bytes(data), kind)
+    count("wal_bytes", len(data))
+    commits = _lock_state.__dict__.setdefault("commits", {})
+    commits[wal] = lsn
+
+def sync_log(filename: str):
+    # make this thread's log records for filename durable now: an in-place
+    # overwrite must not reach the data file before the record that redoes it
+    wal = wal_for(filename)
+    lsn = getattr(_lock_state, "commits", {}).get(wal)
+    if lsn is not None:
+        wal.commit(lsn)
+
+def _flush_commits():
+    commits = getattr(_lock_state, "commits", None)
+    if not commits:
+        return
+    _lock_state.commits = {}
+    for wal, lsn in commits.items():
+        wal.commit(lsn)
+        if wal.size() > WAL_CHECKPOINT_BYTES:
+            checkpoint_table(wal.filename)
+
+def _fsync_file(path: str):
+    if os.path.exists(path):
+        with open(path, "r+b") as f:
+            _fsync(f.fileno())
+
+def _heap_of(filename: str):
+    header = read_format_header(filename)
+    return heap_path(filename, header[3]) if header else None
+
+@timed("checkpoint_table")
+def checkpoint_table(filename: str):
+    with table_lock(filename, exclusive=True):
+        wal = wal_for(filename)
+        heap = _heap_of(filename)
+        if heap:
+            _fsync_file(heap)
+        _fsync_file(filename)
+        wal.reset(os.path.getsize(filename) if os.path.exists(filename) else 0)
+
+def checkpoint_all():
+    for filename, _ in TABLES:
+        if os.path.exists(filename + ".wal"):
+            checkpoint_table(filename)
+
+def close_wals():
+    # drop open logs and recovery state, e.g. before switching to another data folder
+    with _wals_guard:
+        for wal in _wals.values():
+            if wal._f is not None:
+                wal._f.close()
+        _wals.clear()
+    _recovered.clear()
+
+@timed("recover_table")
+def recover_table(filename: str, st: struct.Struct) -> int:
+    """Replay the WAL into the data file after a crash; returns records replayed."""
+    with table_lock(filename, exclusive=True):
+        wal = wal_for(filename)
+        valid_size, replayed = None, 0
+        if os.path.exists(filename) or os.path.exists(wal.path):
+            with open(filename, "ab"):
+                pass
+            heap = _heap_of(filename)
+            with open(filename, "r+b") as f:
+                for kind, offset, payload in wal.records():
+                    if kind == WAL_CHECKPOINT:
+                        valid_size = offset if offset >= 0 else None
+                        continue
+                    if not replayed:
+                        mark_data_written(filename)
+                    replayed += 1
+                    if kind == WAL_HEAP:
+                        if heap:
+                            with open(heap, "ab"):
+                                pass
+                            with open(heap, "r+b") as h:
+                                h.seek(offset)
+                                h.write(payload)
+                        continue
+                    f.seek(offset)
+                    f.write(payload)
+                    if valid_size is not None:
+                        valid_size = max(valid_size, offset + len(payload))
+                size = f.seek(0, os.SEEK_END)
+                if valid_size is not None and size > valid_size:
+                    mark_data_written(filename)
+                    f.truncate(valid_size)  # append that never made it into the log
+                    size = valid_size
+                fmt = table_format(filename, st)
+                torn = max(0, size - fmt.header_size) % fmt.size
+                if torn:
+                    mark_data_written(filename)
+                    f.truncate(size - torn)  # torn partial record
+                f.flush()
+                _fsync(f.fileno())
+            if heap:
+                _fsync_file(heap)
+            wal.reset(os.path.getsize(filename))
+            if replayed:
+                cache_drop(filename)
+                rebuild_derived(filename, st)
+        _recover_archive(filename)
+        _recovered.add(os.path.abspath(filename))
+    return replayed
+
+def ensure_recovered(filename: str, st: struct.Struct):
+    if os.path.abspath(filename) not in _recovered:
+        recover_table(filename, st)
+
+# ---------------- Record cache ----------------
+# Decoded tables are kept in memory so that a menu session which lists a table
+# and then looks records up in it decodes the file once. Entries are evicted
+# least recently used first once RECORD_CACHE_BYTES is exceeded. An entry is
+# valid while the table's generation (see Locking) and the data file's size,
+# mtime and inode are what they were when it was stored; writes made by this
+# process update the entry in place instead (after_write, write_raw_records).
+# Only whole-table reads (read_raw_records) fill the cache; lookups use it
+# when it is there and the indexes otherwise. Cached tuples are shared: callers
+# must not mutate what they get back.
+RECORD_CACHE_BYTES = 64 * 1024 * 1024
+RECORD_CACHE_OVERHEAD = 200  # bytes per record for the dicts that hold it
+
+class CacheEntry:
+    __slots__ = ("stamp", "records", "nbytes", "_by_key")
+
+    def __init__(self, stamp: tuple, records: dict):
+        self.stamp = stamp
+        self.records = records  # slot -> raw, in slot order
+        self._by_key = None
+        self.nbytes = 0
+        if records:
+            sample = next(iter(records.values()))
+            per_record = sys.getsizeof(sample) + sum(sys.getsizeof(v) for v in sample)
+            self.nbytes = len(records) * (per_record + RECORD_CACHE_OVERHEAD)
+
+    def by_key(self) -> dict:
+        # first field (the id) -> raw, built on first use
+        if self._by_key is None:
+            by_key = {}
+            for raw in self.records.values():
+                by_key.setdefault(raw[0], raw)
+            self._by_key = by_key
+        return self._by_key
+
+    def apply(self, slot: int, old, new):
+        if new is None:
+            self.records.pop(slot, None)
+        else:
+            self.records[slot] = new
+        if self._by_key is not None:
+            if old is not None and self._by_key.get(old[0]) == old:
+                del self._by_key[old[0]]
+            if new is not None:
+                self._by_key.setdefault(new[0], new)
+
+_cache = collections.OrderedDict()  # abspath -> CacheEntry
+_cache_guard = threading.Lock()
+
+def _file_stamp(filename: str):
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_dev, stat.st_size, stat.st_mtime_ns
+
+def _cache_get(filename: str, written: bool = False):
+    # the valid entry of filename or None; caller holds the table lock.
+    # written: the caller has just changed the file itself (its stat differs)
+    key = os.path.abspath(filename)
+    with _cache_guard:
+        entry = _cache.get(key)
+    if entry is None:
+        return None
+    before, current = table_generation(filename)
+    generation, file_stamp = entry.stamp
+    # within an exclusive section the entry is still current until a write
+    # that was not applied to it (those drop it)
+    if generation not in (current, before) or (not written and file_stamp != _file_stamp(filename)):
+        cache_drop(filename)
+        return None
+    with _cache_guard:
+        if key in _cache:
+            _cache.move_to_end(key)
+    count("cache_hits")
+    return entry
+
+def cache_put(filename: str, records: dict):
+    # store records (slot -> raw) as the current content of filename; caller holds the lock
+    entry = CacheEntry((table_generation(filename)[1], _file_stamp(filename)), records)
+    key = os.path.abspath(filename)
+    with _cache_guard:
+        _cache.pop(key, None)
+        if entry.nbytes > RECORD_CACHE_BYTES:
+            return
+        _cache[key] = entry
+        total = sum(e.nbytes for e in _cache.values())
+        while total > RECORD_CACHE_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            total -= evicted.nbytes
+
+def cache_drop(filename: str = None):
+    # forget one table, or every table
+    with _cache_guard:
+        if filename is None:
+            _cache.clear()
+        else:
+            _cache.pop(os.path.abspath(filename), None)
+
+def cache_apply(filename: str, st: struct.Struct, changes: list):
+    # carry a write made under this thread's exclusive lock into the entry
+    entry = _cache_get(filename, written=True)
+    if entry is None:
+        return
+    fmt = table_format(filename, st)
+    for slot, old, new in changes:
+        entry.apply(slot, old, fmt.canonical(new) if new is not None else None)
+    entry.stamp = (table_generation(filename)[1], _file_stamp(filename))
+
+def cached_records(filename: str, st: struct.Struct) -> dict:
+    """{slot: raw} of the live records of filename, decoded once per change."""
+    with table_lock(filename):
+        entry = _cache_get(filename)
+        if entry is not None:
+            return entry.records
+        count("cache_misses")
+        records = dict(_iter_file_records(filename, st))
+        if table_generation(filename)[0] is None:
+            # not stored from inside a write: the caller may be about to change the file
+            cache_put(filename, records)
+        return records
+
+def record_map(filename: str, st: struct.Struct) -> dict:
+    """{id: raw} of the live records of filename (first field as the key)."""
+    with table_lock(filename):
+        records = cached_records(filename, st)
+        entry = _cache_get(filename)
+        if entry is not None and entry.records is records:
+            return entry.by_key()
+        by_key = {}
+        for raw in records.values():
+            by_key.setdefault(raw[0], raw)
+        return by_key
+
+def cache_info() -> dict:
+    with _cache_guard:
+        return {"tables": len(_cache), "bytes": sum(e.nbytes for e in _cache.values()),
+                "limit": RECORD_CACHE_BYTES}
+
+# ---------------- Memory-mapped table reader ----------------
+# TableReader maps a data file read-only and behaves like a sequence of
+# RecordView objects indexed by slot. A RecordView only unpacks/decodes the
+# fields that are actually accessed, straight out of the mapping (through the
+# table's format, so compact files read the same way).
+_FIELD_LAYOUTS = {}
+
+def field_layout(st: struct.Struct) -> list:
+    # [(offset, single-field Struct, is_string), ...] for every field of st
+    layout = _FIELD_LAYOUTS.get(st)
+    if layout is None:
+        layout, offset = [], 0
+        for repeat, code in re.findall(r"(\d*)([a-zA-Z?])", st.format.lstrip("<>!=@")):
+            if code == "x":
+                offset += int(repeat or 1)
+                continue
+            fields = [repeat + code] if code in "sp" else [code] * int(repeat or 1)
+            for f in fields:
+                fst = struct.Struct("<" + f)
+                layout.append((offset, fst, code in "sp"))
+                offset += fst.size
+        _FIELD_LAYOUTS[st] = layout
+    return layout
+
+class RecordView:
+    __slots__ = ("_table", "_offset", "slot")
+
+    def __init__(self, table, slot: int):
+        self._table = table
+        self._offset = record_offset(table.fmt, slot)
+        self.slot = slot
+
+    def __getitem__(self, i: int):
+        value = self._table.fmt.raw_field(self._table.buf, self._offset, i)
+        return unpack_str(value) if isinstance(value, bytes) else value
+
+    def __len__(self):
+        return len(self._table.layout)
+
+    @property
+    def deleted(self) -> bool:
+        return self.raw_field(0) == TOMBSTONE
+
+    def raw_field(self, i: int):
+        return self._table.fmt.raw_field(self._table.buf, self._offset, i)
+
+    def raw(self) -> tuple:
+        return self._table.fmt.decode_from(self._table.buf, self._offset)
+
+    def decode(self) -> tuple:
+        return decode_record(self.raw())
+
+class TableReader:
+    # holds the table's shared lock until close()
+    def __init__(self, filename: str, st: struct.Struct):
+        self.st = st
+        self.layout = field_layout(st)
+        self.buf = b""
+        self._mm = None
+        self._count = 0
+        self._lock = table_lock(filename)
+        self._lock.__enter__()
+        self.fmt = fmt = table_format(filename, st)
+        if os.path.exists(filename) and os.path.getsize(filename) >= fmt.header_size + fmt.size:
+            with open(filename, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buf = self._mm
+            self._count = (len(self._mm) - fmt.header_size) // fmt.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, slot: int) -> RecordView:
+        if slot < 0:
+            slot += self._count
+        if not 0 <= slot < self._count:
+            raise IndexError(slot)
+        return RecordView(self, slot)
+
+    def __iter__(self):
+        # live records only
+        count("records_scanned", self._count)
+        count("bytes_read", self._count * self.fmt.size)
+        for slot in range(self._count):
+            view = RecordView(self, slot)
+            if not view.deleted:
+                yield view
+
+    def iter_raw(self, start: int = 0, stop: int = None):
+        # every slot in [start, stop) (tombstones included) as a raw tuple, no
+        # per-record read()
+        stop = self._count if stop is None else min(stop, self._count)
+        if start >= stop:
+            return
+        offset = self.fmt.header_size + start * self.fmt.size
+        mv = memoryview(self._mm)[offset:offset + (stop - start) * self.fmt.size]
+        try:
+            if METRICS_ENABLED:
+                yield from _measured_decode(self.fmt.iter_decode(mv), self.fmt.size)
+            else:
+                yield from self.fmt.iter_decode(mv)
+        finally:
+            mv.release()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            self.buf = b""
+            self._count = 0
+        if self._lock is not None:
+            self._lock.__exit__(None, None, None)
+            self._lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _measured_decode(rows, size: int):
+    # iter_decode() with metrics on: the time spent producing rows is decode time
+    scanned, spent = 0, 0.0
+    rows = iter(rows)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            spent += time.perf_counter() - started
+            scanned += 1
+            yield row
+    finally:
+        count("records_scanned", scanned)
+        count("bytes_read", scanned * size)
+        count("decode_seconds", spent)
+
+def open_table(filename: str, st: struct.Struct) -> TableReader:
+    return TableReader(filename, st)
+
+# ---------------- Indexes ----------------
+# Every index of a data file is a sidecar "<file>.<name>.idx":
+#   header : magic, number of sorted entries, number of data records covered,
+#            data generation of the table it matches (see Locking)
+#   body   : (key, slot) pairs sorted by key; slot = position of the record in the file
+#   tail   : (op, key, slot) appended since the last merge, op = +1 add / -1 remove
+# Lookups binary-search the body with seeks and then replay the (short) tail.
+# Keys need not be unique: borrows are indexed by member_id and by book_id,
+# and a record can have many keys (the "text" indexes hold one key per token).
+INDEX_MAGIC = b"LIX2"
+INDEX_HEADER = struct.Struct("<4sqqq")
+INDEX_ENTRY = struct.Struct("<qi")
+INDEX_TAIL_ENTRY = struct.Struct("<bqi")
+INDEX_MERGE_THRESHOLD = 4096
+INDEX_SORT_CHUNK = 1_000_000  # entries sorted in memory before spilling a run
+INDEX_READ_CHUNK = 65536  # entries per read when streaming an index body
+INDEX_WALK_CHUNK = 4096  # entries per read when a caller may stop early
+
+def _first_field_key(raw):
+    return (raw[0],)
+
+def _second_field_key(raw):
+    return (raw[1],)
+
+def _due_day_key(raw):
+    # only active loans are in the due-date index
+    if not is_active_borrow(unpack_str(raw[5])):
+        return ()
+    try:
+        return (day_number(unpack_str(raw[3])),)
+    except ValueError:
+        return ()
+
+def _active_member_key(raw):
+    # only active loans are in the active-loans index, keyed by member_id
+    return (raw[0],) if is_active_borrow(unpack_str(raw[5])) else ()
+
+# Full-text keys. Text is NFKC-normalized and lower-cased, then split into
+# Thai runs and other words. Thai has no spaces between words, so a Thai run
+# is indexed by its character trigrams (a query matches anywhere inside a
+# word); other words are indexed by their prefixes of 2..TEXT_PREFIX_MAX
+# characters (a query matches the start of a word). Tokens are hashed to
+# 64-bit keys; search verifies candidates against the record text, so hash
+# collisions and over-long prefixes only cost an extra record read.
+TEXT_NGRAM = 3
+TEXT_PREFIX_MIN = 2
+TEXT_PREFIX_MAX = 10
+TEXT_TOKEN_RE = re.compile(r"([\u0e00-\u0e7f]+)|([^\W_]+)")
+BOOK_TEXT_FIELDS = (1, 2, 3, 5)  # title, author, publisher, category
+MEMBER_TEXT_FIELDS = (1, 6)  # name, email
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+def text_terms(text: str) -> list:
+    # [(is_thai, term)] in order of appearance
+    return [(bool(thai), thai or word) for thai, word in TEXT_TOKEN_RE.findall(normalize_text(text))]
+
+def _token_key(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+def term_tokens(is_thai: bool, term: str, query=False) -> set:
+    # a query term needs only its longest prefix: shorter ones are implied
+    if is_thai:
+        return {"t:" + term[i:i + TEXT_NGRAM] for i in range(len(term) - TEXT_NGRAM + 1)}
+    if len(term) < TEXT_PREFIX_MIN:
+        return set()
+    if query:
+        return {"w:" + term[:TEXT_PREFIX_MAX]}
+    return {"w:" + term[:n] for n in range(TEXT_PREFIX_MIN, min(len(term), TEXT_PREFIX_MAX) + 1)}
+
+def _record_text(raw, fields) -> str:
+    return " ".join(unpack_str(raw[i]) for i in fields)
+
+def _text_keys(fields):
+    def key_fn(raw):
+        tokens = set()
+        for is_thai, term in text_terms(_record_text(raw, fields)):
+            tokens |= term_tokens(is_thai, term)
+        return {_token_key(token) for token in tokens}
+    return key_fn
+
+# Query keys (see Queries): numbers are their own key, dates are day numbers
+# and short text fields get one equality key, the hash of the normalized value.
+def _int_field_keys(i: int):
+    def key_fn(raw):
+        return (raw[i],)
+    return key_fn
+
+def _day_field_keys(i: int):
+    def key_fn(raw):
+        try:
+            return (day_number(unpack_str(raw[i])),)
+        except ValueError:
+            return ()
+    return key_fn
+
+def value_key(value: str) -> int:
+    return _token_key("v:" + normalize_text(value).strip())
+
+def _value_field_keys(i: int):
+    def key_fn(raw):
+        return (value_key(unpack_str(raw[i])),)
+    return key_fn
+
+# struct -> {index name: function(raw) -> keys of that record}
+TABLE_INDEXES = {
+    BOOK_STRUCT: {"id": _first_field_key, "text": _text_keys(BOOK_TEXT_FIELDS), "year": _int_field_keys(4),
+                  "category": _value_field_keys(5), "language": _value_field_keys(6), "shelf": _value_field_keys(7)},
+    MEMBER_STRUCT: {"id": _first_field_key, "text": _text_keys(MEMBER_TEXT_FIELDS),
+                    "birth": _day_field_keys(2), "reg": _day_field_keys(7)},
+    BORROW_STRUCT: {"member": _first_field_key, "book": _second_field_key, "due": _due_day_key,
+                    "active": _active_member_key},
+}
+
+def index_path(filename: str, name: str) -> str:
+    return f"{filename}.{name}.idx"
+
+def _read_index_header(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        head = f.read(INDEX_HEADER.size)
+    if len(head) != INDEX_HEADER.size:
+        return None
+    magic, body_count, covers, stamp = INDEX_HEADER.unpack(head)
+    if magic != INDEX_MAGIC:
+        return None
+    return body_count, covers, stamp
+
+def _write_index(path: str, entries: list, covers: int, stamp: int):
+    entries.sort()
+    _write_sorted_index(path, entries, covers, stamp)
+
+def _write_sorted_index(path: str, entries, covers: int, stamp: int):
+    # entries: (key, slot) pairs in sorted order, streamed; duplicates are dropped
+    tmp = path + ".tmp"
+    written, prev = 0, None
+    with open(tmp, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, 0, covers, stamp))
+        buf = bytearray()
+        for entry in entries:
+            if entry == prev:
+                continue
+            prev = entry
+            buf += INDEX_ENTRY.pack(*entry)
+            written += 1
+            if len(buf) >= INDEX_READ_CHUNK * INDEX_ENTRY.size:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
+        f.seek(0)
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, written, covers, stamp))
+    os.replace(tmp, path)
+
+def _spill_index_run(entries: list):
+    entries.sort()
+    run = tempfile.TemporaryFile()
+    run.write(b"".join(INDEX_ENTRY.pack(*e) for e in entries))
+    run.seek(0)
+    return run
+
+def _iter_index_run(run):
+    while True:
+        chunk = run.read(INDEX_READ_CHUNK * INDEX_ENTRY.size)
+        if not chunk:
+            return
+        yield from INDEX_ENTRY.iter_unpack(chunk)
+
+def _iter_index_body(f, body_count: int):
+    f.seek(INDEX_HEADER.size)
+    left = body_count
+    while left:
+        n = min(left, INDEX_READ_CHUNK)
+        yield from INDEX_ENTRY.iter_unpack(f.read(n * INDEX_ENTRY.size))
+        left -= n
+
+def _read_index_tail(f, body_count: int):
+    f.seek(INDEX_HEADER.size + body_count * INDEX_ENTRY.size)
+    data = f.read()
+    usable = len(data) - len(data) % INDEX_TAIL_ENTRY.size
+    return list(INDEX_TAIL_ENTRY.iter_unpack(data[:usable]))
+
+def _index_entries(path: str):
+    # all live (key, slot) pairs, body merged with tail
+    body_count = _read_index_header(path)[0]
+    with open(path, "rb") as f:
+        f.seek(INDEX_HEADER.size)
+        body = f.read(body_count * INDEX_ENTRY.size)
+        entries = set(INDEX_ENTRY.iter_unpack(body))
+        for op, key, slot in _read_index_tail(f, body_count):
+            if op > 0:
+                entries.add((key, slot))
+            else:
+                entries.discard((key, slot))
+    return list(entries)
+
+@timed("rebuild_indexes")
+def rebuild_indexes(filename: str, st: struct.Struct):
+    # one pass over the table; big indexes are sorted in runs on disk and merged
+    indexes = TABLE_INDEXES.get(st)
+    if not indexes:
+        return
+    entries = {name: [] for name in indexes}
+    runs = {name: [] for name in indexes}
+    with table_lock(filename, exclusive=True):
+        try:
+            for slot, raw in iter_records(filename, st):
+                for name, key_fn in indexes.items():
+                    pending = entries[name]
+                    pending.extend((key, slot) for key in key_fn(raw))
+                    if len(pending) >= INDEX_SORT_CHUNK:
+                        runs[name].append(_spill_index_run(pending))
+                        entries[name] = []
+            covers = record_count(filename, st)
+            stamp = data_generation(filename)[1]
+            for name in indexes:
+                pending = entries[name]
+                pending.sort()
+                merged = heapq.merge(pending, *(_iter_index_run(run) for run in runs[name]))
+                _write_sorted_index(index_path(filename, name), merged, covers, stamp)
+        finally:
+            for name_runs in runs.values():
+                for run in name_runs:
+                    run.close()
+
+def ensure_indexes(filename: str, st: struct.Struct):
+    # an index is stale when it is missing, covers a different number of
+    # records or was built from an older data generation
+    indexes = TABLE_INDEXES.get(st)
+    if not indexes:
+        return
+    with table_lock(filename):
+        if not _indexes_stale(filename, st, indexes):
+            return
+    with table_lock(filename, exclusive=True):
+        if _indexes_stale(filename, st, indexes):
+            rebuild_indexes(filename, st)
+
+def _indexes_stale(filename: str, st: struct.Struct, indexes: dict) -> bool:
+    covers = record_count(filename, st)
+    stamp = data_generation(filename)[1]
+    for name in indexes:
+        header = _read_index_header(index_path(filename, name))
+        if header is None or header[1:] != (covers, stamp):
+            return True
+    return False
+
+def _append_index_ops(filename: str, name: str, ops: list, covers: int, stamp: int):
+    path = index_path(filename, name)
+    with open(path, "r+b") as f:
+        body_count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))[1]
+        f.seek(0, os.SEEK_END)
+        f.write(b"".join(INDEX_TAIL_ENTRY.pack(*op) for op in ops))
+        tail_len = (f.tell() - INDEX_HEADER.size - body_count * INDEX_ENTRY.size) // INDEX_TAIL_ENTRY.size
+        f.seek(0)
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, body_count, covers, stamp))
+    if tail_len > INDEX_MERGE_THRESHOLD:
+        _merge_index_tail(path, covers, stamp)
+
+def _merge_index_tail(path: str, covers: int, stamp: int):
+    # fold the tail into the sorted body, streaming the body
+    body_count = _read_index_header(path)[0]
+    with open(path, "rb") as f:
+        final = {}
+        for op, key, slot in _read_index_tail(f, body_count):
+            final[(key, slot)] = op
+        removed = {entry for entry, op in final.items() if op < 0}
+        added = sorted(entry for entry, op in final.items() if op > 0)
+        body = (e for e in _iter_index_body(f, body_count) if e not in removed)
+        _write_sorted_index(path, heapq.merge(body, added), covers, stamp)
+
+def index_apply(filename: str, st: struct.Struct, changes: list, appended: int = 0):
+    # changes: [(slot, old raw or None, new raw or None)], the last `appended`
+    # slots of the file were just added
+    indexes = TABLE_INDEXES.get(st)
+    if not indexes:
+        return
+    covers = record_count(filename, st)
+    expected = covers - appended
+    # in sync before this change: built from the data as this section found
+    # it, or already updated by an earlier write of this section
+    started, stamp = data_generation(filename)
+    headers = {}
+    for name in indexes:
+        headers[name] = header = _read_index_header(index_path(filename, name))
+        if header is None or header[1] != expected or header[2] not in (started, stamp):
+            # index was not in sync before this change: a rebuild includes it anyway
+            rebuild_indexes(filename, st)
+            return
+    for name, key_fn in indexes.items():
+        ops = []
+        for slot, old_raw, new_raw in changes:
+            old_keys = set(key_fn(old_raw)) if old_raw is not None else set()
+            new_keys = set(key_fn(new_raw)) if new_raw is not None else set()
+            ops += [(-1, key, slot) for key in sorted(old_keys - new_keys)]
+            ops += [(1, key, slot) for key in sorted(new_keys - old_keys)]
+        if ops or covers != expected or headers[name][2] != stamp:
+            _append_index_ops(filename, name, ops, covers, stamp)
+
+def _index_bound(f, body_count: int, key: int) -> int:
+    # position of the first body entry with a key >= key
+    lo, hi = 0, body_count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(INDEX_HEADER.size + mid * INDEX_ENTRY.size)
+        mid_key = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))[0]
+        if mid_key < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _index_body_lookup(f, body_count: int, key: int):
+    lo = _index_bound(f, body_count, key)
+    hi = _index_bound(f, body_count, key + 1)
+    f.seek(INDEX_HEADER.size + lo * INDEX_ENTRY.size)
+    return [slot for _, slot in INDEX_ENTRY.iter_unpack(f.read((hi - lo) * INDEX_ENTRY.size))]
+
+def index_lookup(filename: str, st: struct.Struct, name: str, key: int) -> list:
+    ensure_indexes(filename, st)
+    with table_lock(filename):
+        path = index_path(filename, name)
+        if not os.path.exists(path):
+            return []
+        return _index_lookup(path, key)
+
+def _index_lookup(path: str, key: int) -> list:
+    body_count = _read_index_header(path)[0]
+    with open(path, "rb") as f:
+        slots = set(_index_body_lookup(f, body_count, key))
+        for op, k, slot in _read_index_tail(f, body_count):
+            if k != key:
+                continue
+            if op > 0:
+                slots.add(slot)
+            else:
+                slots.discard(slot)
+    return sorted(slots)
+
+def index_range(filename: str, st: struct.Struct, name: str, lo: int, hi: int) -> list:
+    # sorted [(key, slot)] with lo <= key < hi: two binary searches plus one read
+    ensure_indexes(filename, st)
+    with table_lock(filename):
+        path = index_path(filename, name)
+        if not os.path.exists(path):
+            return []
+        body_count = _read_index_header(path)[0]
+        with open(path, "rb") as f:
+            start = _index_bound(f, body_count, lo)
+            end = _index_bound(f, body_count, hi)
+            f.seek(INDEX_HEADER.size + start * INDEX_ENTRY.size)
+            entries = set(INDEX_ENTRY.iter_unpack(f.read((end - start) * INDEX_ENTRY.size)))
+            for op, key, slot in _read_index_tail(f, body_count):
+                if lo <= key < hi:
+                    if op > 0:
+                        entries.add((key, slot))
+                    else:
+                        entries.discard((key, slot))
+    return sorted(entries)
+
+def iter_index_range(path: str, lo: int, hi: int, after=None):
+    # (key, slot) with lo <= key < hi and, if given, > after, in order; the
+    # body is read a chunk at a time as the caller consumes the entries, so a
+    # caller that stops early reads little. Call with the table lock held.
+    body_count = _read_index_header(path)[0]
+    with open(path, "rb") as f:
+        final = {}
+        for op, key, slot in _read_index_tail(f, body_count):
+            if lo <= key < hi:
+                final[(key, slot)] = op
+        removed = {entry for entry, op in final.items() if op < 0}
+        added = sorted(entry for entry, op in final.items() if op > 0)
+        start = _index_bound(f, body_count, lo if after is None else max(lo, after[0]))
+        end = _index_bound(f, body_count, hi)
+
+        def body():
+            pos = start
+            while pos < end:
+                n = min(end - pos, INDEX_WALK_CHUNK)
+                f.seek(INDEX_HEADER.size + pos * INDEX_ENTRY.size)
+                yield from INDEX_ENTRY.iter_unpack(f.read(n * INDEX_ENTRY.size))
+                pos += n
+
+        prev = None
+        for entry in heapq.merge((e for e in body() if e not in removed), added):
+            if entry == prev or (after is not None and entry <= after):
+                continue
+            prev = entry
+            yield entry
+
+def index_estimate(path: str, lo: int, hi: int) -> int:
+    # body entries with lo <= key < hi (the short tail is left out)
+    body_count = _read_index_header(path)[0]
+    with open(path, "rb") as f:
+        return _index_bound(f, body_count, hi) - _index_bound(f, body_count, lo)
+
+def index_keys(filename: str, st: struct.Struct, name: str = "id") -> set:
+    ensure_indexes(filename, st)
+    with table_lock(filename):
+        path = index_path(filename, name)
+        if not os.path.exists(path):
+            return set()
+        return {key for key, _ in _index_entries(path)}
+
+def find_slot(filename: str, st: struct.Struct, key: int):
+    slots = index_lookup(filename, st, "id", key)
+    return slots[0] if slots else None
+
+@timed("find_record")
+def find_record(filename: str, st: struct.Struct, key: int):
+    with table_lock(filename):
+        cached = _cache_get(filename)
+        if cached is not None:
+            return cached.by_key().get(key)
+    slot = find_slot(filename, st, key)
+    if slot is None:
+        return None
+    return read_record_at(filename, st, slot)
+
+@timed("find_records")
+def find_records(filename: str, st: struct.Struct, name: str, key: int) -> list:
+    # [(slot, raw)] of every record whose `name` index key is `key`
+    records = []
+    for slot in index_lookup(filename, st, name, key):
+        raw = read_record_at(filename, st, slot)
+        if raw is not None:
+            records.append((slot, raw))
+    return records
+
+# the loans still in the hot file, with their slots; archived loans have no
+# slot and are read through query_loans()
+@timed("member_borrows")
+def member_borrows(member_id: int) -> list:
+    return find_records(BORROW_FILE, BORROW_STRUCT, "member", member_id)
+
+@timed("book_borrows")
+def book_borrows(book_id: int) -> list:
+    return find_records(BORROW_FILE, BORROW_STRUCT, "book", book_id)
+
+# ---------------- Full-text search ----------------
+# All query terms must match: a Thai term anywhere in the text, any other term
+# at the start of a word. Candidates come from intersecting the posting lists
+# of the "text" index (rarest first); each candidate is then checked against
+# the decoded fields. Terms too short to have a token (one Latin letter, fewer
+# than three Thai characters) are only checked; a query made only of those
+# falls back to scanning the table.
+def _text_matches(terms: list, text: str) -> bool:
+    words = None
+    for is_thai, term in terms:
+        if is_thai:
+            if term not in text:
+                return False
+        else:
+            if words is None:
+                words = [w for thai, w in TEXT_TOKEN_RE.findall(text) if w]
+            if not any(w.startswith(term) for w in words):
+                return False
+    return True
+
+@timed("search_records")
+def search_records(filename: str, st: struct.Struct, fields, query: str, limit=None) -> list:
+    """[(slot, raw)] of the records whose `fields` match every term of query."""
+    terms = text_terms(query)
+    if not terms:
+        return []
+    keys = set()
+    for is_thai, term in terms:
+        keys |= {_token_key(token) for token in term_tokens(is_thai, term, query=True)}
+    results = []
+    if keys:
+        ensure_indexes(filename, st)
+    with table_lock(filename):
+        if keys:
+            path = index_path(filename, "text")
+            postings = sorted((_index_lookup(path, key) for key in keys), key=len)
+            candidates = set(postings[0])
+            for slots in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(slots)
+            candidates = sorted(candidates)
+        else:
+            candidates = range(record_count(filename, st))
+        with open_table(filename, st) as table:
+            for slot in candidates:
+                view = table[slot]
+                if view.deleted:
+                    continue
+                text = normalize_text(" ".join(view[i] for i in fields))
+                if _text_matches(terms, text):
+                    results.append((slot, view.raw()))
+                    if limit is not None and len(results) >= limit:
+                        break
+    return results
+
+def search_books(query: str, limit=None) -> list:
+    return search_records(BOOK_FILE, BOOK_STRUCT, BOOK_TEXT_FIELDS, query, limit)
+
+def search_members(query: str, limit=None) -> list:
+    return search_records(MEMBER_FILE, MEMBER_STRUCT, MEMBER_TEXT_FIELDS, query, limit)
+
+# ---------------- Queries ----------------
+# query_records() filters on indexed columns, sorts by a number or date column
+# and returns one page at a time. A predicate is {column: value}, or for
+# numbers and dates {column: (low, high)}, inclusive, None = open end; text
+# columns match the whole value, ignoring case. Pages are keyset based: the
+# cursor is the (sort key, slot) of the last row and the next page starts
+# right after it in the sort index, so a later page costs the same as the
+# first and rows written between pages do not shift the pages.
+# Plan: walk the sort index and check each record against the predicates,
+# stopping after one page; if another predicate's index range is smaller and
+# at most QUERY_SORT_MAX entries, read all of its records and sort those.
+QUERY_PAGE = 20
+QUERY_SORT_MAX = 10_000
+KEY_MIN, KEY_MAX = -2**63, 2**63 - 1
+
+# struct -> {column: (index name, kind)}; only "int" and "date" columns sort
+QUERY_COLUMNS = {
+    BOOK_STRUCT: {"book_id": ("id", "int"), "year_pub": ("year", "int"), "category": ("category", "text"),
+                  "language": ("language", "text"), "shelf_no": ("shelf", "text")},
+    MEMBER_STRUCT: {"member_id": ("id", "int"), "birth_date": ("birth", "date"), "reg_date": ("reg", "date")},
+}
+
+def _query_key(kind: str, value) -> int:
+    if kind == "date":
+        return day_number(parse_date(str(value)))
+    return parse_int(str(value))
+
+def _query_predicate(st: struct.Struct, column: str, value) -> tuple:
+    # (index name, lo, hi, check): index keys lo <= key < hi, check(raw) confirms a record
+    columns = QUERY_COLUMNS[st]
+    if column not in columns:
+        raise ValueError(f"{column}: ค้นหาด้วยคอลัมน์นี้ไม่ได้ (ได้แก่ {', '.join(columns)})")
+    name, kind = columns[column]
+    if kind == "text":
+        if isinstance(value, (tuple, list)):
+            raise ValueError(f"{column}: ใช้ได้เฉพาะค่าที่ตรงกันทั้งหมด")
+        i = [c[0] for c in TABLE_COLUMNS[st]].index(column)
+        wanted = normalize_text(str(value)).strip()
+        key = value_key(str(value))
+        return name, key, key + 1, lambda raw: normalize_text(unpack_str(raw[i])).strip() == wanted
+    low, high = value if isinstance(value, (tuple, list)) else (value, value)
+    try:
+        lo = KEY_MIN if low is None else _query_key(kind, low)
+        hi = KEY_MAX if high is None else _query_key(kind, high) + 1
+    except ValueError as e:
+        raise ValueError(f"{column}: {str(e).strip()}") from None
+    key_fn = TABLE_INDEXES[st][name]
+    return name, lo, hi, lambda raw: any(lo <= key < hi for key in key_fn(raw))
+
+@timed("query_records")
+def query_records(filename: str, st: struct.Struct, where: dict = None, order_by: str = None,
+                  after=None, limit: int = QUERY_PAGE) -> tuple:
+    """One page of the records matching every predicate of `where`, sorted by order_by.
+
+    Returns ([(slot, raw)], cursor); pass the cursor back as `after` for the
+    next page. The cursor is None on the last page."""
+    columns = QUERY_COLUMNS[st]
+    order_by = order_by or TABLE_COLUMNS[st][0][0]
+    if columns.get(order_by, (None, "text"))[1] == "text":
+        raise ValueError(f"{order_by}: เรียงลำดับด้วยคอลัมน์นี้ไม่ได้")
+    order_name = columns[order_by][0]
+    order_key = TABLE_INDEXES[st][order_name]
+    predicates = [_query_predicate(st, column, value) for column, value in (where or {}).items()]
+    checks = [check for *_, check in predicates]
+    lo, hi = KEY_MIN, KEY_MAX
+    for name, p_lo, p_hi, _ in predicates:
+        if name == order_name:
+            lo, hi = max(lo, p_lo), min(hi, p_hi)
+    after = tuple(after) if after is not None else None
+    limit = max(1, int(limit))
+    rows = []
+    ensure_indexes(filename, st)
+    with table_lock(filename):
+        with open_table(filename, st) as table:
+            estimates = sorted((index_estimate(index_path(filename, name), p_lo, p_hi), name, p_lo, p_hi)
+                               for name, p_lo, p_hi, _ in predicates if name != order_name)
+            if estimates and estimates[0][0] <= QUERY_SORT_MAX and \
+                    estimates[0][0] < index_estimate(index_path(filename, order_name), lo, hi):
+                count("query_sorted")
+                _, name, p_lo, p_hi = estimates[0]
+                for _, slot in iter_index_range(index_path(filename, name), p_lo, p_hi):
+                    view = table[slot]
+                    if view.deleted:
+                        continue
+                    raw = view.raw()
+                    if all(check(raw) for check in checks):
+                        rows += [(key, slot, raw) for key in order_key(raw)
+                                 if lo <= key < hi and (after is None or (key, slot) > after)]
+                rows.sort(key=lambda row: row[:2])
+                del rows[limit + 1:]
+            else:
+                count("query_walked")
+                for key, slot in iter_index_range(index_path(filename, order_name), lo, hi, after):
+                    view = table[slot]
+                    if view.deleted:
+                        continue
+                    raw = view.raw()
+                    if all(check(raw) for check in checks):
+                        rows.append((key, slot, raw))
+                        if len(rows) > limit:
+                            break
+    cursor = rows[limit - 1][:2] if len(rows) > limit else None
+    return [(slot, raw) for _, slot, raw in rows[:limit]], cursor
+
+def query_books(where: dict = None, order_by: str = None, after=None, limit: int = QUERY_PAGE) -> tuple:
+    return query_records(BOOK_FILE, BOOK_STRUCT, where, order_by, after, limit)
+
+def query_members(where: dict = None, order_by: str = None, after=None, limit: int = QUERY_PAGE) -> tuple:
+    return query_records(MEMBER_FILE, MEMBER_STRUCT, where, order_by, after, limit)
+
+# ---------------- Availability table ----------------
+# "<borrows file>.avail" keeps the number of copies currently out per book so
+# checkouts and report summaries do not have to scan the loan history:
+#   header  : magic, entry count, borrow records covered, total borrowed now,
+#             data generation of borrows.dat it matches (see Locking)
+#   entries : (book_id, borrowed) sorted by book_id, counts updated in place
+# It is maintained by after_write() on every borrows.dat change and rebuilt
+# from borrows.dat when missing or stale.
+AVAIL_MAGIC = b"LAV2"
+AVAIL_HEADER = struct.Struct("<4sqqqq")
+AVAIL_ENTRY = struct.Struct("<qi")
+
+def is_active_borrow(status: str) -> bool:
+    return status.lower() == "borrow"
+
+def availability_path(filename: str = BORROW_FILE) -> str:
+    return filename + ".avail"
+
+def _read_availability_header(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        head = f.read(AVAIL_HEADER.size)
+    if len(head) != AVAIL_HEADER.size:
+        return None
+    magic, entries, covers, total, stamp = AVAIL_HEADER.unpack(head)
+    if magic != AVAIL_MAGIC:
+        return None
+    return entries, covers, total, stamp
+
+def _write_availability(path: str, counts: dict, covers: int, stamp: int):
+    items = sorted((book_id, n) for book_id, n in counts.items() if n)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(AVAIL_HEADER.pack(AVAIL_MAGIC, len(items), covers, sum(n for _, n in items), stamp))
+        f.write(b"".join(AVAIL_ENTRY.pack(*item) for item in items))
+    os.replace(tmp, path)
+
+def _read_availability(path: str) -> dict:
+    entries = _read_availability_header(path)[0]
+    with open(path, "rb") as f:
+        f.seek(AVAIL_HEADER.size)
+        return dict(AVAIL_ENTRY.iter_unpack(f.read(entries * AVAIL_ENTRY.size)))
+
+def _availability_position(f, entries: int, book_id: int):
+    # (position, borrowed) of book_id in the sorted entries, position None if absent
+    lo, hi = 0, entries
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(AVAIL_HEADER.size + mid * AVAIL_ENTRY.size)
+        key, borrowed = AVAIL_ENTRY.unpack(f.read(AVAIL_ENTRY.size))
+        if key == book_id:
+            return mid, borrowed
+        if key < book_id:
+            lo = mid + 1
+        else:
+            hi = mid
+    return None, 0
+
+def _active_by_book_shard(records) -> dict:
+    counts = {}
+    for _, raw in records:
+        if is_active_borrow(unpack_str(raw[5])):
+            counts[raw[1]] = counts.get(raw[1], 0) + 1
+    return counts
+
+@timed("rebuild_availability")
+def rebuild_availability(filename: str = BORROW_FILE) -> dict:
+    counts = {}
+    with table_lock(filename, exclusive=True):
+        for part in parallel_scan(filename, BORROW_STRUCT, _active_by_book_shard):
+            for book_id, n in part.items():
+                counts[book_id] = counts.get(book_id, 0) + n
+        _write_availability(availability_path(filename), counts, record_count(filename, BORROW_STRUCT),
+                            data_generation(filename)[1])
+    return counts
+
+def _availability_stale(filename: str) -> bool:
+    header = _read_availability_header(availability_path(filename))
+    return (header is None or header[1] != record_count(filename, BORROW_STRUCT)
+            or header[3] != data_generation(filename)[1])
+
+def ensure_availability(filename: str = BORROW_FILE):
+    with table_lock(filename):
+        if not _availability_stale(filename):
+            return
+    with table_lock(filename, exclusive=True):
+        if _availability_stale(filename):
+            rebuild_availability(filename)
+
+def availability_apply(filename: str, changes: list, appended: int = 0):
+    path = availability_path(filename)
+    covers = record_count(filename, BORROW_STRUCT)
+    header = _read_availability_header(path)
+    started, stamp = data_generation(filename)
+    if header is None or header[1] != covers - appended or header[3] not in (started, stamp):
+        rebuild_availability(filename)
+        return
+    deltas = {}
+    for _, old_raw, new_raw in changes:
+        if old_raw is not None and is_active_borrow(unpack_str(old_raw[5])):
+            deltas[old_raw[1]] = deltas.get(old_raw[1], 0) - 1
+        if new_raw is not None and is_active_borrow(unpack_str(new_raw[5])):
+            deltas[new_raw[1]] = deltas.get(new_raw[1], 0) + 1
+    entries, _, total, _ = header
+    missing = {}
+    with open(path, "r+b") as f:
+        for book_id, delta in deltas.items():
+            if not delta:
+                continue
+            pos, borrowed = _availability_position(f, entries, book_id)
+            if pos is None:
+                missing[book_id] = delta
+                continue
+            f.seek(AVAIL_HEADER.size + pos * AVAIL_ENTRY.size)
+            f.write(AVAIL_ENTRY.pack(book_id, borrowed + delta))
+            total += delta
+        f.seek(0)
+        f.write(AVAIL_HEADER.pack(AVAIL_MAGIC, entries, covers, total, stamp))
+    if missing:
+        # first loan of these books: they need new sorted entries
+        counts = _read_availability(path)
+        for book_id, delta in missing.items():
+            counts[book_id] = counts.get(book_id, 0) + delta
+        _write_availability(path, counts, covers, stamp)
+
+def borrowed_count(book_id: int, filename: str = BORROW_FILE) -> int:
+    ensure_availability(filename)
+    with table_lock(filename):
+        path = availability_path(filename)
+        with open(path, "rb") as f:
+            return _availability_position(f, _read_availability_header(path)[0], book_id)[1]
+
+def availability_counts(filename: str = BORROW_FILE) -> dict:
+    ensure_availability(filename)
+    with table_lock(filename):
+        return _read_availability(availability_path(filename))
+
+def total_borrowed(filename: str = BORROW_FILE) -> int:
+    ensure_availability(filename)
+    with table_lock(filename):
+        return _read_availability_header(availability_path(filename))[2]
+
+# ---------------- Overdue loans & fines ----------------
+# Active loans are indexed by due date ("due" index of borrows.dat, keys are
+# day numbers), so the loans overdue as of a day are one range read of that
+# index: O(log n + k), no date parsing at query time. compute_fines() charges
+# FINE_PER_DAY for every day past the due date; it only raises a fine, so an
+# amount entered by hand that is already higher is kept.
+FINE_PER_DAY = 5.0
+_FLOAT32 = struct.Struct("<f")
+
+@timed("overdue_loans")
+def overdue_loans(as_of: str = None) -> list:
+    """[(slot, raw, days overdue)] of active loans due before as_of, oldest first."""
+    as_of_day = day_number(as_of or datetime.date.today().isoformat())
+    loans = []
+    ensure_indexes(BORROW_FILE, BORROW_STRUCT)
+    with table_lock(BORROW_FILE):
+        due = index_range(BORROW_FILE, BORROW_STRUCT, "due", -2**63, as_of_day)
+        with open_table(BORROW_FILE, BORROW_STRUCT) as borrows:
+            for due_day, slot in due:
+                view = borrows[slot]
+                if not view.deleted:
+                    loans.append((slot, view.raw(), as_of_day - due_day))
+    return loans
+
+@timed("compute_fines")
+def compute_fines(as_of: str = None, rate: float = FINE_PER_DAY) -> tuple:
+    """Raise the fine of every overdue loan to days overdue * rate.
+
+    Returns (overdue loans, loans whose fine changed)."""
+    if not os.path.exists(BORROW_FILE):
+        return 0, 0
+    with table_lock(BORROW_FILE, exclusive=True):
+        loans = overdue_loans(as_of)
+        updates = []
+        for slot, raw, days in loans:
+            fine = _FLOAT32.unpack(_FLOAT32.pack(days * rate))[0]  # as stored
+            if fine > raw[6]:
+                updates.append((slot, raw[:6] + (fine,) + raw[7:]))
+        changed = write_records_at(BORROW_FILE, BORROW_STRUCT, updates)
+    return len(loans), changed
+
+# ---------------- Archive (hot/cold loans) ----------------
+# Returned loans can be moved out of borrows.dat into compressed segments, one
+# per month of date_out: "<file>.archive/YYYY-MM.<gen>.seg". The hot file then
+# holds active and recent loans only, so day-to-day circulation never reads
+# history. A segment is a header (record size, count, first and last date_out
+# as day numbers) followed by the lzma-compressed records in the legacy
+# layout; queries skip segments outside their date range by month and by the
+# header without decompressing them. Segments are never edited: archiving
+# into a month writes the next generation of its file.
+# A move is made atomic by a "pending" file written first, listing the new
+# segments and the identity of the hot file: after a crash, recovery keeps the
+# new segments if the hot file was replaced (the loans left it), else drops them.
+ARCHIVE_MAGIC = b"LAR1"
+ARCHIVE_HEADER = struct.Struct("<4sIIii")  # magic, record size, count, first day, last day
+ARCHIVE_STATUSES = ("return", "returned")
+ARCHIVE_SEGMENT_RE = re.compile(r"^(\d{4}-\d{2})\.(\d+)\.seg$")
+ARCHIVE_CHUNK = 1 << 20
+
+def archive_dir(filename: str = BORROW_FILE) -> str:
+    return filename + ".archive"
+
+def _archive_pending_path(filename: str) -> str:
+    return os.path.join(archive_dir(filename), "pending")
+
+def _file_ident(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_dev
+
+def _write_archive_pending(filename: str, ident: tuple, names: list):
+    path = _archive_pending_path(filename)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join([f"{ident[0]} {ident[1]}"] + names) + "\n")
+        f.flush()
+        _fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    _fsync_dir(path)
+
+def _read_archive_pending(filename: str):
+    # (hot file identity, [new segment names]) of an unfinished move, else None
+    try:
+        with open(_archive_pending_path(filename), encoding="utf-8") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        return None
+    ino, dev = lines[0].split()
+    return (int(ino), int(dev)), [name for name in lines[1:] if name]
+
+def _segment_generations(filename: str) -> dict:
+    # month -> [(generation, path)] of every segment file on disk
+    folder = archive_dir(filename)
+    found = {}
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            m = ARCHIVE_SEGMENT_RE.match(name)
+            if m:
+                found.setdefault(m.group(1), []).append((int(m.group(2)), os.path.join(folder, name)))
+    return found
+
+def _recover_archive(filename: str):
+    pending = _read_archive_pending(filename)
+    if pending is None:
+        return
+    ident, names = pending
+    with table_lock(filename, exclusive=True):
+        moved = os.path.exists(filename) and _file_ident(filename) != ident
+        generations = _segment_generations(filename)
+        for name in names:
+            m = ARCHIVE_SEGMENT_RE.match(name)
+            for generation, path in generations.get(m.group(1), []):
+                if (generation == int(m.group(2))) != moved:
+                    os.remove(path)  # roll forward: old generation, back: the new one
+        os.remove(_archive_pending_path(filename))
+
+def archive_segments(filename: str = BORROW_FILE) -> dict:
+    """month ("YYYY-MM") -> path of its current segment, in month order."""
+    _recover_archive(filename)
+    return {month: max(gens)[1] for month, gens in sorted(_segment_generations(filename).items())}
+
+def read_segment_header(path: str) -> tuple:
+    # (record size, count, first day, last day)
+    with open(path, "rb") as f:
+        head = f.read(ARCHIVE_HEADER.size)
+    if len(head) < ARCHIVE_HEADER.size or head[:4] != ARCHIVE_MAGIC:
+        raise ValueError(f"{path}: ไม่ใช่ไฟล์ archive")
+    return ARCHIVE_HEADER.unpack(head)[1:]
+
+def iter_segment(path: str, st: struct.Struct = BORROW_STRUCT):
+    # raw records of a segment, decompressed a chunk at a time
+    for data in segment_data(path, st):
+        yield from st.iter_unpack(data)
+
+def segment_data(path: str, st: struct.Struct = BORROW_STRUCT):
+    # the decompressed records of a segment as bytes, whole records per chunk
+    size = read_segment_header(path)[0]
+    if size != st.size:
+        raise ValueError(f"{path}: ขนาด record ไม่ตรงกับโครงสร้าง")
+    decompressor = lzma.LZMADecompressor()
+    pending = b""
+    with open(path, "rb") as f:
+        f.seek(ARCHIVE_HEADER.size)
         while True:
-            chunk = f.read(size)
+            chunk = f.read(ARCHIVE_CHUNK)
             if not chunk:
                 break
-            if len(chunk) != size:
-                break
-            records.append(st.unpack(chunk))
-    return records
+            pending += decompressor.decompress(chunk)
+            whole = len(pending) - len(pending) % st.size
+            if whole:
+                yield pending[:whole]
+            pending = pending[whole:]
+
+class SegmentWriter:
+    # streams records into a new segment file; the header is filled in by close()
+    def __init__(self, path: str, st: struct.Struct = BORROW_STRUCT):
+        self.path = path
+        self.st = st
+        self.count = 0
+        self.first = self.last = None
+        self._buf = bytearray()
+        self._compressor = lzma.LZMACompressor()
+        self._f = open(path, "wb")
+        self._f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, st.size, 0, 0, 0))
+
+    def add(self, raw, day: int):
+        self._buf += self.st.pack(*raw)
+        self.count += 1
+        self.first = day if self.first is None else min(self.first, day)
+        self.last = day if self.last is None else max(self.last, day)
+        if len(self._buf) >= ARCHIVE_CHUNK:
+            self._f.write(self._compressor.compress(self._buf))
+            self._buf.clear()
+
+    def close(self):
+        self._f.write(self._compressor.compress(self._buf) + self._compressor.flush())
+        self._f.seek(0)
+        self._f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, self.st.size, self.count, self.first, self.last))
+        self._f.flush()
+        _fsync(self._f.fileno())
+        self._f.close()
+
+def _loan_day(raw):
+    # day number of date_out, None when the field is not a valid date
+    try:
+        return day_number(unpack_str(raw[2]))
+    except ValueError:
+        return None
+
+def _day_month(day: int) -> str:
+    # "YYYY-MM" of a day number; segment names come from it, not from the
+    # stored text, which may be unpadded ("2025-9-7")
+    return (EPOCH + datetime.timedelta(days=day)).isoformat()[:7]
 
-def write_raw_records(filename: str, st: struct.Struct, records: list):
-    with open(filename, "wb") as f:
-        for r in records:
-            f.write(st.pack(*r))
+def _archivable(raw, cutoff: int) -> bool:
+    if unpack_str(raw[5]).lower() not in ARCHIVE_STATUSES:
+        return False
+    day = _loan_day(raw)
+    return day is not None and day < cutoff
+
+@timed("archive_loans")
+def archive_loans(before: str = None, filename: str = BORROW_FILE) -> int:
+    """Move returned loans with date_out before `before` (default: the first day
+    of this month) from the hot file to the archive; returns loans moved."""
+    cutoff = day_number(before or datetime.date.today().replace(day=1).isoformat())
+    with table_lock(filename, exclusive=True):
+        ensure_recovered(filename, BORROW_STRUCT)
+        if not record_count(filename, BORROW_STRUCT):
+            return 0
+        months = {}
+        for _, raw in iter_records(filename, BORROW_STRUCT):
+            if _archivable(raw, cutoff):
+                month = _day_month(_loan_day(raw))
+                months[month] = months.get(month, 0) + 1
+        if not months:
+            return 0
+        os.makedirs(archive_dir(filename), exist_ok=True)
+        current = archive_segments(filename)
+        generations = _segment_generations(filename)
+        new_paths = {}
+        for month in months:
+            generation = max(generations[month])[0] + 1 if month in generations else 1
+            new_paths[month] = os.path.join(archive_dir(filename), f"{month}.{generation}.seg")
+        _write_archive_pending(filename, _file_ident(filename),
+                               [os.path.basename(path) for path in new_paths.values()])
+
+        writers = {}
+        try:
+            for month, path in new_paths.items():
+                writers[month] = writer = SegmentWriter(path)
+                if month in current:
+                    for raw in iter_segment(current[month]):
+                        writer.add(raw, _loan_day(raw))
+            for _, raw in iter_records(filename, BORROW_STRUCT):
+                if _archivable(raw, cutoff):
+                    day = _loan_day(raw)
+                    writers[_day_month(day)].add(raw, day)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        _fsync_dir(new_paths[next(iter(new_paths))])
+        # the loans leave the hot file here: the commit point of the move
+        write_raw_records(filename, BORROW_STRUCT,
+                          (raw for _, raw in iter_records(filename, BORROW_STRUCT) if not _archivable(raw, cutoff)))
+        _recover_archive(filename)  # drops the old generations and the pending file
+    return sum(months.values())
+
+def query_loans(date_from: str = None, date_to: str = None, filename: str = BORROW_FILE,
+                archive: bool = True):
+    """(slot, raw) of loans with date_out in [date_from, date_to], archived loans
+    (slot None) by month first, then the hot file. Loans without a valid
+    date_out only match an open range.
+
+    The lock is not held while rows are yielded: a segment's matches, then
+    the hot file's pages (see iter_records), are read under it one at a time.
+    An archive run in between can move loans past the reader; callers that
+    need one consistent pass hold table_lock(filename) around the loop."""
+    lo = day_number(date_from) if date_from else None
+    hi = day_number(date_to) if date_to else None
+    if archive:
+        first_month = _day_month(lo) if lo is not None else ""
+        last_month = _day_month(hi) if hi is not None else "9999-99"
+        with table_lock(filename):
+            segments = archive_segments(filename)
+        for month in segments:
+            if not first_month <= month <= last_month:
+                continue
+            with table_lock(filename):
+                path = archive_segments(filename).get(month)
+                if path is None:
+                    continue
+                _, stored, first_day, last_day = read_segment_header(path)
+                if not stored or (lo is not None and last_day < lo) or (hi is not None and first_day > hi):
+                    continue
+                page = [raw for raw in iter_segment(path)
+                        if (lo is None or _loan_day(raw) >= lo) and (hi is None or _loan_day(raw) <= hi)]
+            for raw in page:
+                yield None, raw
+    for slot, raw in iter_records(filename, BORROW_STRUCT):
+        if lo is not None or hi is not None:
+            day = _loan_day(raw)
+            if day is None or (lo is not None and day < lo) or (hi is not None and day > hi):
+                continue
+        yield slot, raw
+
+def archive_stats(filename: str = BORROW_FILE) -> list:
+    # [(month, loans, bytes on disk)]
+    with table_lock(filename):
+        return [(month, read_segment_header(path)[1], os.path.getsize(path))
+                for month, path in archive_segments(filename).items()]
+
+# ---------------- Derived data ----------------
+# struct -> [(apply(filename, changes, appended), rebuild(filename))] for data
+# that is kept in sync with a table next to its indexes
+TABLE_TRIGGERS = {
+    BORROW_STRUCT: [(availability_apply, rebuild_availability)],
+}
+
+def after_write(filename: str, st: struct.Struct, changes: list, appended: int = 0):
+    # changes: [(slot, old raw or None, new raw or None)] just written to filename
+    cache_apply(filename, st, changes)
+    index_apply(filename, st, changes, appended)
+    for apply, _ in TABLE_TRIGGERS.get(st, ()):
+        apply(filename, changes, appended)
+
+def rebuild_derived(filename: str, st: struct.Struct):
+    rebuild_indexes(filename, st)
+    for _, rebuild in TABLE_TRIGGERS.get(st, ()):
+        rebuild(filename)
 
 # ---------------- Conversion helpers ----------------
 def decode_record(raw_tuple):
     return tuple(unpack_str(x) if isinstance(x, (bytes, bytearray)) else x for x in raw_tuple)
 
+# ---------------- Record operations (non-interactive) ----------------
+# Building blocks for the menus' final step, the server and the tools. Each
+# runs under the table's exclusive lock and raises ValueError on bad input.
+def insert_unique(filename: str, st: struct.Struct, packed: tuple) -> int:
+    with table_lock(filename, exclusive=True):
+        if find_slot(filename, st, packed[0]) is not None:
+            raise ValueError(f"ID {packed[0]} มีอยู่แล้ว")
+        return add_record(filename, st, packed)
+
+@timed("insert_row")
+def insert_row(filename: str, st: struct.Struct, row: dict) -> tuple:
+    packed = parse_row(st, row)
+    insert_unique(filename, st, packed)
+    return packed
+
+@timed("update_row")
+def update_row(filename: str, st: struct.Struct, key: int, changes: dict) -> tuple:
+    # changes = {column: new value}; the primary key itself cannot change
+    with table_lock(filename, exclusive=True):
+        slot = find_slot(filename, st, key)
+        if slot is None:
+            raise ValueError(f"ไม่พบ ID {key}")
+        old = read_record_at(filename, st, slot)
+        row = format_row(st, old)
+        row.update(changes)
+        row[TABLE_COLUMNS[st][0][0]] = key
+        new = parse_row(st, row)
+        write_record_at(filename, st, slot, new, expected=old)
+    return new
+
+@timed("delete_by_key")
+def delete_by_key(filename: str, st: struct.Struct, key: int):
+    with table_lock(filename, exclusive=True):
+        slot = find_slot(filename, st, key)
+        if slot is None:
+            raise ValueError(f"ไม่พบ ID {key}")
+        delete_record_at(filename, st, slot)
+
+@timed("update_loan")
+def update_loan(slot: int, changes: dict, expected=None, key: dict = None) -> tuple:
+    # expected = the raw record the caller saw; key = its loan_key() fields, for
+    # callers (server clients) that hold a slot across compaction or archiving
+    with table_lock(BORROW_FILE, exclusive=True):
+        old = read_record_at(BORROW_FILE, BORROW_STRUCT, slot)
+        if old is None:
+            raise ValueError(f"ไม่พบรายการยืม slot {slot}")
+        check_loan_key(old, key)
+        row = format_row(BORROW_STRUCT, old)
+        row.update(changes)
+        row["member_id"], row["book_id"] = old[0], old[1]
+        new = parse_row(BORROW_STRUCT, row)
+        write_record_at(BORROW_FILE, BORROW_STRUCT, slot, new, expected=expected)
+    return new
+
+@timed("delete_loan")
+def delete_loan(slot: int, expected=None, key: dict = None):
+    with table_lock(BORROW_FILE, exclusive=True):
+        old = read_record_at(BORROW_FILE, BORROW_STRUCT, slot)
+        if old is None:
+            raise ValueError(f"ไม่พบรายการยืม slot {slot}")
+        check_loan_key(old, key)
+        delete_record_at(BORROW_FILE, BORROW_STRUCT, slot, expected=expected)
+
+LOAN_KEY_COLUMNS = ("member_id", "book_id", "date_out")
+
+def loan_key(raw) -> tuple:
+    # what identifies a loan when its slot may have been renumbered
+    return raw[0], raw[1], unpack_str(raw[2])
+
+def check_loan_key(old, key: dict):
+    if key is None:
+        return
+    try:
+        wanted = (int(key["member_id"]), int(key["book_id"]), str(key["date_out"]))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"expected ต้องมี {', '.join(LOAN_KEY_COLUMNS)}") from None
+    if loan_key(old) != wanted:
+        raise ValueError("รายการยืมที่ slot นี้ไม่ใช่รายการเดิมแล้ว (ถูกย้ายหรือลบ) — กรุณาโหลดรายการใหม่")
+
 # ---------------- Book & Member operations (Update/Delete included for completeness) ----------------
+SEARCH_LIMIT = 50  # rows shown by the search menus
+BOOK_LIST_HEADER = f"{'ID':<6} {'Title':<30} {'Author':<20} {'Year':<6} {'Copies':<6}"
+MEMBER_LIST_HEADER = f"{'ID':<6} {'Name':<25} {'Birth Date':<12} {'Mobile':<15} {'Email':<25}"
+
+def book_line(rr) -> str:
+    return f"{rr[0]:<6} {rr[1][:30]:<30} {rr[2][:20]:<20} {rr[4]:<6} {rr[8]:<6}"
+
+def member_line(rr) -> str:
+    return f"{rr[0]:<6} {rr[1][:25]:<25} {rr[2]:<12} {rr[5]:<15} {rr[6][:25]:<25}"
+
+def page_rows(fetch, header: str, width: int, line) -> int:
+    # fetch(cursor) -> (rows, next cursor) as query_records(); prints one page
+    # at a time and only fetches the next page when asked to
+    cursor, shown = None, 0
+    while True:
+        rows, cursor = fetch(cursor)
+        if rows and not shown:
+            print(header)
+            print("-" * width)
+        for _, raw in rows:
+            print(line(decode_record(raw)))
+        shown += len(rows)
+        if cursor is None:
+            return shown
+        if input(f" ({shown} รายการ) Enter = หน้าถัดไป, q = กลับ: ").strip().lower() == "q":
+            return shown
+
+@timed("add_book")
 def add_book():
     print("\n== Add Book ==")
-    book_id = get_int("Book ID (ตัวเลข): ")
-    if any(b[0] == book_id for b in read_raw_records(BOOK_FILE, BOOK_STRUCT)):
+    book_id = get_int("Book ID (ตัวเลข): ", ID_MIN, INT_MAX)
+    if find_slot(BOOK_FILE, BOOK_STRUCT, book_id) is not None:
         print(" Book ID นี้มีอยู่แล้ว")
         return
     title = get_str("Title: ", 100)
@@ -126,65 +2753,99 @@ def add_book():
     category = get_str("Category: ", 50, allow_empty=True)
     language = get_str("Language: ", 50, allow_empty=True)
     shelf_no = get_str("Shelf No.: ", 20, allow_empty=True)
-    total_copies = get_int("Total copies: ", 0)
+    total_copies = get_int("Total copies: ", 0, INT_MAX)
     packed = (
         book_id, pack_str(title, 100), pack_str(author, 100), pack_str(publisher, 100),
         year_pub, pack_str(category, 50), pack_str(language, 50),
         pack_str(shelf_no, 20), total_copies
     )
-    add_record(BOOK_FILE, BOOK_STRUCT, packed)
+    try:
+        insert_unique(BOOK_FILE, BOOK_STRUCT, packed)
+    except ValueError:
+        print(" Book ID นี้มีอยู่แล้ว")
+        return
     print(" เพิ่มหนังสือสำเร็จ")
 
+@timed("view_books")
 def view_books():
     print("\n== View Books ==")
-    raws = read_raw_records(BOOK_FILE, BOOK_STRUCT)
-    if not raws:
+    shown = page_rows(lambda cursor: query_books(after=cursor), BOOK_LIST_HEADER, 80, book_line)
+    if not shown:
         print("ไม่มีข้อมูลหนังสือ")
+
+@timed("query_book")
+def query_book():
+    print("\n== Query Books == (เว้นว่าง = ไม่กำหนด)")
+    where = {}
+    year_from = get_int("ปีพิมพ์ตั้งแต่: ", 0, 9999, allow_empty=True)
+    year_to = get_int("ปีพิมพ์ถึง: ", 0, 9999, allow_empty=True)
+    if year_from is not None or year_to is not None:
+        where["year_pub"] = (year_from, year_to)
+    for column, prompt in (("category", "Category: "), ("language", "Language: "), ("shelf_no", "Shelf No.: ")):
+        value = input(prompt).strip()
+        if value:
+            where[column] = value
+    order_by = "year_pub" if input("เรียงตาม (1 = Book ID, 2 = ปีพิมพ์): ").strip() == "2" else "book_id"
+    shown = page_rows(lambda cursor: query_books(where, order_by, cursor), BOOK_LIST_HEADER, 80, book_line)
+    if not shown:
+        print(" ไม่พบหนังสือที่ตรงกับเงื่อนไข")
+
+@timed("search_book")
+def search_book():
+    print("\n== Search Books ==")
+    query = get_str("คำค้น (ชื่อเรื่อง/ผู้แต่ง/สำนักพิมพ์/หมวดหมู่): ", 100)
+    found = search_books(query, SEARCH_LIMIT + 1)
+    if not found:
+        print(" ไม่พบหนังสือที่ตรงกับคำค้น")
         return
-    print(f"{'ID':<6} {'Title':<30} {'Author':<20} {'Year':<6} {'Copies':<6}")
+    print(BOOK_LIST_HEADER)
     print("-" * 80)
-    for r in raws:
-        rr = decode_record(r)
-        print(f"{rr[0]:<6} {rr[1][:30]:<30} {rr[2][:20]:<20} {rr[4]:<6} {rr[8]:<6}")
+    for _, raw in found[:SEARCH_LIMIT]:
+        print(book_line(decode_record(raw)))
+    if len(found) > SEARCH_LIMIT:
+        print(f" ... แสดง {SEARCH_LIMIT} รายการแรก — ระบุคำค้นให้ละเอียดขึ้น")
 
+@timed("update_book")
 def update_book():
     print("\n== Update Book ==")
     book_id = get_int("Book ID ที่ต้องการแก้ไข: ")
-    raws = read_raw_records(BOOK_FILE, BOOK_STRUCT)
-    found = False
-    for idx, r in enumerate(raws):
-        if r[0] == book_id:
-            found = True
-            rr = decode_record(r)
-            print("ข้อมูลเดิม:", rr)
-            # ... (Logic to get new values)
-            new_title = get_str("New Title (Enter=ไม่เปลี่ยน): ", 100, allow_empty=True) or rr[1]
-            new_author = get_str("New Author (Enter=ไม่เปลี่ยน): ", 100, allow_empty=True) or rr[2]
-            # ... (Rest of the fields)
-            raws[idx] = (
-                book_id, pack_str(new_title, 100), pack_str(new_author, 100), r[3], r[4], r[5], r[6], r[7], r[8]
-            ) # Simplified for brevity
-            write_raw_records(BOOK_FILE, BOOK_STRUCT, raws)
-            print(" แก้ไขเรียบร้อย")
-            break
-    if not found:
+    idx = find_slot(BOOK_FILE, BOOK_STRUCT, book_id)
+    if idx is None:
         print(" ไม่พบ Book ID")
+        return
+    r = read_record_at(BOOK_FILE, BOOK_STRUCT, idx)
+    rr = decode_record(r)
+    print("ข้อมูลเดิม:", rr)
+    # ... (Logic to get new values)
+    new_title = get_str("New Title (Enter=ไม่เปลี่ยน): ", 100, allow_empty=True) or rr[1]
+    new_author = get_str("New Author (Enter=ไม่เปลี่ยน): ", 100, allow_empty=True) or rr[2]
+    # ... (Rest of the fields)
+    new_packed = (
+        book_id, pack_str(new_title, 100), pack_str(new_author, 100), r[3], r[4], r[5], r[6], r[7], r[8]
+    ) # Simplified for brevity
+    try:
+        write_record_at(BOOK_FILE, BOOK_STRUCT, idx, new_packed, expected=r)
+    except ValueError as e:
+        print(f" {e}")
+        return
+    print(" แก้ไขเรียบร้อย")
 
+@timed("delete_book")
 def delete_book():
     print("\n== Delete Book ==")
     book_id = get_int("Book ID ที่ต้องการลบ: ")
-    raws = read_raw_records(BOOK_FILE, BOOK_STRUCT)
-    new_raws = [r for r in raws if r[0] != book_id]
-    if len(raws) == len(new_raws):
+    try:
+        delete_by_key(BOOK_FILE, BOOK_STRUCT, book_id)
+    except ValueError:
         print(" ไม่พบ Book ID")
     else:
-        write_raw_records(BOOK_FILE, BOOK_STRUCT, new_raws)
         print(" ลบสำเร็จ")
 
+@timed("add_member")
 def add_member():
     print("\n== Add Member ==")
-    member_id = get_int("Member ID (ตัวเลข): ")
-    if any(m[0] == member_id for m in read_raw_records(MEMBER_FILE, MEMBER_STRUCT)):
+    member_id = get_int("Member ID (ตัวเลข): ", ID_MIN, INT_MAX)
+    if find_slot(MEMBER_FILE, MEMBER_STRUCT, member_id) is not None:
         print(" Member ID นี้มีอยู่แล้ว")
         return
     name = get_str("Name Surname: ", 100)
@@ -199,62 +2860,94 @@ def add_member():
         pack_str(address, 200), pack_str(mobile, 15), pack_str(email, 100),
         pack_str(reg_date, 10)
     )
-    add_record(MEMBER_FILE, MEMBER_STRUCT, packed)
+    try:
+        insert_unique(MEMBER_FILE, MEMBER_STRUCT, packed)
+    except ValueError:
+        print(" Member ID นี้มีอยู่แล้ว")
+        return
     print(" เพิ่มสมาชิกสำเร็จ")
 
+@timed("view_members")
 def view_members():
     print("\n== View Members ==")
-    raws = read_raw_records(MEMBER_FILE, MEMBER_STRUCT)
-    if not raws:
+    shown = page_rows(lambda cursor: query_members(after=cursor), MEMBER_LIST_HEADER, 90, member_line)
+    if not shown:
         print("ไม่มีข้อมูลสมาชิก")
+
+@timed("query_member")
+def query_member():
+    print("\n== Query Members == (เว้นว่าง = ไม่กำหนด)")
+    where = {}
+    for column, label in (("reg_date", "วันสมัคร"), ("birth_date", "วันเกิด")):
+        low = get_date(f"{label}ตั้งแต่ (YYYY-MM-DD): ", allow_empty=True)
+        high = get_date(f"{label}ถึง (YYYY-MM-DD): ", allow_empty=True)
+        if low or high:
+            where[column] = (low or None, high or None)
+    choice = input("เรียงตาม (1 = Member ID, 2 = วันสมัคร, 3 = วันเกิด): ").strip()
+    order_by = {"2": "reg_date", "3": "birth_date"}.get(choice, "member_id")
+    shown = page_rows(lambda cursor: query_members(where, order_by, cursor), MEMBER_LIST_HEADER, 90, member_line)
+    if not shown:
+        print(" ไม่พบสมาชิกที่ตรงกับเงื่อนไข")
+
+@timed("search_member")
+def search_member():
+    print("\n== Search Members ==")
+    query = get_str("คำค้น (ชื่อ/อีเมล): ", 100)
+    found = search_members(query, SEARCH_LIMIT + 1)
+    if not found:
+        print(" ไม่พบสมาชิกที่ตรงกับคำค้น")
         return
-    print(f"{'ID':<6} {'Name':<25} {'Birth Date':<12} {'Mobile':<15} {'Email':<25}")
+    print(MEMBER_LIST_HEADER)
     print("-" * 90)
-    for r in raws:
-        rr = decode_record(r)
-        print(f"{rr[0]:<6} {rr[1][:25]:<25} {rr[2]:<12} {rr[5]:<15} {rr[6][:25]:<25}")
+    for _, raw in found[:SEARCH_LIMIT]:
+        print(member_line(decode_record(raw)))
+    if len(found) > SEARCH_LIMIT:
+        print(f" ... แสดง {SEARCH_LIMIT} รายการแรก — ระบุคำค้นให้ละเอียดขึ้น")
 
+@timed("update_member")
 def update_member():
     print("\n== Update Member ==")
     member_id = get_int("Member ID ที่ต้องการแก้ไข: ")
-    raws = read_raw_records(MEMBER_FILE, MEMBER_STRUCT)
-    found = False
-    for idx, r in enumerate(raws):
-        if r[0] == member_id:
-            found = True
-            rr = decode_record(r)
-            print("ข้อมูลเดิม:", rr)
-            # ... (Logic to get new values)
-            new_name = get_str("New Name (Enter=ไม่เปลี่ยน): ", 100, allow_empty=True) or rr[1]
-            # ... (Rest of the fields)
-            raws[idx] = (
-                member_id, pack_str(new_name, 100), r[2], r[3], r[4], r[5], r[6], r[7]
-            ) # Simplified for brevity
-            write_raw_records(MEMBER_FILE, MEMBER_STRUCT, raws)
-            print(" แก้ไขข้อมูลสมาชิกเรียบร้อย")
-            break
-    if not found:
+    idx = find_slot(MEMBER_FILE, MEMBER_STRUCT, member_id)
+    if idx is None:
         print(" ไม่พบ Member ID")
+        return
+    r = read_record_at(MEMBER_FILE, MEMBER_STRUCT, idx)
+    rr = decode_record(r)
+    print("ข้อมูลเดิม:", rr)
+    # ... (Logic to get new values)
+    new_name = get_str("New Name (Enter=ไม่เปลี่ยน): ", 100, allow_empty=True) or rr[1]
+    # ... (Rest of the fields)
+    new_packed = (
+        member_id, pack_str(new_name, 100), r[2], r[3], r[4], r[5], r[6], r[7]
+    ) # Simplified for brevity
+    try:
+        write_record_at(MEMBER_FILE, MEMBER_STRUCT, idx, new_packed, expected=r)
+    except ValueError as e:
+        print(f" {e}")
+        return
+    print(" แก้ไขข้อมูลสมาชิกเรียบร้อย")
 
 
+@timed("delete_member")
 def delete_member():
     print("\n== Delete Member ==")
     member_id = get_int("Member ID ที่ต้องการลบ: ")
-    raws = read_raw_records(MEMBER_FILE, MEMBER_STRUCT)
-    new_raws = [r for r in raws if r[0] != member_id]
-    if len(raws) == len(new_raws):
+    try:
+        delete_by_key(MEMBER_FILE, MEMBER_STRUCT, member_id)
+    except ValueError:
         print(" ไม่พบ Member ID")
     else:
-        write_raw_records(MEMBER_FILE, MEMBER_STRUCT, new_raws)
         print(" ลบข้อมูลสมาชิกสำเร็จ")
 
 
 # ---------------- Borrows (REWRITTEN) ----------------
 
+@timed("add_borrow")
 def add_borrow():
     print("\n== Add Borrow (Multiple books) ==")
     member_id = get_int("Member ID: ")
-    if not any(r[0] == member_id for r in read_raw_records(MEMBER_FILE, MEMBER_STRUCT)):
+    if find_slot(MEMBER_FILE, MEMBER_STRUCT, member_id) is None:
         print(" ไม่พบ Member ID")
         return
     
@@ -268,9 +2961,13 @@ def add_borrow():
         
         try:
             book_id = int(book_id_str)
-            if not any(b[0] == book_id for b in read_raw_records(BOOK_FILE, BOOK_STRUCT)):
+            book = find_record(BOOK_FILE, BOOK_STRUCT, book_id)
+            if book is None:
                 print(f" ไม่พบ Book ID {book_id}")
                 continue
+            if borrowed_count(book_id) + books_to_borrow.count(book_id) >= book[8]:
+                print(f" Book ID {book_id} ถูกยืมครบทุกเล่มแล้ว ({book[8]} เล่ม)")
+                continue
             books_to_borrow.append(book_id)
             print(f"  เพิ่ม Book ID {book_id} ในรายการ")
         except ValueError:
@@ -280,81 +2977,113 @@ def add_borrow():
         date_out = get_date("Date out (YYYY-MM-DD) สำหรับหนังสือทั้งหมด: ")
         date_due = get_date("Date due (YYYY-MM-DD) สำหรับหนังสือทั้งหมด: ")
         
-        for book_id in books_to_borrow:
-            packed = (
-                member_id, book_id, pack_str(date_out, 10), pack_str(date_due, 10),
-                pack_str("", 10), pack_str("Borrow", 20), 0.0, pack_str("", 200)
-            )
-            add_record(BORROW_FILE, BORROW_STRUCT, packed)
+        try:
+            borrow_books(member_id, books_to_borrow, date_out, date_due)
+        except ValueError as e:
+            print(f" {e}")
+            return
         print(f"\nเพิ่มการยืมหนังสือ {len(books_to_borrow)} เล่มสำหรับ Member ID {member_id} สำเร็จ")
 
+@timed("borrow_books")
+def borrow_books(member_id: int, book_ids: list, date_out: str, date_due: str) -> int:
+    """Record one loan per book as a single transaction; returns the first slot.
+
+    Every ID is checked against the indexes and the availability table before
+    anything is written, then all rows go to borrows.dat in one write. Raises
+    ValueError on unknown IDs or when a book has no copy left. borrows.dat stays
+    locked from the availability check to the write, so two desks cannot both
+    lend the last copy."""
+    book_ids = list(book_ids)
+    date_out, date_due = parse_date(date_out), parse_date(date_due)
+    if find_slot(MEMBER_FILE, MEMBER_STRUCT, member_id) is None:
+        raise ValueError(f"ไม่พบ Member ID {member_id}")
+    rows = [
+        (
+            member_id, book_id, pack_str(date_out, 10), pack_str(date_due, 10),
+            pack_str("", 10), pack_str("Borrow", 20), 0.0, pack_str("", 200)
+        )
+        for book_id in book_ids
+    ]
+    with table_lock(BORROW_FILE, exclusive=True):
+        missing, unavailable = [], []
+        for book_id in dict.fromkeys(book_ids):
+            book = find_record(BOOK_FILE, BOOK_STRUCT, book_id)
+            if book is None:
+                missing.append(book_id)
+            elif borrowed_count(book_id) + book_ids.count(book_id) > book[8]:
+                unavailable.append(book_id)
+        if missing:
+            raise ValueError(f"ไม่พบ Book ID {', '.join(map(str, missing))}")
+        if unavailable:
+            raise ValueError(f"Book ID {', '.join(map(str, unavailable))} ไม่มีเล่มว่างให้ยืม")
+        return add_records(BORROW_FILE, BORROW_STRUCT, rows)
+
+@timed("view_borrows")
 def view_borrows():
     print("\n== View Borrows (Grouped) ==")
-    borrows_raw = read_raw_records(BORROW_FILE, BORROW_STRUCT)
-    if not borrows_raw:
+    # large files are grouped by several worker processes (see Parallel scans)
+    grouped_borrows = loans_by_member()
+    if not grouped_borrows:
         print("ไม่มีข้อมูลการยืม")
         return
 
-    grouped_borrows = {}
-    for r in borrows_raw:
-        rr = decode_record(r)
-        member_id = rr[0]
-        if member_id not in grouped_borrows:
-            grouped_borrows[member_id] = []
-        grouped_borrows[member_id].append(rr)
-
-    members_map = {m[0]: decode_record(m) for m in read_raw_records(MEMBER_FILE, MEMBER_STRUCT)}
-    books_map = {b[0]: decode_record(b) for b in read_raw_records(BOOK_FILE, BOOK_STRUCT)}
+    # members and books come from the record cache, so the lookups that
+    # update_borrow/delete_borrow make right after this do not touch the files
+    members_map = record_map(MEMBER_FILE, MEMBER_STRUCT)
+    books_map = record_map(BOOK_FILE, BOOK_STRUCT)
 
     for member_id, borrows in grouped_borrows.items():
-        member_info = members_map.get(member_id, (None, "Unknown Member"))
         print("-" * 80)
-        print(f"Member ID: {member_id} | Name: {member_info[1]}")
+        member = members_map.get(member_id)
+        print(f"Member ID: {member_id} | Name: {unpack_str(member[1]) if member else 'Unknown Member'}")
         print(f"{'':<4}{'BookID':<7} | {'Title':<40} | {'Status'}")
         
-        for borrow_item in borrows:
-            book_id = borrow_item[1]
-            book_info = books_map.get(book_id, (None, "Unknown Book"))
-            title = book_info[1]
-            status = borrow_item[5]
+        for book_id, status in borrows:
+            book = books_map.get(book_id)
+            title = unpack_str(book[1]) if book else "Unknown Book"
             print(f"{'':<4}{book_id:<7} | {title[:40]:<40} | {status}")
     print("-" * 80)
 
+def book_title(book_id: int) -> str:
+    book = find_record(BOOK_FILE, BOOK_STRUCT, book_id)
+    return unpack_str(book[1]) if book else "Unknown Book"
+
+@timed("view_book_borrows")
+def view_book_borrows():
+    print("\n== View Borrows of a Book ==")
+    book_id = get_int("Book ID: ")
+    loans = book_borrows(book_id)
+    if not loans:
+        print(f"ไม่พบรายการยืมสำหรับ Book ID {book_id}")
+        return
+    print(f"Book ID: {book_id} | Title: {book_title(book_id)}")
+    print(f"{'':<4}{'MemberID':<9} | {'Date Out':<12} | {'Due Date':<12} | {'Return':<12} | {'Status'}")
+    for _, r in loans:
+        rr = decode_record(r)
+        print(f"{'':<4}{rr[0]:<9} | {rr[2]:<12} | {rr[3]:<12} | {rr[4]:<12} | {rr[5]}")
+
+@timed("update_borrow")
 def update_borrow():
     print("\n== Update Borrow Record ==")
     view_borrows() # แสดงข้อมูลทั้งหมดก่อน
-    borrows_raw = read_raw_records(BORROW_FILE, BORROW_STRUCT)
-    if not borrows_raw:
+    if not record_count(BORROW_FILE, BORROW_STRUCT):
         return
 
     member_id_to_edit = get_int("ใส่ Member ID ที่ต้องการแก้ไข: ")
     
-    # กรองรายการยืมเฉพาะของสมาชิกคนนี้
-    member_borrows_raw = [r for r in borrows_raw if r[0] == member_id_to_edit]
+    # รายการยืมเฉพาะของสมาชิกคนนี้จาก index (เก็บ slot ไว้แก้ไขตรงตำแหน่ง)
+    member_borrows_raw = member_borrows(member_id_to_edit)
     if not member_borrows_raw:
         print(f"ไม่พบรายการยืมสำหรับ Member ID {member_id_to_edit}")
         return
 
-    books_map = {b[0]: decode_record(b) for b in read_raw_records(BOOK_FILE, BOOK_STRUCT)}
     print(f"\nรายการหนังสือสำหรับ Member ID {member_id_to_edit}:")
-    for i, r in enumerate(member_borrows_raw):
+    for i, (_, r) in enumerate(member_borrows_raw):
         rr = decode_record(r)
-        book_info = books_map.get(rr[1], (None, "Unknown Book"))
-        print(f"  {i+1}: Book ID {rr[1]} ({book_info[1][:30]}) - Status: {rr[5]}")
+        print(f"  {i+1}: Book ID {rr[1]} ({book_title(rr[1])[:30]}) - Status: {rr[5]}")
 
     rec_num = get_int("เลือกลำดับหนังสือที่ต้องการแก้ไข: ", minv=1, maxv=len(member_borrows_raw))
-    record_to_update_raw = member_borrows_raw[rec_num - 1]
-    
-    # หา index ของ record นี้ใน list ดั้งเดิมทั้งหมด
-    original_index = -1
-    for i, r in enumerate(borrows_raw):
-        if r == record_to_update_raw:
-            original_index = i
-            break
-            
-    if original_index == -1:
-        print("เกิดข้อผิดพลาด: ไม่พบข้อมูลที่ต้องการแก้ไขในไฟล์หลัก")
-        return
+    slot, record_to_update_raw = member_borrows_raw[rec_num - 1]
     
     rr = decode_record(record_to_update_raw)
     print("\nข้อมูลเดิม:", rr)
@@ -375,116 +3104,627 @@ def update_borrow():
         pack_str(new_status, 20), fine_amount, pack_str(new_notes, 200)
     )
     
-    borrows_raw[original_index] = new_packed
-    write_raw_records(BORROW_FILE, BORROW_STRUCT, borrows_raw)
+    try:
+        write_record_at(BORROW_FILE, BORROW_STRUCT, slot, new_packed, expected=record_to_update_raw)
+    except ValueError as e:
+        print(f" {e}")
+        return
     print(" แก้ไขข้อมูลการยืมเรียบร้อย")
 
+@timed("loan_history")
+def loan_history():
+    print("\n== Loan History ==")
+    date_from = get_date("ตั้งแต่วันที่ยืม (YYYY-MM-DD, Enter=ทั้งหมด): ", allow_empty=True)
+    date_to = get_date("ถึงวันที่ยืม (YYYY-MM-DD, Enter=ทั้งหมด): ", allow_empty=True)
+    history_report(date_from or None, date_to or None)
+
+@timed("view_overdue")
+def view_overdue():
+    print("\n== Overdue Loans ==")
+    as_of = get_date("ณ วันที่ (YYYY-MM-DD, Enter=วันนี้): ", allow_empty=True)
+    loans = overdue_loans(as_of)
+    if not loans:
+        print(" ไม่มีรายการยืมที่เกินกำหนด")
+        return
+    print(f"{'MemberID':<9} {'BookID':<7} {'Title':<30} {'Due Date':<12} {'Days':>5} {'Fine':>9}")
+    print("-" * 80)
+    for _, raw, days in loans:
+        rr = decode_record(raw)
+        print(f"{rr[0]:<9} {rr[1]:<7} {book_title(rr[1])[:30]:<30} {rr[3]:<12} {days:>5} {rr[6]:>9.2f}")
+    print(f" เกินกำหนดทั้งหมด {len(loans)} รายการ")
+
+@timed("compute_overdue_fines")
+def compute_overdue_fines():
+    print("\n== Compute Fines ==")
+    as_of = get_date("ณ วันที่ (YYYY-MM-DD, Enter=วันนี้): ", allow_empty=True)
+    rate_str = input(f"ค่าปรับต่อวัน (Enter={FINE_PER_DAY}): ").strip()
+    try:
+        rate = parse_float(rate_str, minv=0) if rate_str else FINE_PER_DAY
+    except ValueError as e:
+        print(e)
+        return
+    overdue, changed = compute_fines(as_of, rate)
+    print(f" เกินกำหนด {overdue} รายการ, ปรับปรุงค่าปรับ {changed} รายการ")
+
+@timed("delete_borrow")
 def delete_borrow():
     print("\n== Delete Borrow Record ==")
     view_borrows() # แสดงข้อมูลทั้งหมดก่อน
-    borrows_raw = read_raw_records(BORROW_FILE, BORROW_STRUCT)
-    if not borrows_raw:
+    if not record_count(BORROW_FILE, BORROW_STRUCT):
         return
 
     member_id_to_delete = get_int("ใส่ Member ID ที่ต้องการลบรายการ: ")
     
-    member_borrows_raw = [r for r in borrows_raw if r[0] == member_id_to_delete]
+    member_borrows_raw = member_borrows(member_id_to_delete)
     if not member_borrows_raw:
         print(f"ไม่พบรายการยืมสำหรับ Member ID {member_id_to_delete}")
         return
 
-    books_map = {b[0]: decode_record(b) for b in read_raw_records(BOOK_FILE, BOOK_STRUCT)}
     print(f"\nรายการหนังสือสำหรับ Member ID {member_id_to_delete}:")
-    for i, r in enumerate(member_borrows_raw):
+    for i, (_, r) in enumerate(member_borrows_raw):
         rr = decode_record(r)
-        book_info = books_map.get(rr[1], (None, "Unknown Book"))
-        print(f"  {i+1}: Book ID {rr[1]} ({book_info[1][:30]}) - Status: {rr[5]}")
+        print(f"  {i+1}: Book ID {rr[1]} ({book_title(rr[1])[:30]}) - Status: {rr[5]}")
 
     rec_num = get_int("เลือกลำดับหนังสือที่ต้องการลบ: ", minv=1, maxv=len(member_borrows_raw))
-    record_to_delete_raw = member_borrows_raw[rec_num - 1]
+    slot, record_to_delete_raw = member_borrows_raw[rec_num - 1]
 
     confirm = input(f"ต้องการลบรายการยืมนี้ใช่หรือไม่? (y/n): ").strip().lower()
     if confirm == 'y':
-        borrows_raw.remove(record_to_delete_raw)
-        write_raw_records(BORROW_FILE, BORROW_STRUCT, borrows_raw)
+        try:
+            delete_record_at(BORROW_FILE, BORROW_STRUCT, slot, expected=record_to_delete_raw)
+        except ValueError as e:
+            print(f" {e}")
+            return
         print(" ลบข้อมูลการยืมสำเร็จ")
     else:
         print("ยกเลิกการลบ")
 
+# ---------------- Columnar arrays (NumPy) ----------------
+# The .dat files are arrays of fixed-size records, so with numpy a table can be
+# memory-mapped as a structured array whose dtype mirrors the struct layout
+# and aggregated column-wise without decoding a row in Python. In legacy files
+# strings stay raw bytes (numpy ignores the trailing NUL padding when
+# comparing) and dates are "YYYY-MM-DD", so byte order is date order; compact
+# files have day numbers, status codes and heap references instead, and the
+# _column helpers below hide the difference.
+def require_numpy():
+    if np is None:
+        raise ImportError("ต้องติดตั้ง numpy ก่อนใช้งานส่วนนี้ (pip install numpy)")
+
+def numpy_dtype(st: struct.Struct):
+    require_numpy()
+    names = [name for name, _, _ in TABLE_COLUMNS[st]]
+    formats = [f"S{fst.size}" if is_string else "<" + fst.format[-1] for _, fst, is_string in field_layout(st)]
+    offsets = [offset for offset, _, _ in field_layout(st)]
+    return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": st.size})
+
+def table_array(filename: str, st: struct.Struct):
+    """Read-only structured array over every slot of filename (tombstones included).
+
+    Hold table_lock(filename) while using it."""
+    fmt = table_format(filename, st)
+    dtype = numpy_dtype(st) if fmt.version == 1 else fmt.numpy_dtype()
+    slots = record_count(filename, st)
+    if slots == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", offset=fmt.header_size, shape=(slots,))
+
+def segment_array(path: str):
+    """Structured array of the records of an archive segment (legacy layout)."""
+    return np.frombuffer(b"".join(segment_data(path, BORROW_STRUCT)), dtype=numpy_dtype(BORROW_STRUCT))
+
+def live_mask(arr):
+    return arr[arr.dtype.names[0]] != TOMBSTONE
+
+def active_mask(borrows, fmt):
+    if fmt.version == 2:
+        codes = borrows["status"]
+        mask = np.isin(codes, [code for code, name in enumerate(STATUS_NAMES, 1) if is_active_borrow(name)])
+        for slot in np.flatnonzero(codes == 0).tolist():
+            text = fmt.heap.read(int(borrows["status_off"][slot]), int(borrows["status_len"][slot]))
+            mask[slot] = is_active_borrow(unpack_str(text))
+        return mask & live_mask(borrows)
+    # vectorized is_active_borrow(): "borrow" in any case, then only spaces/NULs
+    width = borrows.dtype["status"].itemsize
+    raw = borrows["status"].astype(f"S{width}").view(np.uint8).reshape(-1, width)
+    lowered = np.where((raw >= ord("A")) & (raw <= ord("Z")), raw + 32, raw)
+    word = np.frombuffer(b"borrow", dtype=np.uint8)
+    rest = lowered[:, len(word):]
+    return ((lowered[:, :len(word)] == word).all(axis=1)
+            & ((rest == 0) | (rest == ord(" "))).all(axis=1)
+            & live_mask(borrows))
+
+def _legacy_dates(col):
+    # date bytes of a legacy column as b"YYYY-MM-DD"; rows written before
+    # parse_date() padded its result ("2025-9-7") are rewritten so that byte
+    # order is date order
+    raw = np.ascontiguousarray(col).view(np.uint8).reshape(len(col), col.itemsize)
+    odd = np.flatnonzero((raw[:, 0] != 0)
+                         & ((raw[:, 4] != ord("-")) | (raw[:, 7] != ord("-")) | (raw[:, 9] == 0)))
+    if len(odd) == 0:
+        return col
+    col = col.copy()
+    for i in odd.tolist():
+        try:
+            col[i] = _date_field(day_number(col[i].decode()), col.itemsize)
+        except ValueError:
+            pass
+    return col
+
+def _dates_before_column(arr, fmt, name: str, date_str: str):
+    # non-empty dates earlier than date_str
+    col = arr[name]
+    if fmt.version == 2:
+        return (col != NO_DATE) & (col < day_number(date_str))
+    return (col != b"") & (_legacy_dates(col) < parse_date(date_str).encode())
+
+def _month_column(arr, fmt, name: str):
+    # b"YYYY-MM" of a date column, b"" where empty
+    col = arr[name]
+    if fmt.version == 2:
+        empty = col == NO_DATE
+        months = np.where(empty, 0, col).astype("datetime64[D]").astype("datetime64[M]").astype("S7")
+        return np.where(empty, b"", months)
+    return _legacy_dates(col).astype("S7")
+
+def _text_column(arr, fmt, name: str):
+    # the bytes of a string column for every slot (heap reads for compact files)
+    if fmt.version == 2 and name + "_off" in arr.dtype.names:
+        width = dict((n, opts) for n, _, opts in TABLE_COLUMNS[fmt.st])[name]["maxlen"]
+        refs = zip(arr[name + "_off"].tolist(), arr[name + "_len"].tolist())
+        return np.array([fmt.heap.read(off, length) for off, length in refs], dtype=f"S{width}")
+    return arr[name]
+
+def _first_slots(ids, live):
+    # (sorted live ids, slot of each): the lowest slot per id, like find_slot()
+    slots = np.flatnonzero(live)
+    unique_ids, first = np.unique(ids[slots], return_index=True)
+    return unique_ids, slots[first]
+
+def _lookup_slots(sorted_ids, slots, keys):
+    # slot for every key, -1 where the id does not exist
+    if len(sorted_ids) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_ids, keys).clip(max=len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == keys, slots[pos], -1)
+
+@timed("array_loan_groups")
+def array_loan_groups():
+    """(active loan total, groups) for the borrows report, computed with numpy.
+
+    groups yields (member_id, member slot or None, [(loan slot, book slot or
+    None), ...]) in member_id order; loan slots ascending within a member."""
+    with table_lock(BORROW_FILE), table_lock(MEMBER_FILE), table_lock(BOOK_FILE):
+        entries = np.array(active_loans(), dtype=np.int64).reshape(-1, 2)
+        member_ids, loan_slots = entries[:, 0], entries[:, 1]
+        borrows = table_array(BORROW_FILE, BORROW_STRUCT)
+        members = table_array(MEMBER_FILE, MEMBER_STRUCT)
+        books = table_array(BOOK_FILE, BOOK_STRUCT)
+        book_slots = _lookup_slots(*_first_slots(books["book_id"], live_mask(books)),
+                                   borrows["book_id"][loan_slots])
+        group_ids, starts = np.unique(member_ids, return_index=True)
+        member_slots = _lookup_slots(*_first_slots(members["member_id"], live_mask(members)), group_ids)
+        del borrows, members, books
+    ends = list(starts[1:]) + [len(loan_slots)]
+    loan_slots, book_slots = loan_slots.tolist(), book_slots.tolist()
+
+    def groups():
+        for member_id, member_slot, start, end in zip(group_ids.tolist(), member_slots.tolist(),
+                                                      starts.tolist(), ends):
+            loans = [(slot, book_slot if book_slot >= 0 else None)
+                     for slot, book_slot in zip(loan_slots[start:end], book_slots[start:end])]
+            yield member_id, (member_slot if member_slot >= 0 else None), loans
+    return len(loan_slots), groups()
+
+def _sum_by(keys, weights=None):
+    # (unique keys, sum of weights (count when None) per key)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=weights, minlength=len(unique))
+
+@timed("library_analytics")
+def library_analytics(as_of: str = None) -> dict:
+    """Collection and circulation figures from books.dat and borrows.dat.
+
+    Fines per member and circulation by month cover the whole history: the
+    archive segments are read one at a time along with the hot file.
+    as_of: "YYYY-MM-DD" for the overdue count (default today)."""
+    require_numpy()
+    as_of = as_of or datetime.date.today().isoformat()
+    with table_lock(BORROW_FILE), table_lock(BOOK_FILE):
+        books_fmt, borrows_fmt = table_format(BOOK_FILE, BOOK_STRUCT), table_format(BORROW_FILE, BORROW_STRUCT)
+        books = table_array(BOOK_FILE, BOOK_STRUCT)
+        borrows = table_array(BORROW_FILE, BORROW_STRUCT)
+        live_books = books[live_mask(books)]
+        loans = borrows[live_mask(borrows)]
+        active = active_mask(borrows, borrows_fmt)[live_mask(borrows)]
+
+        borrowed_ids, borrowed = np.unique(loans["book_id"][active], return_counts=True)
+        overdue = int(_dates_before_column(loans[active], borrows_fmt, "date_due", as_of).sum())
+
+        book_index = _first_slots(books["book_id"], live_mask(books))
+        categories = _text_column(books, books_fmt, "category")
+        fine_parts, circulation_parts = [], []
+
+        def add_history(loans, fmt):
+            # reduce one array of loans to fines per member and loans per (category, month)
+            fine_parts.append(_sum_by(loans["member_id"], loans["fine"].astype(np.float64)))
+            book_slots = _lookup_slots(*book_index, loans["book_id"])
+            keys = np.zeros(len(loans), dtype=[("category", categories.dtype), ("month", "S7")])
+            if len(categories):
+                keys["category"] = np.where(book_slots >= 0, categories[book_slots.clip(min=0)], b"")
+            keys["month"] = _month_column(loans, fmt, "date_out")
+            circulation_parts.append(_sum_by(keys))
+
+        add_history(loans, borrows_fmt)
+        archived = 0
+        for path in archive_segments(BORROW_FILE).values():
+            segment = segment_array(path)
+            archived += len(segment)
+            add_history(segment, LegacyFormat(BORROW_STRUCT))
+            del segment
+        fine_members, fines = _sum_by(np.concatenate([m for m, _ in fine_parts]),
+                                      np.concatenate([f for _, f in fine_parts]))
+        circulation, circulation_counts = _sum_by(np.concatenate([k for k, _ in circulation_parts]),
+                                                  np.concatenate([n for _, n in circulation_parts]))
+        circulation_counts = circulation_counts.astype(np.int64)
+        titles, copies = len(live_books), int(live_books["total_copies"].sum())
+        borrowed_total = int(borrowed.sum())
+        del books, borrows, live_books, loans
+
+    return {
+        "as_of": as_of,
+        "titles": titles,
+        "copies": copies,
+        "borrowed": borrowed_total,
+        "available": copies - borrowed_total,
+        "overdue": overdue,
+        "archived": archived,
+        "borrowed_per_book": dict(zip(borrowed_ids.tolist(), borrowed.tolist())),
+        "fines_per_member": dict(zip(fine_members.tolist(), fines.tolist())),
+        "circulation": {(unpack_str(c), unpack_str(m)): n for (c, m), n in
+                        zip(circulation.tolist(), circulation_counts.tolist())},
+    }
+
+# ---------------- Parallel scans ----------------
+# Records are fixed-size, so a table splits cleanly into slot ranges. A
+# parallel scan hands each range (shard) to a worker process, which maps the
+# file itself, decodes only its slice and returns a partial result; the
+# caller merges the partials, which come back in slot order. The caller holds
+# the table's shared lock for the whole scan, so no writer can change the file
+# under the workers. Mappers run in other processes: they must be module-level
+# functions (or functools.partial of one) and return picklable results.
+# Workers never fork from the caller: in a threaded process (the server) a
+# forked child would inherit the other threads' flock descriptors, keeping
+# their table locks held until it exits, and could deadlock on a Python lock
+# another thread held at the time. They start from a clean forkserver (or
+# spawned, where there is no forkserver) process instead.
+SCAN_WORKERS = os.cpu_count() or 1
+SCAN_SHARD_RECORDS = 500_000  # upper bound per shard, keeps worker memory flat
+SCAN_PARALLEL_MIN = 200_000  # smaller tables are scanned in this process
+_SCAN_STRUCTS = {st.format: st for _, st in TABLES}  # Struct objects do not pickle
+
+def _scan_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def scan_shards(records: int, workers: int) -> list:
+    shards = max(workers, -(-records // SCAN_SHARD_RECORDS))
+    step = max(1, -(-records // shards))
+    return [(lo, min(lo + step, records)) for lo in range(0, records, step)]
+
+def _live_records(rows, start: int):
+    for slot, raw in enumerate(rows, start):
+        if raw[0] != TOMBSTONE:
+            yield slot, raw
+
+def _scan_shard(filename: str, st_format: str, start: int, stop: int, mapper):
+    fmt = table_format(filename, _SCAN_STRUCTS[st_format])
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mv = memoryview(mm)[record_offset(fmt, start):record_offset(fmt, stop)]
+        records = _live_records(fmt.iter_decode(mv), start)
+        try:
+            return mapper(records)
+        finally:
+            records.close()
+            mv.release()
+
+@timed("parallel_scan")
+def parallel_scan(filename: str, st: struct.Struct, mapper, workers: int = None) -> list:
+    """Partial results of mapper over the shards of filename, in slot order.
+
+    mapper gets an iterator of (slot, raw) for the live records of one shard."""
+    workers = workers or SCAN_WORKERS
+    with table_lock(filename):
+        ensure_recovered(filename, st)
+        records = record_count(filename, st)
+        if not records:
+            return []
+        count("records_scanned", records)  # decoded in the workers: no decode time here
+        if workers <= 1 or records < SCAN_PARALLEL_MIN:
+            return [_scan_shard(filename, st.format, 0, records, mapper)]
+        shards = scan_shards(records, workers)
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=_scan_context()) as pool:
+            futures = [pool.submit(_scan_shard, filename, st.format, lo, hi, mapper) for lo, hi in shards]
+            return [future.result() for future in futures]
+
+def _filter_shard(predicate, records) -> list:
+    return [(slot, raw) for slot, raw in records if predicate(raw)]
+
+def parallel_filter(filename: str, st: struct.Struct, predicate, workers: int = None) -> list:
+    """[(slot, raw)] of the live records for which predicate(raw) is true, in slot order."""
+    parts = parallel_scan(filename, st, functools.partial(_filter_shard, predicate), workers)
+    return [item for part in parts for item in part]
+
+def _status_is(status: str, raw) -> bool:
+    return unpack_str(raw[5]).lower() == status.lower()
+
+def loans_by_status(status: str) -> list:
+    return parallel_filter(BORROW_FILE, BORROW_STRUCT, functools.partial(_status_is, status))
+
+def _loan_stats_shard(records) -> dict:
+    stats = {"loans": 0, "active": 0, "fines": 0.0, "by_book": collections.Counter(),
+             "by_member": collections.Counter(), "fines_by_member": collections.Counter()}
+    for _, raw in records:
+        stats["loans"] += 1
+        if raw[6]:
+            stats["fines"] += raw[6]
+            stats["fines_by_member"][raw[0]] += raw[6]
+        if is_active_borrow(unpack_str(raw[5])):
+            stats["active"] += 1
+            stats["by_book"][raw[1]] += 1
+            stats["by_member"][raw[0]] += 1
+    return stats
+
+@timed("loan_stats")
+def loan_stats(workers: int = None, archive: bool = True) -> dict:
+    """Totals over borrows.dat: loans, active loans and fines, overall and
+    per book / per member (active loans only). With archive, loans and fines
+    include the archived loans (which are never active)."""
+    total = _loan_stats_shard(())
+    with table_lock(BORROW_FILE):
+        parts = parallel_scan(BORROW_FILE, BORROW_STRUCT, _loan_stats_shard, workers)
+        if archive:
+            parts += [_loan_stats_shard((None, raw) for raw in iter_segment(path))
+                      for path in archive_segments(BORROW_FILE).values()]
+    for part in parts:
+        for key, value in part.items():
+            total[key] += value
+    return total
+
+def _loans_by_member_shard(records) -> dict:
+    grouped = {}
+    for _, raw in records:
+        grouped.setdefault(raw[0], []).append((raw[1], unpack_str(raw[5])))
+    return grouped
+
+def loans_by_member(workers: int = None) -> dict:
+    # member_id -> [(book_id, status)], members in order of their first loan
+    grouped = {}
+    for part in parallel_scan(BORROW_FILE, BORROW_STRUCT, _loans_by_member_shard, workers):
+        for member_id, loans in part.items():
+            grouped.setdefault(member_id, []).extend(loans)
+    return grouped
+
 # ---------------- Report ----------------
-def generate_report():
-    print("\nGenerating reports...")
-    books_raw = read_raw_records(BOOK_FILE, BOOK_STRUCT)
-    books = [decode_record(r) for r in books_raw]
-    books_map = {b[0]: b for b in books}
-    
-    members_map = {m[0]: decode_record(m) for m in read_raw_records(MEMBER_FILE, MEMBER_STRUCT)}
-    borrows_raw = read_raw_records(BORROW_FILE, BORROW_STRUCT)
-    borrows = [decode_record(r) for r in borrows_raw]
-    
-    now = datetime.datetime.now()
+# The report is rendered from state that the writes keep up to date, so its
+# cost follows the size of the output rather than the loan history: borrowed
+# counts per book come from the availability table, and the active loans
+# grouped by member from the "active" index of borrows.dat ((member_id, slot)
+# pairs of active loans in order). Both are updated with every write
+# (after_write) and carry the number of records they cover, which is how a
+# stale copy is detected and rebuilt.
+def active_loans() -> list:
+    # sorted [(member_id, slot)] of the active loans
+    return index_range(BORROW_FILE, BORROW_STRUCT, "active", -2**31, 2**31)
+
+def id_slots(filename: str, st: struct.Struct) -> dict:
+    # id -> slot of every live record, from one read of the "id" index
+    slots = {}
+    for key, slot in index_range(filename, st, "id", -2**31, 2**31):
+        slots.setdefault(key, slot)
+    return slots
+
+def index_loan_groups(entries):
+    # the same groups as array_loan_groups(), joined through the id indexes
+    book_slots, member_slots = id_slots(BOOK_FILE, BOOK_STRUCT), id_slots(MEMBER_FILE, MEMBER_STRUCT)
+    with open_table(BORROW_FILE, BORROW_STRUCT) as borrows:
+        for member_id, pairs in itertools.groupby(entries, key=lambda p: p[0]):
+            loans = [(slot, book_slots.get(borrows[slot][1])) for _, slot in pairs]
+            yield member_id, member_slots.get(member_id), loans
 
-    with open("books_report.txt", "w", encoding="utf-8") as f:
-        # ... (same as before)
-        f.write("Library Borrow System – Book Summary Report\n")
-        f.write(f"Generated At : {now.strftime('%Y-%m-%d %H:%M')} (+07:00)\n\n")
-        f.write(f"{'BookID':<6} | {'Title':<30} | {'Author':<20} | {'Year':<5} | {'Copies':<7} | {'Borrowed':<9} | {'Status'}\n")
-        f.write("-" * 95 + "\n")
-        borrowed_counts = {b_id: 0 for b_id in books_map.keys()}
-        active_borrows_list = [br for br in borrows if br[5].lower() == 'borrow']
-        for br in active_borrows_list:
-            book_id = br[1]
-            if book_id in borrowed_counts:
-                borrowed_counts[book_id] += 1
-        total_copies_sum = sum(b[8] for b in books)
+def write_books_report(f, now, borrowed_counts: dict):
+    f.write("Library Borrow System – Book Summary Report\n")
+    f.write(f"Generated At : {now.strftime('%Y-%m-%d %H:%M')} (+07:00)\n\n")
+    f.write(f"{'BookID':<6} | {'Title':<30} | {'Author':<20} | {'Year':<5} | {'Copies':<7} | {'Borrowed':<9} | {'Status'}\n")
+    f.write("-" * 95 + "\n")
+    titles = total_copies_sum = borrowed_sum = 0
+    with open_table(BOOK_FILE, BOOK_STRUCT) as books:
         for b in books:
-            book_id, title, author, _, year, _, _, _, total_copies = b
+            book_id, total_copies = b[0], b[8]
             borrowed = borrowed_counts.get(book_id, 0)
-            f.write(f"{book_id:<6} | {title[:30]:<30} | {author[:20]:<20} | {str(year):<5} | {total_copies:<7} | {borrowed:<9} | {'Active'}\n")
-        f.write("\n\nSummary (Active Books Only)\n")
-        f.write(f"- Total Book Titles : {len(books)}\n")
-        f.write(f"- Total Copies      : {total_copies_sum}\n")
-        f.write(f"- Borrowed Now      : {sum(borrowed_counts.values())}\n")
-        f.write(f"- Available Now     : {total_copies_sum - sum(borrowed_counts.values())}\n")
-
-    with open("borrows_report.txt", "w", encoding="utf-8") as f:
-        # ... (same as before, grouped)
-        f.write("Library Borrow System – Borrowed Report\n")
-        f.write(f"Generated At : {now.strftime('%Y-%m-%d %H:%M')} (+07:00)\n\n")
-        grouped_borrows = {}
-        for br in active_borrows_list:
-            member_id = br[0]
-            if member_id not in grouped_borrows:
-                grouped_borrows[member_id] = []
-            grouped_borrows[member_id].append(br)
-        for member_id, borrows_list in grouped_borrows.items():
-            member_info = members_map.get(member_id)
-            if not member_info: continue
+            f.write(f"{book_id:<6} | {b[1][:30]:<30} | {b[2][:20]:<20} | {str(b[4]):<5} | {total_copies:<7} | {borrowed:<9} | {'Active'}\n")
+            titles += 1
+            total_copies_sum += total_copies
+            borrowed_sum += borrowed
+    f.write("\n\nSummary (Active Books Only)\n")
+    f.write(f"- Total Book Titles : {titles}\n")
+    f.write(f"- Total Copies      : {total_copies_sum}\n")
+    f.write(f"- Borrowed Now      : {borrowed_sum}\n")
+    f.write(f"- Available Now     : {total_copies_sum - borrowed_sum}\n")
+
+def write_borrows_report(f, now, active_total: int, groups):
+    # groups: (member_id, member slot or None, [(loan slot, book slot or None)])
+    f.write("Library Borrow System – Borrowed Report\n")
+    f.write(f"Generated At : {now.strftime('%Y-%m-%d %H:%M')} (+07:00)\n\n")
+    members_with_borrows = 0
+    with open_table(BORROW_FILE, BORROW_STRUCT) as borrows, \
+            open_table(BOOK_FILE, BOOK_STRUCT) as books, \
+            open_table(MEMBER_FILE, MEMBER_STRUCT) as members:
+        for member_id, member_slot, loans in groups:
+            members_with_borrows += 1
+            if member_slot is None: continue
+            member_info = members[member_slot]
             f.write("-" * 120 + "\n")
             f.write(f"MemberID: {member_id:<5} | Name: {member_info[1]:<30} | Email: {member_info[6]}\n")
             f.write(f"{'':<4}{'BookID':<7} | {'Title':<40} | {'Author':<20} | {'Date Out':<12} | {'Due Date':<12} | {'Fine'}\n")
             f.write(f"{'':<4}{'-'*110}\n")
-            for item in borrows_list:
-                book_id, book_info = item[1], books_map.get(item[1], (None, "N/A", "N/A"))
-                title, author = book_info[1], book_info[2]
+            for slot, book_slot in loans:
+                item = borrows[slot]
+                book_id = item[1]
+                if book_slot is None:
+                    title, author = "N/A", "N/A"
+                else:
+                    title, author = books[book_slot][1], books[book_slot][2]
                 date_out, date_due, fine = item[2], item[3], item[6]
                 f.write(f"{'':<4}{book_id:<7} | {title[:40]:<40} | {author[:20]:<20} | {date_out:<12} | {date_due:<12} | {fine:.2f}\n")
             f.write("\n")
-        f.write("-" * 120 + "\n")
-        f.write("Summary (Borrowed Only)\n")
-        f.write(f"- Total Borrowed Books : {len(active_borrows_list)}\n")
-        f.write(f"- Members with Borrows : {len(grouped_borrows)}\n")
+    f.write("-" * 120 + "\n")
+    f.write("Summary (Borrowed Only)\n")
+    f.write(f"- Total Borrowed Books : {active_total}\n")
+    f.write(f"- Members with Borrows : {members_with_borrows}\n")
+
+def write_reports(books_f, borrows_f):
+    # both reports into open text files (the server sends them back as text)
+    now = datetime.datetime.now()
+    # bring the derived data up to date first: with the tables locked shared a
+    # rebuild would have to upgrade (see Locking)
+    for filename, st in TABLES:
+        ensure_indexes(filename, st)
+    ensure_availability()
+    # both reports, the grouping and the slots it returns come from one state
+    # of the three tables (locked in the order used everywhere: borrows,
+    # members, books)
+    with table_lock(BORROW_FILE), table_lock(MEMBER_FILE), table_lock(BOOK_FILE):
+        with span("generate_report.books"):
+            write_books_report(books_f, now, availability_counts())
+        if np is not None:
+            # same report, with the id joins done column-wise
+            with span("generate_report.group"):
+                active_total, groups = array_loan_groups()
+        else:
+            with span("generate_report.group"):
+                entries = active_loans()
+            active_total, groups = len(entries), index_loan_groups(entries)
+        with span("generate_report.write"):
+            write_borrows_report(borrows_f, now, active_total, groups)
 
+@timed("generate_report")
+def generate_report():
+    print("\nGenerating reports...")
+    with open("books_report.txt", "w", encoding="utf-8") as books_f, \
+            open("borrows_report.txt", "w", encoding="utf-8") as borrows_f:
+        write_reports(books_f, borrows_f)
     print(" รายงานถูกสร้าง: books_report.txt, borrows_report.txt")
 
+@timed("analytics_report")
+def analytics_report(as_of: str = None):
+    print("\nGenerating analytics...")
+    try:
+        stats = library_analytics(as_of)
+    except ImportError as e:
+        print(f" {e}")
+        return
+    with open("analytics_report.txt", "w", encoding="utf-8") as f:
+        f.write("Library Borrow System – Analytics Report\n")
+        f.write(f"As Of : {stats['as_of']}\n\n")
+        f.write("Collection\n")
+        f.write(f"- Total Book Titles : {stats['titles']}\n")
+        f.write(f"- Total Copies      : {stats['copies']}\n")
+        f.write(f"- Borrowed Now      : {stats['borrowed']}\n")
+        f.write(f"- Available Now     : {stats['available']}\n")
+        f.write(f"- Overdue Loans     : {stats['overdue']}\n")
+        f.write(f"- Archived Loans    : {stats['archived']} (included below)\n\n")
+        f.write(f"{'MemberID':<10} | {'Fines':>12}\n")
+        f.write("-" * 30 + "\n")
+        for member_id, total in sorted(stats["fines_per_member"].items(), key=lambda kv: (-kv[1], kv[0])):
+            if total:
+                f.write(f"{member_id:<10} | {total:>12.2f}\n")
+        f.write(f"\n{'Month':<8} | {'Category':<30} | {'Loans':>8}\n")
+        f.write("-" * 54 + "\n")
+        for (category, month), loans in sorted(stats["circulation"].items(), key=lambda kv: (kv[0][1], kv[0][0])):
+            f.write(f"{month:<8} | {(category or '-')[:30]:<30} | {loans:>8}\n")
+    print(f" ยืมอยู่ {stats['borrowed']} เล่ม, เกินกำหนด {stats['overdue']} รายการ, "
+          f"ค่าปรับรวม {sum(stats['fines_per_member'].values()):.2f}")
+    print(" รายงานถูกสร้าง: analytics_report.txt")
+
+@timed("history_report")
+def history_report(date_from: str = None, date_to: str = None):
+    # every loan (hot and archived) with date_out in the range, oldest segment first
+    print("\nGenerating loan history...")
+    loans = archived = 0
+    fines = 0.0
+    # one consistent pass: no archive run between the segments and the hot file
+    with table_lock(BORROW_FILE), open("history_report.txt", "w", encoding="utf-8") as f:
+        f.write("Library Borrow System – Loan History Report\n")
+        f.write(f"Date Out : {date_from or '-'} .. {date_to or '-'}\n\n")
+        f.write(f"{'MemberID':<9} | {'BookID':<7} | {'Date Out':<12} | {'Due Date':<12} | {'Return':<12} | {'Status':<10} | {'Fine':>9} | {'Where'}\n")
+        f.write("-" * 100 + "\n")
+        for slot, raw in query_loans(date_from, date_to):
+            rr = decode_record(raw)
+            f.write(f"{rr[0]:<9} | {rr[1]:<7} | {rr[2]:<12} | {rr[3]:<12} | {rr[4]:<12} | {rr[5]:<10} | {rr[6]:>9.2f} | {'archive' if slot is None else 'hot'}\n")
+            loans += 1
+            archived += slot is None
+            fines += rr[6]
+        f.write("\nSummary\n")
+        f.write(f"- Loans          : {loans}\n")
+        f.write(f"- From Archive   : {archived}\n")
+        f.write(f"- Total Fines    : {fines:.2f}\n")
+    print(f" {loans} รายการ (จาก archive {archived} รายการ)")
+    print(" รายงานถูกสร้าง: history_report.txt")
+
+# ---------------- Maintenance ----------------
+@timed("rebuild_availability_table")
+def rebuild_availability_table():
+    print("\n== Rebuild Availability Table ==")
+    counts = rebuild_availability()
+    print(f" สร้างใหม่แล้ว: {len(counts)} รายการหนังสือ, ยืมอยู่ {sum(counts.values())} เล่ม")
+
+@timed("compact_data")
+def compact_data():
+    print("\n== Compact Data Files ==")
+    for filename, st in TABLES:
+        reclaimed = compact_file(filename, st)
+        print(f" {filename}: คืนพื้นที่ {reclaimed} records ({reclaimed * table_format(filename, st).size} bytes)")
+
+@timed("archive_data")
+def archive_data():
+    print("\n== Archive Returned Loans ==")
+    before = get_date("ย้ายรายการที่คืนแล้วซึ่งยืมก่อนวันที่ (YYYY-MM-DD, Enter=ต้นเดือนนี้): ", allow_empty=True)
+    moved = archive_loans(before or None)
+    stats = archive_stats()
+    print(f" ย้ายไป archive {moved} รายการ, เหลือใน {BORROW_FILE} {record_count(BORROW_FILE, BORROW_STRUCT)} records")
+    print(f" archive: {len(stats)} เดือน, {sum(n for _, n, _ in stats)} รายการ, {sum(b for _, _, b in stats)} bytes")
+
+@timed("checkpoint_data")
+def checkpoint_data():
+    print("\n== Checkpoint WAL ==")
+    for filename, _ in TABLES:
+        before = wal_for(filename).size()
+        checkpoint_table(filename)
+        print(f" {filename}.wal: {before} -> {wal_for(filename).size()} bytes")
+
+@timed("dump_metrics_file")
+def dump_metrics_file():
+    print("\n== Dump Metrics ==")
+    if not METRICS_ENABLED:
+        print(" ยังไม่ได้เปิดการเก็บ metrics (ตั้งค่า LIBRARY_METRICS=1 ก่อนเริ่มโปรแกรม)")
+        return
+    path = input("ชื่อไฟล์ (.json หรือ .prom, Enter=metrics.json): ").strip() or "metrics.json"
+    dump_metrics(path)
+    print(f" บันทึก metrics แล้ว: {path}")
+
 # ---------------- Menu ----------------
 def main_menu():
+    for filename, st in TABLES:
+        recover_table(filename, st)
     while True:
         print("\n===== Library System =====")
         print("1. Books")
         print("2. Members")
         print("3. Borrows")
         print("4. Generate Report")
+        print("5. Maintenance")
+        print("6. Analytics")
         print("0. Exit")
         c = input("เลือก: ").strip()
         if c == "1":
@@ -495,12 +3735,16 @@ def main_menu():
                 print("2. View Books")
                 print("3. Update Book")
                 print("4. Delete Book")
+                print("5. Search Books")
+                print("6. Query Books")
                 print("0. Back")
                 cc = input("เลือก: ").strip()
                 if cc == "1": add_book()
                 elif cc == "2": view_books()
                 elif cc == "3": update_book()
                 elif cc == "4": delete_book()
+                elif cc == "5": search_book()
+                elif cc == "6": query_book()
                 elif cc == "0": break
         elif c == "2":
             # ... (Member Menu)
@@ -510,12 +3754,16 @@ def main_menu():
                 print("2. View Members")
                 print("3. Update Member")
                 print("4. Delete Member")
+                print("5. Search Members")
+                print("6. Query Members")
                 print("0. Back")
                 cc = input("เลือก: ").strip()
                 if cc == "1": add_member()
                 elif cc == "2": view_members()
                 elif cc == "3": update_member()
                 elif cc == "4": delete_member()
+                elif cc == "5": search_member()
+                elif cc == "6": query_member()
                 elif cc == "0": break
         elif c == "3":
             while True:
@@ -524,17 +3772,45 @@ def main_menu():
                 print("2. View Borrows")
                 print("3. Update Borrow")
                 print("4. Delete Borrow")
+                print("5. View Borrows of a Book")
+                print("6. Overdue Loans")
+                print("7. Compute Fines")
+                print("8. Loan History (incl. archive)")
                 print("0. Back")
                 cc = input("เลือก: ").strip()
                 if cc == "1": add_borrow()
                 elif cc == "2": view_borrows()
                 elif cc == "3": update_borrow()
                 elif cc == "4": delete_borrow()
+                elif cc == "5": view_book_borrows()
+                elif cc == "6": view_overdue()
+                elif cc == "7": compute_overdue_fines()
+                elif cc == "8": loan_history()
                 elif cc == "0": break
                 else: print(" เลือกไม่ถูกต้อง")
         elif c == "4":
             generate_report()
+        elif c == "5":
+            while True:
+                print("\n-- Maintenance Menu --")
+                print("1. Compact data files")
+                print("2. Rebuild availability table")
+                print("3. Checkpoint WAL")
+                print("4. Archive returned loans")
+                print("5. Dump metrics")
+                print("0. Back")
+                cc = input("เลือก: ").strip()
+                if cc == "1": compact_data()
+                elif cc == "2": rebuild_availability_table()
+                elif cc == "3": checkpoint_data()
+                elif cc == "4": archive_data()
+                elif cc == "5": dump_metrics_file()
+                elif cc == "0": break
+                else: print(" เลือกไม่ถูกต้อง")
+        elif c == "6":
+            analytics_report()
         elif c == "0":
+            checkpoint_all()
             print("Bye")
             break
         else:
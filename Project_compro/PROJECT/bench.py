@@ -0,0 +1,335 @@
+"""Benchmarks for the library storage engine on synthetic data.
+
+    python PROJECT/bench.py                              # 10^3 and 10^4 loans
+    python PROJECT/bench.py --sizes 1e3,1e5,1e6 --output before.json
+    python PROJECT/bench.py --sizes 1e7 --ops read_raw_records,generate_report
+
+For every size a fresh dataset is generated in a temporary folder (or --dir)
+with the exact BOOK_STRUCT/MEMBER_STRUCT/BORROW_STRUCT layouts and Thai UTF-8
+text: `size` loans, size/10 books and size/20 members (converted to the
+compact format first with --format 2). Each operation runs
+without prompts (menu output goes to os.devnull) and is timed with
+perf_counter; the JSON result also records the process memory high-water mark
+(ru_maxrss) after the operation and, with --tracemalloc, the peak Python
+allocation during it, and with LIBRARY_METRICS=1 set the storage counters
+(records scanned, bytes read/written, fsyncs, ...) of the operation. Compare
+two result files to spot regressions.
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows: no ru_maxrss
+    resource = None
+
+import Project as P
+
+DEFAULT_SIZES = "1e3,1e4"
+GENERATE_CHUNK = 50_000
+
+THAI_WORDS = ("หนังสือ", "ความรู้", "ประวัติศาสตร์", "วิทยาศาสตร์", "คณิตศาสตร์", "ภาษาไทย", "การเขียน",
+              "โปรแกรม", "ข้อมูล", "ระบบ", "เบื้องต้น", "ขั้นสูง", "นิทาน", "วรรณคดี", "ศิลปะ", "ดนตรี",
+              "อาหาร", "สุขภาพ", "ธรรมชาติ", "ท่องเที่ยว", "เศรษฐศาสตร์", "ปรัชญา", "จิตวิทยา", "กีฬา")
+FIRST_NAMES = ("สมชาย", "สมหญิง", "วิชัย", "มาลี", "ประเสริฐ", "สุดา", "อนันต์", "กมล", "ปิยะ", "ศิริพร",
+               "ธนา", "นภา", "Somchai", "Malee", "John", "Anna")
+LAST_NAMES = ("ใจดี", "รักเรียน", "ศรีสุข", "มั่นคง", "วงศ์ไทย", "บุญมา", "แก้วใส", "ทองคำ", "Smith", "Lee")
+PUBLISHERS = ("สำนักพิมพ์มหาวิทยาลัย", "ซีเอ็ดยูเคชั่น", "นานมีบุ๊คส์", "อมรินทร์", "O'Reilly", "Springer")
+CATEGORIES = ("นวนิยาย", "วิชาการ", "คอมพิวเตอร์", "เด็ก", "ประวัติศาสตร์", "Science", "Fiction")
+LANGUAGES = ("ไทย", "English", "日本語")
+STATUSES = ("Borrow", "Borrow", "Return", "Return", "Return", "Lost")
+
+
+def _date(rnd, start_year, end_year):
+    start = datetime.date(start_year, 1, 1).toordinal()
+    end = datetime.date(end_year, 12, 31).toordinal()
+    return datetime.date.fromordinal(rnd.randint(start, end))
+
+
+def _words(rnd, lo, hi):
+    return " ".join(rnd.choice(THAI_WORDS) for _ in range(rnd.randint(lo, hi)))
+
+
+def _name(rnd):
+    return f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+
+
+def book_row(rnd, book_id):
+    return (book_id, P.pack_str(_words(rnd, 2, 6), 100), P.pack_str(_name(rnd), 100),
+            P.pack_str(rnd.choice(PUBLISHERS), 100), rnd.randint(1950, 2026),
+            P.pack_str(rnd.choice(CATEGORIES), 50), P.pack_str(rnd.choice(LANGUAGES), 50),
+            P.pack_str(f"{rnd.choice('ABCDEFGH')}{rnd.randint(1, 99):02d}-{rnd.randint(1, 9)}", 20),
+            rnd.randint(1, 10))
+
+
+def member_row(rnd, member_id):
+    return (member_id, P.pack_str(_name(rnd), 100), P.pack_str(_date(rnd, 1950, 2010).isoformat(), 10),
+            P.pack_str(rnd.choice("MF"), 1),
+            P.pack_str(f"{rnd.randint(1, 999)} ถนน{rnd.choice(THAI_WORDS)} กรุงเทพฯ", 200),
+            P.pack_str(f"08{rnd.randint(0, 99_999_999):08d}", 15),
+            P.pack_str(f"member{member_id}@example.com", 100),
+            P.pack_str(_date(rnd, 2015, 2026).isoformat(), 10))
+
+
+def borrow_row(rnd, n_members, n_books):
+    date_out = _date(rnd, 2020, 2026)
+    status = rnd.choice(STATUSES)
+    date_return = (date_out + datetime.timedelta(days=rnd.randint(1, 30))).isoformat() if status == "Return" else ""
+    return (rnd.randint(1, n_members), rnd.randint(1, n_books), P.pack_str(date_out.isoformat(), 10),
+            P.pack_str((date_out + datetime.timedelta(days=14)).isoformat(), 10), P.pack_str(date_return, 10),
+            P.pack_str(status, 20), float(rnd.choice((0, 0, 0, 5, 10, 20))),
+            P.pack_str(_words(rnd, 0, 4) or "-", 200))
+
+
+def _write_table(filename, st, rows):
+    # the generator writes the .dat files directly; indexes and the WAL are
+    # created on first use, which the "ensure_indexes" operation measures
+    with open(filename, "wb") as f:
+        buf = bytearray()
+        for i, row in enumerate(rows, 1):
+            buf += st.pack(*row)
+            if i % GENERATE_CHUNK == 0:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
+
+
+def generate_dataset(size, seed=0):
+    """Write books.dat, members.dat and borrows.dat for `size` loans into the cwd."""
+    rnd = random.Random(seed)
+    n_books, n_members = max(10, size // 10), max(10, size // 20)
+    _write_table(P.BOOK_FILE, P.BOOK_STRUCT, (book_row(rnd, i) for i in range(1, n_books + 1)))
+    _write_table(P.MEMBER_FILE, P.MEMBER_STRUCT, (member_row(rnd, i) for i in range(1, n_members + 1)))
+    _write_table(P.BORROW_FILE, P.BORROW_STRUCT, (borrow_row(rnd, n_members, n_books) for _ in range(size)))
+    return {"books": n_books, "members": n_members, "borrows": size}
+
+
+# ---------------- Operations ----------------
+# Each op takes (counts, rnd, args) and returns how many items it processed.
+def op_ensure_indexes(counts, rnd, args):
+    for filename, st in P.TABLES:
+        P.ensure_recovered(filename, st)
+        P.ensure_indexes(filename, st)
+    P.ensure_availability()
+    return sum(counts.values())
+
+
+def op_read_raw_records(counts, rnd, args):
+    return sum(len(P.read_raw_records(filename, st)) for filename, st in P.TABLES)
+
+
+def op_find_record(counts, rnd, args):
+    for _ in range(args.lookups):
+        P.find_record(P.BOOK_FILE, P.BOOK_STRUCT, rnd.randint(1, counts["books"]))
+        P.find_record(P.MEMBER_FILE, P.MEMBER_STRUCT, rnd.randint(1, counts["members"]))
+    return 2 * args.lookups
+
+
+def op_member_borrows(counts, rnd, args):
+    for _ in range(args.lookups):
+        P.member_borrows(rnd.randint(1, counts["members"]))
+    return args.lookups
+
+
+def op_view_books(counts, rnd, args):
+    # every page of the books listing, as the menu pages through it
+    cursor, rows = None, 0
+    while True:
+        page, cursor = P.query_books(after=cursor, limit=1000)
+        rows += len(page)
+        if cursor is None:
+            return rows
+
+
+def op_query_books(counts, rnd, args):
+    # first page of filtered, sorted queries, the menu's time to first result
+    for _ in range(args.lookups):
+        year = rnd.randint(1950, 2020)
+        P.query_books({"year_pub": (year, year + 5), "category": rnd.choice(CATEGORIES)}, "year_pub")
+    return args.lookups
+
+
+def op_view_borrows(counts, rnd, args):
+    P.view_borrows()
+    return counts["borrows"]
+
+
+def op_generate_report(counts, rnd, args):
+    P.generate_report()
+    return counts["borrows"]
+
+
+def op_analytics(counts, rnd, args):
+    if P.np is None:
+        return 0
+    P.library_analytics()
+    return counts["borrows"] + counts["books"]
+
+
+def op_loan_stats(counts, rnd, args):
+    P.loan_stats()
+    return counts["borrows"]
+
+
+def op_archive_loans(counts, rnd, args):
+    moved = P.archive_loans()
+    counts["borrows"] -= moved
+    return moved
+
+
+def op_history(counts, rnd, args):
+    return sum(1 for _ in P.query_loans("2021-01-01", "2021-12-31"))
+
+
+def op_add_record(counts, rnd, args):
+    for _ in range(args.appends):
+        P.add_record(P.BORROW_FILE, P.BORROW_STRUCT, borrow_row(rnd, counts["members"], counts["books"]))
+    counts["borrows"] += args.appends
+    return args.appends
+
+
+def op_write_raw_records(counts, rnd, args):
+    records = P.read_raw_records(P.BORROW_FILE, P.BORROW_STRUCT)
+    P.write_raw_records(P.BORROW_FILE, P.BORROW_STRUCT, records)
+    return len(records)
+
+
+OPS = {
+    "ensure_indexes": op_ensure_indexes,
+    "read_raw_records": op_read_raw_records,
+    "find_record": op_find_record,
+    "member_borrows": op_member_borrows,
+    "view_books": op_view_books,
+    "query_books": op_query_books,
+    "view_borrows": op_view_borrows,
+    "generate_report": op_generate_report,
+    "analytics": op_analytics,
+    "loan_stats": op_loan_stats,
+    "archive_loans": op_archive_loans,
+    "history": op_history,
+    "add_record": op_add_record,
+    "write_raw_records": op_write_raw_records,
+}
+
+
+def maxrss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux reports KiB
+
+
+def run_op(name, counts, rnd, args):
+    gc.collect()
+    P.metrics.reset()
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        items = OPS[name](counts, rnd, args)
+    seconds = time.perf_counter() - started
+    result = {"op": name, "seconds": seconds, "items": items,
+              "items_per_sec": items / seconds if seconds else None,
+              "maxrss_bytes": maxrss_bytes()}
+    if P.METRICS_ENABLED:
+        result["metrics"] = P.metrics.snapshot()["counters"]
+    if args.tracemalloc:
+        result["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def bench_size(size, ops, args):
+    started = time.perf_counter()
+    rows = generate_dataset(size, args.seed)
+    results = [{"op": "generate", "seconds": time.perf_counter() - started, "items": sum(rows.values()),
+                "maxrss_bytes": maxrss_bytes()}]
+    if args.format != 1:
+        started = time.perf_counter()
+        for filename, st in P.TABLES:
+            P.convert_table(filename, st, args.format)
+        results.append({"op": "convert", "seconds": time.perf_counter() - started, "items": sum(rows.values()),
+                        "maxrss_bytes": maxrss_bytes()})
+    counts = dict(rows)  # add_record grows the live counts
+    rnd = random.Random(args.seed + 1)
+    for name in ops:
+        results.append(run_op(name, counts, rnd, args))
+        print(f" {size:>10,} {name:<18} {results[-1]['seconds']:9.3f}s", file=sys.stderr)
+    sizes = {filename: P.table_bytes(filename, st) for filename, st in P.TABLES}
+    return {"size": size, "rows": rows, "file_bytes": sizes, "results": results}
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def parse_sizes(text):
+    return [int(float(s)) for s in text.split(",") if s.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library storage engine on synthetic data")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated loan counts, e.g. 1e3,1e5,1e7")
+    parser.add_argument("--ops", default=",".join(OPS), help="comma-separated operations to run, in order")
+    parser.add_argument("--lookups", type=int, default=1000, help="random lookups per lookup op")
+    parser.add_argument("--appends", type=int, default=200, help="single-record appends for add_record")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", type=int, choices=(1, 2), default=1, help="on-disk format version to benchmark")
+    parser.add_argument("--workers", type=int, default=P.SCAN_WORKERS, help="processes for parallel scans")
+    parser.add_argument("--tracemalloc", action="store_true", help="record peak Python allocations (slower)")
+    parser.add_argument("--dir", help="generate data here instead of a temporary folder (files are overwritten)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    P.SCAN_WORKERS = args.workers
+    ops = [name.strip() for name in args.ops.split(",") if name.strip()]
+    unknown = [name for name in ops if name not in OPS]
+    if unknown:
+        parser.error(f"unknown ops: {', '.join(unknown)} (choose from {', '.join(OPS)})")
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "started": datetime.datetime.now().isoformat(timespec="seconds"), "runs": []}
+    cwd = os.getcwd()
+    for size in parse_sizes(args.sizes):
+        with contextlib.ExitStack() as stack:
+            workdir = args.dir or stack.enter_context(tempfile.TemporaryDirectory(prefix="libbench-"))
+            os.makedirs(workdir, exist_ok=True)
+            os.chdir(workdir)
+            stack.callback(os.chdir, cwd)
+            for filename, _ in P.TABLES:
+                for leftover in [f for f in os.listdir(".") if f.startswith(filename + ".") or f == filename]:
+                    if os.path.isdir(leftover):
+                        shutil.rmtree(leftover)
+                    else:
+                        os.remove(leftover)
+            P.close_wals()
+            report["runs"].append(bench_size(size, ops, args))
+            P.close_wals()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
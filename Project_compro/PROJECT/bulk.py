@@ -0,0 +1,170 @@
+"""Bulk import/export between CSV/JSONL and the library .dat files.
+
+Run from the folder that holds the .dat files, e.g.:
+
+    python PROJECT/bulk.py import books catalogue.csv
+    python PROJECT/bulk.py import members members.jsonl
+    python PROJECT/bulk.py export borrows borrows.csv
+
+Rows are validated with the same rules as the interactive prompts. Input is
+streamed; only the set of known IDs is kept in memory. An import holds the
+table's exclusive lock from the ID snapshot to the last write (loans also hold
+members and books shared), so the duplicate and reference checks stay true.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import sys
+import time
+
+import Project as P
+
+BATCH_SIZE = 10_000
+MAX_ERRORS_SHOWN = 20
+
+
+def detect_format(path: str, fmt: str) -> str:
+    if fmt:
+        return fmt
+    return "jsonl" if path.lower().endswith((".jsonl", ".json", ".ndjson")) else "csv"
+
+
+def iter_rows(f, fmt: str):
+    # (line number, {column: value}); JSONL lines come back undecoded, see row_dict()
+    if fmt == "jsonl":
+        for n, line in enumerate(f, 1):
+            if line.strip():
+                yield n, line
+    else:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def row_dict(fmt: str, row) -> dict:
+    # decoded per row, so a malformed line is rejected like any other invalid row
+    if fmt != "jsonl":
+        return row
+    try:
+        value = json.loads(row)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON ไม่ถูกต้อง: {e.msg}") from None
+    if not isinstance(value, dict):
+        raise ValueError("แต่ละบรรทัดต้องเป็น JSON object")
+    return value
+
+
+def import_locks(table: str) -> contextlib.ExitStack:
+    # the target table exclusive; loans also need members and books to stay as
+    # checked, taken shared after borrows like the report does
+    filename, _ = P.TABLE_NAMES[table]
+    locks = contextlib.ExitStack()
+    locks.enter_context(P.table_lock(filename, exclusive=True))
+    if table == "borrows":
+        locks.enter_context(P.table_lock(P.MEMBER_FILE))
+        locks.enter_context(P.table_lock(P.BOOK_FILE))
+    return locks
+
+
+def import_file(table: str, path: str, fmt: str = "") -> dict:
+    filename, st = P.TABLE_NAMES[table]
+    fmt = detect_format(path, fmt)
+    stats = {"imported": 0, "rejected": 0}
+    started = time.perf_counter()
+
+    def reject(line_no, message):
+        stats["rejected"] += 1
+        if stats["rejected"] <= MAX_ERRORS_SHOWN:
+            print(f" line {line_no}: {message}", file=sys.stderr)
+
+    def write(batch):
+        P.add_records(filename, st, batch, update_indexes=False)
+        # the lock is held for the whole import: checkpoint per batch so the
+        # log does not grow with the file
+        P.checkpoint_table(filename)
+        stats["imported"] += len(batch)
+
+    with import_locks(table), open(path, encoding="utf-8-sig", newline="") as f:
+        P.recover_table(filename, st)
+        if table == "borrows":
+            member_ids = P.index_keys(P.MEMBER_FILE, P.MEMBER_STRUCT)
+            book_ids = P.index_keys(P.BOOK_FILE, P.BOOK_STRUCT)
+        else:
+            seen_ids = P.index_keys(filename, st)
+        batch = []
+        for line_no, row in iter_rows(f, fmt):
+            try:
+                packed = P.parse_row(st, row_dict(fmt, row))
+            except ValueError as e:
+                reject(line_no, e)
+                continue
+            if table == "borrows":
+                if packed[0] not in member_ids:
+                    reject(line_no, f"ไม่พบ Member ID {packed[0]}")
+                    continue
+                if packed[1] not in book_ids:
+                    reject(line_no, f"ไม่พบ Book ID {packed[1]}")
+                    continue
+            else:
+                if packed[0] in seen_ids:
+                    reject(line_no, f"ID {packed[0]} ซ้ำ")
+                    continue
+                seen_ids.add(packed[0])
+            batch.append(packed)
+            if len(batch) >= BATCH_SIZE:
+                write(batch)
+                batch = []
+        if batch:
+            write(batch)
+        P.ensure_indexes(filename, st)
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["records_per_sec"] = stats["imported"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def export_file(table: str, path: str, fmt: str = "") -> dict:
+    filename, st = P.TABLE_NAMES[table]
+    fmt = detect_format(path, fmt)
+    columns = [name for name, _, _ in P.TABLE_COLUMNS[st]]
+    exported = 0
+    started = time.perf_counter()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = None
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+        for _, raw in P.iter_records(filename, st):
+            row = P.format_row(st, raw)
+            if writer:
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            exported += 1
+    seconds = time.perf_counter() - started
+    return {"exported": exported, "seconds": seconds,
+            "records_per_sec": exported / seconds if seconds else 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export for the library .dat files")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("table", choices=sorted(P.TABLE_NAMES))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="")
+    args = parser.parse_args(argv)
+
+    if args.action == "import":
+        stats = import_file(args.table, args.path, args.format)
+        print(f"นำเข้า {stats['imported']} records, ปฏิเสธ {stats['rejected']} records "
+              f"ใน {stats['seconds']:.2f}s ({stats['records_per_sec']:,.0f} records/s)")
+        return 1 if stats["rejected"] else 0
+    stats = export_file(args.table, args.path, args.format)
+    print(f"ส่งออก {stats['exported']} records ใน {stats['seconds']:.2f}s "
+          f"({stats['records_per_sec']:,.0f} records/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
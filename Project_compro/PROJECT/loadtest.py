@@ -0,0 +1,101 @@
+"""Load-test client for server.py.
+
+    python PROJECT/loadtest.py --clients 16 --requests 500
+    python PROJECT/loadtest.py --unix lib.sock --write-ratio 0.1
+
+Each client keeps one connection and sends requests back to back: lookups of
+random books, members and availability, plus a share of writes (a member's
+loan list is read and one loan's notes field is updated). Prints ops/sec and
+latency percentiles.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from server import DEFAULT_HOST, DEFAULT_PORT
+
+
+async def _call(reader, writer, op, **args):
+    writer.write(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def _connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def client(args, book_ids, member_ids, latencies, errors):
+    reader, writer = await _connect(args)
+    rnd = random.Random()
+    try:
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            if rnd.random() < args.write_ratio:
+                reply = await _call(reader, writer, "member_loans", member_id=rnd.choice(member_ids))
+                loans = reply.get("result") or []
+                if loans:
+                    loan = rnd.choice(loans)
+                    reply = await _call(reader, writer, "update_loan", slot=loan["slot"], expected=loan,
+                                        changes={"notes": f"loadtest {time.time():.0f}"})
+            else:
+                op = rnd.choice(("find_book", "find_member", "availability"))
+                if op == "find_member":
+                    reply = await _call(reader, writer, op, member_id=rnd.choice(member_ids))
+                else:
+                    reply = await _call(reader, writer, op, book_id=rnd.choice(book_ids))
+            latencies.append(time.perf_counter() - started)
+            if not reply.get("ok"):
+                errors.append(reply.get("error"))
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def run(args):
+    book_ids, member_ids = parse_range(args.books), parse_range(args.members)
+    latencies, errors = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(args, book_ids, member_ids, latencies, errors)
+                           for _ in range(args.clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"requests : {len(latencies)} ({len(errors)} errors) from {args.clients} clients")
+    print(f"ops/sec  : {len(latencies) / elapsed:,.0f}")
+    print(f"latency  : p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+    for error in errors[:5]:
+        print(f" error: {error}")
+
+
+def parse_range(text):
+    lo, _, hi = text.partition("-")
+    return list(range(int(lo), int(hi or lo) + 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the library server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--write-ratio", type=float, default=0.0)
+    parser.add_argument("--books", default="2001-2005", help="book ID range to query, e.g. 1-100000")
+    parser.add_argument("--members", default="1001-1004", help="member ID range to query")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
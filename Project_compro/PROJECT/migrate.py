@@ -0,0 +1,65 @@
+"""Convert the library .dat files between on-disk format versions.
+
+Run from the folder that holds the .dat files:
+
+    python PROJECT/migrate.py status                 # version and size of each table
+    python PROJECT/migrate.py to-v2                  # compact format, all tables
+    python PROJECT/migrate.py to-v1 borrows          # back to the legacy layout
+
+Version 1 is the original fixed-width layout; version 2 stores dates as day
+numbers, the loan status as one byte and text in a string heap (see "On-disk
+formats" in Project.py). Readers detect the version by themselves, so the
+tables can be converted one at a time. A conversion also drops deleted
+records, like compacting does.
+"""
+import argparse
+import sys
+import time
+
+import Project as P
+
+ACTIONS = {"to-v1": 1, "to-v2": 2}
+
+
+def show_status(names):
+    print(f"{'Table':<8} {'File':<12} {'Version':<8} {'Records':>10} {'Bytes':>14} {'Bytes/record':>13}")
+    for name in names:
+        filename, st = P.TABLE_NAMES[name]
+        fmt = P.table_format(filename, st)
+        count = P.record_count(filename, st)
+        size = P.table_bytes(filename, st)
+        per_record = f"{size / count:,.1f}" if count else "-"
+        print(f"{name:<8} {filename:<12} {fmt.version:<8} {count:>10,} {size:>14,} {per_record:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the library .dat files between format versions")
+    parser.add_argument("action", choices=("status",) + tuple(ACTIONS))
+    parser.add_argument("tables", nargs="*", metavar="table", help="books, members and/or borrows (default: all)")
+    args = parser.parse_args(argv)
+    names = args.tables or list(P.TABLE_NAMES)
+    unknown = [name for name in names if name not in P.TABLE_NAMES]
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(unknown)} (choose from {', '.join(P.TABLE_NAMES)})")
+
+    for name in names:
+        P.recover_table(*P.TABLE_NAMES[name])
+    if args.action == "status":
+        show_status(names)
+        return 0
+
+    version = ACTIONS[args.action]
+    for name in names:
+        filename, st = P.TABLE_NAMES[name]
+        if P.table_format(filename, st).version == version:
+            print(f" {filename}: เป็นเวอร์ชัน {version} อยู่แล้ว")
+            continue
+        started = time.perf_counter()
+        before, after = P.convert_table(filename, st, version)
+        ratio = f"{before / after:.1f}x" if after else "-"
+        print(f" {filename}: {before:,} -> {after:,} bytes ({ratio}) ใน {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Local multi-client server for the library data files.
+
+Run from the folder that holds the .dat files:
+
+    python PROJECT/server.py                   # TCP on 127.0.0.1:8765
+    python PROJECT/server.py --unix lib.sock   # Unix socket
+
+Protocol: one JSON object per line, {"op": "<name>", "args": {...}}; the reply
+is one JSON line, {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+Blocking file I/O runs on a thread pool; the tables' shared/exclusive file
+locks keep concurrent desks (and other processes) consistent, and writes from
+concurrent requests share WAL fsyncs (group commit).
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import io
+import itertools
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import Project as P
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def _row(st, raw):
+    return P.format_row(st, raw) if raw is not None else None
+
+
+def _loans(loans):
+    return [dict(P.format_row(P.BORROW_STRUCT, raw), slot=slot) for slot, raw in loans]
+
+
+def _page(st, page):
+    rows, cursor = page
+    return {"rows": [P.format_row(st, raw) for _, raw in rows], "cursor": cursor}
+
+
+def op_availability(book_id):
+    book = P.find_record(P.BOOK_FILE, P.BOOK_STRUCT, book_id)
+    if book is None:
+        raise ValueError(f"ไม่พบ Book ID {book_id}")
+    borrowed = P.borrowed_count(book_id)
+    return {"book_id": book_id, "total_copies": book[8], "borrowed": borrowed,
+            "available": book[8] - borrowed}
+
+
+def op_history(date_from=None, date_to=None, limit=P.QUERY_PAGE):
+    # at most limit loans; "more" means the range holds others (narrow it)
+    limit = max(1, limit)
+    loans = list(itertools.islice(P.query_loans(date_from, date_to), limit + 1))
+    return {"rows": _loans(loans[:limit]), "more": len(loans) > limit}
+
+
+def op_report():
+    # the report text itself; files written here would land in the server's folder
+    books, borrows = io.StringIO(), io.StringIO()
+    P.write_reports(books, borrows)
+    return {"books": books.getvalue(), "borrows": borrows.getvalue()}
+
+
+NULL = type(None)
+OPT_STR = (str, NULL)
+
+# op -> (function, {argument: accepted JSON types}); a type, a tuple of types,
+# or [type] for an array of that type. Arguments without a default are required.
+OPS = {
+    "ping": (lambda: "pong", {}),
+    "find_book": (lambda book_id: _row(P.BOOK_STRUCT, P.find_record(P.BOOK_FILE, P.BOOK_STRUCT, book_id)),
+                  {"book_id": int}),
+    "find_member": (lambda member_id: _row(P.MEMBER_STRUCT, P.find_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member_id)),
+                    {"member_id": int}),
+    "add_book": (lambda row: _row(P.BOOK_STRUCT, P.insert_row(P.BOOK_FILE, P.BOOK_STRUCT, row)), {"row": dict}),
+    "add_member": (lambda row: _row(P.MEMBER_STRUCT, P.insert_row(P.MEMBER_FILE, P.MEMBER_STRUCT, row)),
+                   {"row": dict}),
+    "update_book": (lambda book_id, changes: _row(P.BOOK_STRUCT, P.update_row(P.BOOK_FILE, P.BOOK_STRUCT, book_id, changes)),
+                    {"book_id": int, "changes": dict}),
+    "update_member": (lambda member_id, changes: _row(P.MEMBER_STRUCT, P.update_row(P.MEMBER_FILE, P.MEMBER_STRUCT, member_id, changes)),
+                      {"member_id": int, "changes": dict}),
+    "delete_book": (lambda book_id: P.delete_by_key(P.BOOK_FILE, P.BOOK_STRUCT, book_id), {"book_id": int}),
+    "delete_member": (lambda member_id: P.delete_by_key(P.MEMBER_FILE, P.MEMBER_STRUCT, member_id),
+                      {"member_id": int}),
+    "borrow": (lambda member_id, book_ids, date_out, date_due: P.borrow_books(member_id, book_ids, date_out, date_due),
+               {"member_id": int, "book_ids": [int], "date_out": str, "date_due": str}),
+    "search_books": (lambda query, limit=50: [P.format_row(P.BOOK_STRUCT, raw) for _, raw in P.search_books(query, limit)],
+                     {"query": str, "limit": int}),
+    "search_members": (lambda query, limit=50: [P.format_row(P.MEMBER_STRUCT, raw) for _, raw in P.search_members(query, limit)],
+                       {"query": str, "limit": int}),
+    "query_books": (lambda where=None, order_by=None, after=None, limit=P.QUERY_PAGE:
+                    _page(P.BOOK_STRUCT, P.query_books(where, order_by, after, limit)),
+                    {"where": (dict, NULL), "order_by": OPT_STR, "after": ([int], NULL), "limit": int}),
+    "query_members": (lambda where=None, order_by=None, after=None, limit=P.QUERY_PAGE:
+                      _page(P.MEMBER_STRUCT, P.query_members(where, order_by, after, limit)),
+                      {"where": (dict, NULL), "order_by": OPT_STR, "after": ([int], NULL), "limit": int}),
+    "member_loans": (lambda member_id: _loans(P.member_borrows(member_id)), {"member_id": int}),
+    "book_loans": (lambda book_id: _loans(P.book_borrows(book_id)), {"book_id": int}),
+    # slots change when the table is compacted or archived: the client sends the
+    # loan it saw (at least member_id, book_id, date_out) and the op fails if
+    # the slot now holds another loan
+    "update_loan": (lambda slot, expected, changes: _row(P.BORROW_STRUCT, P.update_loan(slot, changes, key=expected)),
+                    {"slot": int, "expected": dict, "changes": dict}),
+    "delete_loan": (lambda slot, expected: P.delete_loan(slot, key=expected), {"slot": int, "expected": dict}),
+    "availability": (op_availability, {"book_id": int}),
+    "overdue": (lambda as_of=None: [dict(P.format_row(P.BORROW_STRUCT, raw), slot=slot, days_overdue=days)
+                                    for slot, raw, days in P.overdue_loans(as_of)],
+                {"as_of": OPT_STR}),
+    "compute_fines": (lambda as_of=None, rate=P.FINE_PER_DAY: dict(zip(("overdue", "changed"), P.compute_fines(as_of, rate))),
+                      {"as_of": OPT_STR, "rate": (int, float)}),
+    "loans_by_status": (lambda status: _loans(P.loans_by_status(status)), {"status": str}),
+    "loan_stats": (lambda: P.loan_stats(), {}),
+    "history": (op_history, {"date_from": OPT_STR, "date_to": OPT_STR, "limit": int}),
+    "archive": (lambda before=None: P.archive_loans(before), {"before": OPT_STR}),
+    "report": (op_report, {}),
+    "metrics": (lambda: P.metrics.snapshot(), {}),
+}
+JSON_TYPES = {int: "integer", float: "number", str: "string", dict: "object", list: "array", NULL: "null"}
+
+
+def _matches(value, spec) -> bool:
+    if isinstance(spec, tuple):
+        return any(_matches(value, t) for t in spec)
+    if isinstance(spec, list):
+        return isinstance(value, list) and all(_matches(v, spec[0]) for v in value)
+    if isinstance(value, bool):  # JSON true/false is not a number
+        return spec is bool
+    return isinstance(value, spec)
+
+
+def _type_name(spec) -> str:
+    if isinstance(spec, tuple):
+        return " หรือ ".join(_type_name(t) for t in spec)
+    if isinstance(spec, list):
+        return f"array of {_type_name(spec[0])}"
+    return JSON_TYPES[spec]
+
+
+def check_args(fn, types: dict, args) -> dict:
+    if not isinstance(args, dict):
+        raise ValueError("args ต้องเป็น JSON object")
+    unknown = sorted(set(args) - set(types))
+    if unknown:
+        raise ValueError(f"ไม่รู้จัก argument: {', '.join(unknown)}")
+    params = inspect.signature(fn).parameters
+    missing = [name for name, p in params.items() if p.default is p.empty and name not in args]
+    if missing:
+        raise ValueError(f"ขาด argument: {', '.join(missing)}")
+    for name, value in args.items():
+        if not _matches(value, types[name]):
+            raise ValueError(f"{name}: ต้องเป็น {_type_name(types[name])}")
+    return args
+
+
+def run_op(request: dict):
+    if not isinstance(request, dict):
+        raise ValueError("request ต้องเป็น JSON object")
+    entry = OPS.get(request.get("op"))
+    if entry is None:
+        raise ValueError(f"unknown op {request.get('op')!r}")
+    fn, types = entry
+    args = check_args(fn, types, request.get("args") or {})
+    # with LIBRARY_METRICS set, counters are labelled with the request's op
+    return P.timed(request["op"])(fn)(**args)
+
+
+async def read_line(reader) -> bytes:
+    """The next request line, b"" at the end of the stream. A line longer than
+    the reader's limit is skipped up to its newline and raises ValueError."""
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        except asyncio.LimitOverrunError as e:
+            too_long = True
+            await reader.readexactly(e.consumed)  # already buffered: drop it
+            continue
+        if too_long:
+            raise ValueError("request ยาวเกินไป")
+        return line
+
+
+async def handle_client(reader, writer, pool):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                line = await read_line(reader)
+                if not line:
+                    break
+                request = json.loads(line)
+                result = await loop.run_in_executor(pool, functools.partial(run_op, request))
+                reply = {"ok": True, "result": result}
+            except ValueError as e:
+                reply = {"ok": False, "error": str(e).strip()}
+            except Exception as e:
+                # a bug or an I/O failure in one request: log it, answer it, keep the connection
+                traceback.print_exc()
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, workers=None):
+    for filename, st in P.TABLES:
+        P.recover_table(filename, st)
+    pool = ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4))
+    handler = functools.partial(handle_client, pool=pool)
+    if unix_path:
+        server = await asyncio.start_unix_server(handler, path=unix_path)
+        where = unix_path
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        where = f"{host}:{port}"
+    print(f"Library server listening on {where}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.shutdown(wait=True)
+        P.checkpoint_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library multi-client server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, help="threads for blocking file I/O")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers))
+    except KeyboardInterrupt:
+        print("Bye")
+
+
+if __name__ == "__main__":
+    main()
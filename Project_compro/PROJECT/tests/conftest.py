@@ -0,0 +1,52 @@
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Project as P  # noqa: E402
+
+CATEGORIES = ("Novel", "Science", "History", "Comics")
+
+def _pack(st, row: dict) -> tuple:
+    # row values in struct order; text is NUL-padded to its field width
+    fields = re.findall(r"(\d*)([a-z])", st.format)
+    return tuple(P.pack_str(value, int(width)) if code == "s" else value
+                 for (width, code), value in zip(fields, row.values()))
+
+def book(book_id: int, **changes) -> tuple:
+    row = {"book_id": book_id, "title": f"Book {book_id}", "author": f"Author {book_id % 11}",
+           "publisher": "Pub", "year_pub": 1980 + book_id % 40, "category": CATEGORIES[book_id % 4],
+           "language": "Thai" if book_id % 2 else "English", "shelf_no": f"S{book_id % 7}",
+           "total_copies": 3}
+    row.update(changes)
+    return _pack(P.BOOK_STRUCT, row)
+
+def member(member_id: int, **changes) -> tuple:
+    row = {"member_id": member_id, "name": f"Member {member_id}",
+           "birth_date": f"{1960 + member_id % 45}-{member_id % 12 + 1:02d}-{member_id % 28 + 1:02d}",
+           "gender": "F" if member_id % 2 else "M", "address": "", "mobile": "",
+           "email": f"m{member_id}@example.com", "reg_date": f"2024-{member_id % 12 + 1:02d}-01"}
+    row.update(changes)
+    return _pack(P.MEMBER_STRUCT, row)
+
+def loan(member_id: int, book_id: int, **changes) -> tuple:
+    row = {"member_id": member_id, "book_id": book_id, "date_out": "2025-01-05",
+           "date_due": "2025-01-19", "date_return": "", "status": "Borrow", "fine": 0.0, "notes": ""}
+    row.update(changes)
+    return _pack(P.BORROW_STRUCT, row)
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # every test works on its own empty data folder
+    monkeypatch.chdir(tmp_path)
+    restart()
+    yield tmp_path
+    restart()
+
+def restart():
+    # forget everything this process knows about the tables, as after a crash
+    P.close_wals()
+    P.cache_drop()
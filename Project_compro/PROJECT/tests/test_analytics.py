@@ -0,0 +1,67 @@
+import pytest
+
+import Project as P
+from conftest import book, loan, member
+
+pytest.importorskip("numpy")
+
+def add_library():
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(1, category="Novel", total_copies=2),
+                                               book(2, category="Science", total_copies=5),
+                                               book(3, category="Novel", total_copies=1)])
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [
+        loan(1, 1, date_out="2025-01-05", date_due="2025-01-19"),
+        loan(1, 2, date_out="2025-01-20", date_due="2025-02-03", status="BORROW"),
+        loan(2, 2, date_out="2025-02-01", date_due="2025-02-15", status="Returned",
+             date_return="2025-02-20", fine=25.0),
+        loan(2, 3, date_out="2025-02-10", date_due="2025-03-01", fine=10.5),
+        loan(3, 9, date_out="2025-02-11", date_due="2025-02-25"),  # book no longer in the catalogue
+        loan(3, 1, date_out="2025-02-12", date_due="2025-02-26", fine=99.0),
+    ])
+    P.delete_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 5)
+
+def test_figures(data_dir):
+    add_library()
+    stats = P.library_analytics("2025-02-20")
+    assert (stats["titles"], stats["copies"], stats["borrowed"], stats["available"]) == (3, 8, 4, 4)
+    assert stats["overdue"] == 2  # due 2025-01-19 and 2025-02-03
+    assert stats["borrowed_per_book"] == {1: 1, 2: 1, 3: 1, 9: 1}
+    assert stats["fines_per_member"] == {1: 0.0, 2: 35.5, 3: 0.0}
+    assert stats["circulation"] == {("Novel", "2025-01"): 1, ("Science", "2025-01"): 1,
+                                    ("Science", "2025-02"): 1, ("Novel", "2025-02"): 1, ("", "2025-02"): 1}
+
+def test_agrees_with_availability_table(data_dir):
+    add_library()
+    stats = P.library_analytics()
+    assert stats["borrowed_per_book"] == P.availability_counts()
+    assert stats["borrowed"] == P.total_borrowed()
+
+def test_empty_tables(data_dir):
+    stats = P.library_analytics("2025-01-01")
+    assert (stats["titles"], stats["borrowed"], stats["circulation"]) == (0, 0, {})
+
+def test_archived_loans_are_included(data_dir):
+    add_library()
+    P.update_loan(0, {"status": "Returned", "date_return": "2025-01-19", "fine": "7"})
+    before = P.library_analytics("2025-02-20")
+    assert P.archive_loans("2025-02-05") == 2
+    after = P.library_analytics("2025-02-20")
+    assert after["archived"] == 2
+    for name in ("fines_per_member", "circulation", "borrowed", "overdue"):
+        assert after[name] == before[name], name
+    assert P.loan_stats(workers=1)["loans"] == 5
+    assert P.loan_stats(workers=1, archive=False)["loans"] == 3
+
+def test_unpadded_legacy_dates(data_dir):
+    # rows stored before parse_date() padded its result
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(1, category="Novel")])
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(1, 1, date_out="2025-9-7", date_due="2025-9-21"),
+                                                   loan(2, 1, date_out="2025-10-1", date_due="2025-10-15")])
+    stats = P.library_analytics("2025-10-02")
+    assert stats["overdue"] == 1
+    assert stats["circulation"] == {("Novel", "2025-09"): 1, ("Novel", "2025-10"): 1}
+
+def test_dates_are_stored_padded(data_dir):
+    row = P.parse_row(P.BORROW_STRUCT, {"member_id": 1, "book_id": 1, "date_out": "2025-9-7",
+                                        "date_due": "2025-9-21", "status": "Borrow"})
+    assert P.decode_record(row)[2:4] == ("2025-09-07", "2025-09-21")
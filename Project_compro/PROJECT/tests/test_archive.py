@@ -0,0 +1,94 @@
+import os
+import shutil
+import threading
+
+import Project as P
+from conftest import loan
+
+F, ST = P.BORROW_FILE, P.BORROW_STRUCT
+
+def returned(member_id: int, date_out: str) -> tuple:
+    return loan(member_id, 1, date_out=date_out, status="Returned", date_return=date_out)
+
+def add_history():
+    P.add_records(F, ST, [returned(1, "2025-01-03"), returned(2, "2025-01-20"), returned(3, "2025-02-14"),
+                          loan(4, 1, date_out="2025-01-04"),  # still out: stays hot
+                          returned(5, "2025-03-02")])
+
+def members(loans) -> list:
+    return [raw[0] for _, raw in loans]
+
+def test_archive_moves_returned_loans(data_dir):
+    add_history()
+    assert P.archive_loans("2025-03-01") == 3
+    assert members(P.iter_records(F, ST)) == [4, 5]
+    assert list(P.archive_segments()) == ["2025-01", "2025-02"]
+    assert [count for _, count, _ in P.archive_stats()] == [2, 1]
+    assert P.member_borrows(1) == []
+    assert P.archive_loans("2025-03-01") == 0
+
+def test_query_spans_archive_and_hot_file(data_dir):
+    add_history()
+    P.archive_loans("2025-03-01")
+    loans = list(P.query_loans())
+    assert members(loans) == [1, 2, 3, 4, 5]
+    assert [slot for slot, _ in loans] == [None, None, None, 0, 1]
+    assert members(P.query_loans("2025-01-04", "2025-02-14")) == [2, 3, 4]
+    assert members(P.query_loans("2025-02-15")) == [5]
+    assert members(P.query_loans(archive=False)) == [4, 5]
+
+def test_suspended_query_does_not_block_writers(data_dir):
+    add_history()
+    P.archive_loans("2025-03-01")
+    loans = P.query_loans()
+    assert next(loans)[0] is None
+    writer = threading.Thread(target=P.archive_loans, args=("2025-04-01",))
+    writer.start()
+    writer.join(5)
+    assert not writer.is_alive()
+    loans.close()
+
+def test_archiving_into_a_month_writes_a_new_generation(data_dir):
+    add_history()
+    P.archive_loans("2025-01-10")
+    P.add_record(F, ST, returned(6, "2025-01-25"))
+    assert P.archive_loans("2025-03-01") == 3
+    segments = P.archive_segments()
+    assert os.path.basename(segments["2025-01"]) == "2025-01.2.seg"
+    assert sorted(os.listdir(P.archive_dir())) == ["2025-01.2.seg", "2025-02.1.seg"]
+    assert [raw[0] for raw in P.iter_segment(segments["2025-01"])] == [1, 2, 6]
+
+def test_crash_before_the_hot_file_changed_is_rolled_back(data_dir):
+    add_history()
+    P.archive_loans("2025-02-01")
+    # a second move that died while writing its segment
+    P._write_archive_pending(F, P._file_ident(F), ["2025-01.2.seg"])
+    with open(os.path.join(P.archive_dir(), "2025-01.2.seg"), "wb") as f:
+        f.write(b"LAR1 half written")
+
+    assert os.path.basename(P.archive_segments()["2025-01"]) == "2025-01.1.seg"
+    assert sorted(os.listdir(P.archive_dir())) == ["2025-01.1.seg"]
+    assert members(P.query_loans()) == [1, 2, 3, 4, 5]
+
+def test_crash_after_the_hot_file_changed_is_rolled_forward(data_dir):
+    add_history()
+    P.archive_loans("2025-02-01")
+    P._write_archive_pending(F, P._file_ident(F), ["2025-01.2.seg"])
+    writer = P.SegmentWriter(os.path.join(P.archive_dir(), "2025-01.2.seg"))
+    for raw in P.iter_segment(os.path.join(P.archive_dir(), "2025-01.1.seg")):
+        writer.add(raw, P._loan_day(raw))
+    writer.add(returned(7, "2025-01-30"), P.day_number("2025-01-30"))
+    writer.close()
+    shutil.copy(F, F + ".new")
+    os.replace(F + ".new", F)  # the hot file was replaced: the commit point passed
+
+    assert os.path.basename(P.archive_segments()["2025-01"]) == "2025-01.2.seg"
+    assert not os.path.exists(P._archive_pending_path(F))
+    assert sorted(os.listdir(P.archive_dir())) == ["2025-01.2.seg"]
+    assert members(P.query_loans(None, "2025-01-31")) == [1, 2, 7, 4]
+
+def test_unpadded_date_goes_to_its_month(data_dir):
+    P.add_records(F, ST, [returned(1, "2025-9-7"), returned(2, "2025-09-20")])
+    assert P.archive_loans("2025-10-01") == 2
+    assert list(P.archive_segments()) == ["2025-09"]
+    assert members(P.query_loans("2025-9-1", "2025-9-30")) == [1, 2]
@@ -0,0 +1,39 @@
+import pytest
+
+import Project as P
+from conftest import book, loan, member
+
+def scanned_availability() -> dict:
+    counts = {}
+    for _, raw in P.iter_records(P.BORROW_FILE, P.BORROW_STRUCT):
+        if P.is_active_borrow(P.unpack_str(raw[5])):
+            counts[raw[1]] = counts.get(raw[1], 0) + 1
+    return counts
+
+def test_counts_follow_borrow_writes(data_dir):
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(i % 5, i % 7) for i in range(30)])
+    for slot in range(0, 30, 4):
+        P.write_record_at(P.BORROW_FILE, P.BORROW_STRUCT, slot, loan(1, 8 + slot % 3, status="Returned"))
+    for slot in range(1, 30, 5):
+        P.delete_record_at(P.BORROW_FILE, P.BORROW_STRUCT, slot)
+    P.write_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 2, loan(1, 50))  # first loan of book 50
+    counts = scanned_availability()
+    assert P.availability_counts() == counts
+    assert P.total_borrowed() == sum(counts.values())
+    assert P.borrowed_count(50) == 1
+    assert P.borrowed_count(99) == 0
+
+def test_rebuilt_when_stale(data_dir):
+    P.add_record(P.BORROW_FILE, P.BORROW_STRUCT, loan(1, 1))
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(2, 1)], update_indexes=False)
+    assert P.borrowed_count(1) == 2
+
+def test_borrow_books_checks_copies(data_dir):
+    P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(1))
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1, total_copies=2))
+    P.borrow_books(1, [1], "2025-01-05", "2025-01-19")
+    with pytest.raises(ValueError):
+        P.borrow_books(1, [1, 1], "2025-01-05", "2025-01-19")
+    P.borrow_books(1, [1], "2025-01-05", "2025-01-19")
+    assert P.borrowed_count(1) == 2
+    assert P.record_count(P.BORROW_FILE, P.BORROW_STRUCT) == 2
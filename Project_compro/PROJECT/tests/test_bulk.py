@@ -0,0 +1,97 @@
+import json
+import threading
+
+import bulk
+import Project as P
+from conftest import book, member
+
+def fresh_folder(data_dir, monkeypatch):
+    # import into an empty data folder next to the exported file
+    (data_dir / "copy").mkdir()
+    monkeypatch.chdir(data_dir / "copy")
+
+def test_csv_round_trip(data_dir, monkeypatch):
+    for i in range(1, 21):
+        P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(i))
+    assert bulk.export_file("books", "books.csv")["exported"] == 20
+    fresh_folder(data_dir, monkeypatch)
+    stats = bulk.import_file("books", "../books.csv")
+    assert (stats["imported"], stats["rejected"]) == (20, 0)
+    assert [raw for _, raw in P.iter_records(P.BOOK_FILE, P.BOOK_STRUCT)] == [book(i) for i in range(1, 21)]
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 20) == 19
+
+def test_jsonl_round_trip(data_dir, monkeypatch):
+    for i in range(1, 6):
+        P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(i))
+    bulk.export_file("members", "members.jsonl")
+    with open("members.jsonl", encoding="utf-8") as f:
+        assert json.loads(f.readline())["name"] == "Member 1"
+    fresh_folder(data_dir, monkeypatch)
+    assert bulk.import_file("members", "../members.jsonl")["imported"] == 5
+    assert P.find_record(P.MEMBER_FILE, P.MEMBER_STRUCT, 5) == member(5)
+
+def test_invalid_and_duplicate_rows_rejected(data_dir):
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    with open("books.csv", "w", encoding="utf-8", newline="") as f:
+        f.write("book_id,title,author,publisher,year_pub,category,language,shelf_no,total_copies\n"
+                "1,Old,A,P,2000,Novel,Thai,S1,1\n"        # already in books.dat
+                "2,New,A,P,2000,Novel,Thai,S1,1\n"
+                "2,Again,A,P,2000,Novel,Thai,S1,1\n"      # repeated in the file
+                "3,Bad year,A,P,abc,Novel,Thai,S1,1\n")
+    stats = bulk.import_file("books", "books.csv")
+    assert (stats["imported"], stats["rejected"]) == (1, 3)
+    assert P.index_keys(P.BOOK_FILE, P.BOOK_STRUCT) == {1, 2}
+
+def test_borrows_need_known_member_and_book(data_dir):
+    P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(1))
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    with open("borrows.jsonl", "w", encoding="utf-8") as f:
+        for member_id, book_id in ((1, 1), (2, 1), (1, 2)):
+            f.write(json.dumps({"member_id": member_id, "book_id": book_id, "date_out": "2025-01-05",
+                                "date_due": "2025-01-19", "status": "Borrow"}) + "\n")
+    stats = bulk.import_file("borrows", "borrows.jsonl")
+    assert (stats["imported"], stats["rejected"]) == (1, 2)
+    assert P.record_count(P.BORROW_FILE, P.BORROW_STRUCT) == 1
+
+def test_malformed_jsonl_lines_are_rejected(data_dir):
+    with open("members.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"member_id": 1, "name": "A", "birth_date": "2000-01-01", "gender": "F",
+                            "reg_date": "2024-01-01"}) + "\n")
+        f.write('{"member_id": 2, "name": \n')
+        f.write("[1, 2, 3]\n")
+        f.write(json.dumps({"member_id": 4, "name": "D", "birth_date": "2000-01-01", "gender": "M",
+                            "reg_date": "2024-01-01"}) + "\n")
+    stats = bulk.import_file("members", "members.jsonl")
+    assert (stats["imported"], stats["rejected"]) == (2, 2)
+    assert P.index_keys(P.MEMBER_FILE, P.MEMBER_STRUCT) == {1, 4}
+
+def test_insert_during_import_waits_for_it(data_dir, monkeypatch):
+    # an ID added by another writer mid-import must not slip past the duplicate check
+    monkeypatch.setattr(bulk, "BATCH_SIZE", 2)
+    with open("books.csv", "w", encoding="utf-8", newline="") as f:
+        f.write("book_id,title,author,publisher,year_pub,category,language,shelf_no,total_copies\n")
+        for i in range(1, 7):
+            f.write(f"{i},Book,A,P,2000,Novel,Thai,S1,1\n")
+    errors = []
+
+    def insert_late_id():
+        try:
+            P.insert_unique(P.BOOK_FILE, P.BOOK_STRUCT, book(5))
+        except ValueError as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=insert_late_id)
+    add_records = P.add_records
+
+    def first_batch_starts_writer(*args, **kwargs):
+        if not writer.is_alive() and not writer.ident:
+            writer.start()
+            writer.join(0.2)
+            assert writer.is_alive()  # blocked on the import's lock
+        return add_records(*args, **kwargs)
+
+    monkeypatch.setattr(P, "add_records", first_batch_starts_writer)
+    assert bulk.import_file("books", "books.csv")["imported"] == 6
+    writer.join()
+    assert len(errors) == 1
+    assert P.record_count(P.BOOK_FILE, P.BOOK_STRUCT) == 6
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import Project as P
+from conftest import book
+
+F, ST = P.BOOK_FILE, P.BOOK_STRUCT
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def other_process(code: str):
+    # run code against the same data folder from a separate process
+    subprocess.run([sys.executable, "-c", "import Project as P\n" + code], check=True,
+                   env=dict(os.environ, PYTHONPATH=PROJECT_DIR))
+
+def titles() -> list:
+    return [P.unpack_str(raw[1]) for raw in P.read_raw_records(F, ST)]
+
+def test_own_writes_update_the_cache(data_dir):
+    P.add_records(F, ST, [book(i) for i in range(1, 6)])
+    titles()
+    assert P.cache_info()["tables"] == 1
+    P.write_record_at(F, ST, 1, book(2, title="Edited"))
+    P.delete_record_at(F, ST, 3)
+    P.add_record(F, ST, book(6))
+    assert P.cache_info()["tables"] == 1
+    assert titles() == ["Book 1", "Edited", "Book 3", "Book 5", "Book 6"]
+    assert P.record_map(F, ST)[2] == book(2, title="Edited")
+    assert 4 not in P.record_map(F, ST)
+
+def test_write_from_another_process_invalidates(data_dir):
+    P.add_records(F, ST, [book(i) for i in range(1, 4)])
+    assert titles() == ["Book 1", "Book 2", "Book 3"]
+    other_process("raw = P.read_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0)\n"
+                  "P.write_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0, raw[:1] + (P.pack_str('Other', 100),) + raw[2:])")
+    assert titles() == ["Other", "Book 2", "Book 3"]
+    assert P.unpack_str(P.find_record(F, ST, 1)[1]) == "Other"
+
+def test_rewrite_by_hand_invalidates(data_dir):
+    P.add_records(F, ST, [book(i) for i in range(1, 4)])
+    titles()
+    with open(F, "ab") as f:  # no lock, no generation bump: the file stamp changes
+        f.write(ST.pack(*book(4)))
+    assert titles() == ["Book 1", "Book 2", "Book 3", "Book 4"]
+
+def test_least_recently_used_table_is_evicted(data_dir, monkeypatch):
+    P.add_records(F, ST, [book(i) for i in range(1, 21)])
+    P.read_raw_records(F, ST)
+    monkeypatch.setattr(P, "RECORD_CACHE_BYTES", P.cache_info()["bytes"] + 1)
+    P.read_raw_records(P.MEMBER_FILE, P.MEMBER_STRUCT)  # empty: costs nothing
+    assert P.cache_info()["tables"] == 2
+    P.add_records("other.dat", ST, [book(i) for i in range(1, 21)])
+    P.read_raw_records("other.dat", ST)
+    assert P.cache_info()["tables"] == 2  # books.dat went
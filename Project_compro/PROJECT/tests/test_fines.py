@@ -0,0 +1,37 @@
+import Project as P
+from conftest import loan
+
+F, ST = P.BORROW_FILE, P.BORROW_STRUCT
+
+def add_loans():
+    P.add_records(F, ST, [
+        loan(1, 1, date_due="2025-01-10"),
+        loan(2, 2, date_due="2025-01-20"),
+        loan(3, 3, date_due="2025-01-10", status="Returned", date_return="2025-01-15"),
+        loan(4, 4, date_due="2025-02-01"),
+        loan(5, 5, date_due="2025-01-05", fine=500.0),
+    ])
+
+def test_overdue_oldest_first(data_dir):
+    add_loans()
+    loans = P.overdue_loans("2025-01-21")
+    assert [(slot, days) for slot, _, days in loans] == [(4, 16), (0, 11), (1, 1)]
+    assert P.overdue_loans("2025-01-05") == []
+
+def test_overdue_follows_returns_and_deletes(data_dir):
+    add_loans()
+    P.write_record_at(F, ST, 0, loan(1, 1, date_due="2025-01-10", status="Returned"))
+    P.delete_record_at(F, ST, 4)
+    P.write_record_at(F, ST, 3, loan(4, 4, date_due="2025-01-12"))
+    assert [slot for slot, _, _ in P.overdue_loans("2025-01-21")] == [3, 1]
+
+def test_compute_fines(data_dir):
+    add_loans()
+    assert P.compute_fines("2025-01-21", rate=2.5) == (3, 2)
+    fines = [raw[6] for _, raw in P.iter_records(F, ST)]
+    assert fines == [27.5, 2.5, 0.0, 0.0, 500.0]  # a higher fine set by hand is kept
+    assert P.compute_fines("2025-01-21", rate=2.5) == (3, 0)
+
+def test_no_borrows_file(data_dir):
+    assert P.compute_fines("2025-01-21") == (0, 0)
+    assert P.overdue_loans("2025-01-21") == []
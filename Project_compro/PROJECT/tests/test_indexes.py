@@ -0,0 +1,165 @@
+import os
+import random
+import shutil
+
+import pytest
+
+import Project as P
+from conftest import book, loan, member
+
+def scanned_entries(filename, st, name) -> set:
+    # what the index should hold, from a full scan of the data file
+    key_fn = P.TABLE_INDEXES[st][name]
+    return {(key, slot) for slot, raw in P.iter_records(filename, st) for key in key_fn(raw)}
+
+def assert_indexes_match_scan():
+    for filename, st in P.TABLES:
+        P.ensure_indexes(filename, st)
+        for name in P.TABLE_INDEXES[st]:
+            assert set(P._index_entries(P.index_path(filename, name))) == scanned_entries(filename, st, name)
+
+def test_lookup_by_id(data_dir):
+    for i in (5, 3, 9, 1):
+        P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(i))
+    assert [P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, i) for i in (5, 3, 9, 1)] == [0, 1, 2, 3]
+    assert P.find_record(P.BOOK_FILE, P.BOOK_STRUCT, 9) == book(9)
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 4) is None
+    assert P.find_record(P.MEMBER_FILE, P.MEMBER_STRUCT, 1) is None
+
+def test_indexes_follow_appends_and_rewrites(data_dir):
+    for i in range(1, 41):
+        P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(i * 7 % 101))
+        P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(i))
+    assert_indexes_match_scan()
+
+    P.write_raw_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(i) for i in range(100, 110)])
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 7) is None
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 104) == 4
+    assert_indexes_match_scan()
+
+def test_indexes_follow_updates_and_deletes(data_dir):
+    for i in range(1, 31):
+        P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(i))
+    for slot in range(0, 30, 3):
+        P.write_record_at(P.BOOK_FILE, P.BOOK_STRUCT, slot, book(100 + slot))
+    for slot in range(1, 30, 4):
+        P.delete_record_at(P.BOOK_FILE, P.BOOK_STRUCT, slot)
+    assert_indexes_match_scan()
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 1) is None
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 103) == 3
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 2) is None
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 3) == 2
+
+def test_tail_merge_keeps_entries(data_dir, monkeypatch):
+    monkeypatch.setattr(P, "INDEX_MERGE_THRESHOLD", 4)
+    for i in range(30, 0, -1):
+        P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(i))
+    assert_indexes_match_scan()
+    assert P.find_slot(P.MEMBER_FILE, P.MEMBER_STRUCT, 1) == 29
+
+def test_index_rebuilt_when_stale(data_dir):
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    with open(P.BOOK_FILE, "ab") as f:
+        f.write(P.BOOK_STRUCT.pack(*book(2)))  # written without updating the index
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 2) == 1
+
+def test_index_rebuilt_when_missing(data_dir):
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(2))
+    os.remove(P.index_path(P.BOOK_FILE, "id"))
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 2) == 1
+    assert os.path.exists(P.index_path(P.BOOK_FILE, "id"))
+
+def test_borrows_by_member_and_book(data_dir):
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(i % 4, i % 6) for i in range(24)])
+    P.write_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 0, loan(9, 9))
+    P.delete_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 5)
+    assert_indexes_match_scan()
+    assert [slot for slot, _ in P.member_borrows(1)] == [1, 9, 13, 17, 21]
+    assert [slot for slot, _ in P.book_borrows(0)] == [6, 12, 18]
+    assert P.member_borrows(9) == [(0, loan(9, 9))]
+    assert P.book_borrows(42) == []
+
+def assert_availability_matches_scan():
+    counts = {}
+    for _, raw in P.iter_records(P.BORROW_FILE, P.BORROW_STRUCT):
+        if P.is_active_borrow(P.unpack_str(raw[5])):
+            counts[raw[1]] = counts.get(raw[1], 0) + 1
+    assert P.availability_counts() == counts
+    assert P.total_borrowed() == sum(counts.values())
+
+def random_writes(rnd, rounds: int):
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(i) for i in range(1, 61)])
+    P.add_records(P.MEMBER_FILE, P.MEMBER_STRUCT, [member(i) for i in range(1, 41)])
+    for _ in range(rounds):
+        op = rnd.random()
+        if op < 0.4:
+            P.add_records(P.BORROW_FILE, P.BORROW_STRUCT,
+                          [loan(rnd.randint(1, 40), rnd.randint(1, 60)) for _ in range(rnd.randint(1, 5))])
+            continue
+        filename, st = rnd.choice(P.TABLES)
+        slots = P.record_count(filename, st)
+        if not slots:
+            continue
+        slot = rnd.randrange(slots)
+        old = P.read_record_at(filename, st, slot)
+        if old is None:
+            continue
+        if op < 0.85:
+            if st is P.BORROW_STRUCT:
+                new = loan(old[0], rnd.randint(1, 60), status=rnd.choice(["Borrow", "Returned", "Lost"]),
+                           date_due=f"2025-02-{rnd.randint(1, 28):02d}")
+            elif st is P.BOOK_STRUCT:
+                new = book(old[0], title=f"Edited {rnd.random():.6f} หนังสือ", year_pub=rnd.randint(1900, 2025))
+            else:
+                new = member(old[0], name=f"Renamed {rnd.random():.6f}")
+            P.write_record_at(filename, st, slot, new, expected=old)
+        else:
+            P.delete_record_at(filename, st, slot, expected=old)
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_derived_data_match_scan_after_random_writes(data_dir, version):
+    rnd = random.Random(version)
+    random_writes(rnd, 300)
+    if version == 2:
+        for filename, st in P.TABLES:
+            P.convert_table(filename, st, 2)
+        random_writes(rnd, 300)
+    assert_indexes_match_scan()
+    assert_availability_matches_scan()
+
+def test_lost_index_update_is_detected(data_dir):
+    # an in-place write whose index and availability updates never happened:
+    # the record count is unchanged, the data generation is not
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(1, 10), loan(2, 20)])
+    with P.table_lock(P.BORROW_FILE, exclusive=True):
+        fmt = P.table_format(P.BORROW_FILE, P.BORROW_STRUCT)
+        P._write_at(P.BORROW_FILE, P.record_offset(fmt, 1), fmt.encode(loan(9, 10), None))
+    P.cache_drop()
+
+    assert P.index_lookup(P.BORROW_FILE, P.BORROW_STRUCT, "member", 9) == [1]
+    assert P.index_lookup(P.BORROW_FILE, P.BORROW_STRUCT, "member", 2) == []
+    assert P.borrowed_count(10) == 2
+    assert P.borrowed_count(20) == 0
+
+def test_index_from_another_table_state_is_rebuilt(data_dir):
+    # index files restored from a copy taken before a later write
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(1), book(2)])
+    saved = [P.index_path(P.BOOK_FILE, name) for name in P.TABLE_INDEXES[P.BOOK_STRUCT]]
+    for path in saved:
+        shutil.copy(path, path + ".saved")
+    P.write_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0, book(5))
+    for path in saved:
+        shutil.copy(path + ".saved", path)
+    P.cache_drop()
+
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 5) == 0
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 1) is None
+
+def test_old_index_format_is_rebuilt(data_dir):
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(1), book(2)])
+    path = P.index_path(P.BOOK_FILE, "id")
+    with open(path, "r+b") as f:
+        f.write(b"LIX1")
+    assert P.find_slot(P.BOOK_FILE, P.BOOK_STRUCT, 2) == 1
+    assert P._read_index_header(path) is not None
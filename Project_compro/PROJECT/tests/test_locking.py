@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+import Project as P
+from conftest import book
+
+def test_stale_write_is_rejected(data_dir):
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    seen = P.read_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0)
+    P.write_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0, book(1, title="Desk A"), expected=seen)
+    with pytest.raises(ValueError):
+        P.write_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0, book(1, title="Desk B"), expected=seen)
+    with pytest.raises(ValueError):
+        P.delete_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0, expected=seen)
+    assert P.decode_record(P.read_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0))[1] == "Desk A"
+
+def test_concurrent_inserts_keep_ids_unique(data_dir):
+    errors = []
+
+    def desk(n):
+        for book_id in range(1, 21):
+            try:
+                P.insert_unique(P.BOOK_FILE, P.BOOK_STRUCT, book(book_id, title=f"Desk {n}"))
+            except ValueError:
+                errors.append(book_id)
+
+    threads = [threading.Thread(target=desk, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(raw[0] for _, raw in P.iter_records(P.BOOK_FILE, P.BOOK_STRUCT)) == list(range(1, 21))
+    assert len(errors) == 3 * 20
+
+def test_upgrade_notices_a_writer_that_got_in(data_dir, monkeypatch):
+    # flock drops the shared lock before taking exclusive; let a writer in there
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    flock = P._flock
+    upgrading = threading.current_thread()
+
+    def upgrade_with_writer(fd, exclusive):
+        if exclusive and threading.current_thread() is upgrading:
+            P.fcntl.flock(fd, P.fcntl.LOCK_UN)
+            writer = threading.Thread(target=P.add_record, args=(P.BOOK_FILE, P.BOOK_STRUCT, book(2)))
+            writer.start()
+            writer.join()
+        flock(fd, exclusive)
+
+    with P.table_lock(P.BOOK_FILE):
+        with P.table_lock(P.BOOK_FILE, exclusive=True):
+            pass  # nobody else wrote: the upgrade goes through
+        monkeypatch.setattr(P, "_flock", upgrade_with_writer)
+        with pytest.raises(ValueError):
+            with P.table_lock(P.BOOK_FILE, exclusive=True):
+                pass
+    assert P.record_count(P.BOOK_FILE, P.BOOK_STRUCT) == 2
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+import Project as P
+from conftest import book, member
+
+def all_pages(query, after=None, **kwargs) -> list:
+    rows, pages = [], 0
+    while True:
+        page, after = query(after=after, **kwargs)
+        rows += page
+        pages += 1
+        assert pages < 1000
+        if after is None:
+            return rows
+
+def expected_rows(filename, st, order_by, keep=lambda row: True) -> list:
+    # brute force: every live matching record, sorted by (sort key, slot)
+    i = [c[0] for c in P.TABLE_COLUMNS[st]].index(order_by)
+    kind = P.QUERY_COLUMNS[st][order_by][1]
+    key = (lambda row: P.day_number(row[i])) if kind == "date" else (lambda row: row[i])
+    rows = [(slot, raw) for slot, raw in P.iter_records(filename, st) if keep(P.decode_record(raw))]
+    return sorted(rows, key=lambda r: (key(P.decode_record(r[1])), r[0]))
+
+@pytest.fixture
+def books(data_dir):
+    rnd = random.Random(21)
+    ids = rnd.sample(range(1, 10_000), 250)
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(i) for i in ids])
+    for slot in rnd.sample(range(250), 20):
+        P.delete_record_at(P.BOOK_FILE, P.BOOK_STRUCT, slot)
+
+@pytest.mark.parametrize("limit", [1, 7, 20, 230, 1000])
+def test_pages_cover_table_in_order(books, limit):
+    rows = all_pages(P.query_books, order_by="year_pub", limit=limit)
+    assert rows == expected_rows(P.BOOK_FILE, P.BOOK_STRUCT, "year_pub")
+
+def test_default_order_is_first_column(books):
+    rows = all_pages(P.query_books, limit=13)
+    assert [P.decode_record(raw)[0] for _, raw in rows] == sorted(
+        P.decode_record(raw)[0] for _, raw in P.iter_records(P.BOOK_FILE, P.BOOK_STRUCT))
+
+@pytest.mark.parametrize("where, keep", [
+    ({"category": "science"}, lambda row: row[5] == "Science"),
+    ({"year_pub": (1990, 1999)}, lambda row: 1990 <= row[4] <= 1999),
+    ({"category": "Novel", "language": "THAI"}, lambda row: row[5] == "Novel" and row[6] == "Thai"),
+    ({"year_pub": (None, 1985), "shelf_no": "S3"}, lambda row: row[4] <= 1985 and row[7] == "S3"),
+])
+@pytest.mark.parametrize("order_by", ["book_id", "year_pub"])
+def test_filtered_pages(books, where, keep, order_by):
+    rows = all_pages(P.query_books, where=where, order_by=order_by, limit=6)
+    assert rows == expected_rows(P.BOOK_FILE, P.BOOK_STRUCT, order_by, keep)
+
+def test_both_plans_agree(books, monkeypatch):
+    where = {"category": "History"}
+    sorted_plan = all_pages(P.query_books, where=where, order_by="year_pub", limit=9)
+    monkeypatch.setattr(P, "QUERY_SORT_MAX", 0)  # always walk the sort index
+    assert all_pages(P.query_books, where=where, order_by="year_pub", limit=9) == sorted_plan
+
+def test_last_page_has_no_cursor(books):
+    total = len(list(P.iter_records(P.BOOK_FILE, P.BOOK_STRUCT)))
+    rows, after = P.query_books(limit=total)
+    assert len(rows) == total and after is None
+    rows, after = P.query_books(limit=total - 1)
+    assert len(rows) == total - 1 and after is not None
+    rows, after = P.query_books(after=after, limit=total - 1)
+    assert len(rows) == 1 and after is None
+
+def test_writes_between_pages_do_not_shift_pages(books):
+    first, after = P.query_books(order_by="book_id", limit=10)
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(0), book(20_000)])
+    rest = all_pages(P.query_books, after=after, order_by="book_id", limit=10)
+
+    ids = [P.decode_record(raw)[0] for _, raw in first + rest]
+    assert ids == sorted(set(ids))
+    assert 0 not in ids and ids[-1] == 20_000
+
+def test_member_dates(data_dir):
+    P.add_records(P.MEMBER_FILE, P.MEMBER_STRUCT, [member(i) for i in range(1, 120)])
+    where = {"birth_date": ("1970-01-01", "1989-12-31")}
+    rows = all_pages(P.query_members, where=where, order_by="birth_date", limit=8)
+    assert rows == expected_rows(P.MEMBER_FILE, P.MEMBER_STRUCT, "birth_date",
+                                 lambda row: "1970-01-01" <= row[2] <= "1989-12-31")
+
+def test_bad_queries_raise(books):
+    with pytest.raises(ValueError):
+        P.query_books(order_by="category")
+    with pytest.raises(ValueError):
+        P.query_books(where={"title": "Book 1"})
+    with pytest.raises(ValueError):
+        P.query_books(where={"category": ("A", "B")})
+    with pytest.raises(ValueError):
+        P.query_members(where={"reg_date": "2025-13-01"})
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+import Project as P
+from conftest import book, loan, member
+
+def report_lines(name: str) -> list:
+    with open(name, encoding="utf-8") as f:
+        return [line for line in f if not line.startswith("Generated At")]
+
+def add_library():
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(i) for i in range(1, 8)])
+    P.add_records(P.MEMBER_FILE, P.MEMBER_STRUCT, [member(i) for i in range(1, 5)])
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(i % 5, i % 9, status="Borrow" if i % 3 else "Returned")
+                                                   for i in range(40)])
+    P.delete_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 2)
+    P.delete_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 4)
+
+def test_numpy_and_index_reports_agree(data_dir, monkeypatch):
+    pytest.importorskip("numpy")
+    add_library()
+    P.generate_report()
+    expected = {name: report_lines(name) for name in ("books_report.txt", "borrows_report.txt")}
+    monkeypatch.setattr(P, "np", None)
+    P.generate_report()
+    assert {name: report_lines(name) for name in expected} == expected
+
+def test_borrows_report_groups_by_member(data_dir):
+    add_library()
+    P.generate_report()
+    lines = report_lines("borrows_report.txt")
+    members = [int(line.split("|")[0].split(":")[1]) for line in lines if line.startswith("MemberID")]
+    assert members == [1, 2, 3, 4]  # member 0 does not exist
+    unknown_books = [raw for _, raw in P.iter_records(P.BORROW_FILE, P.BORROW_STRUCT)
+                     if P.is_active_borrow(P.unpack_str(raw[5])) and raw[0] and raw[1] in (0, 3, 8)]
+    assert sum("N/A" in line for line in lines) == len(unknown_books)  # book 3 was deleted
+    assert "- Members with Borrows : 5\n" in lines
+
+def test_active_loans_follow_writes(data_dir):
+    add_library()
+    P.write_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 1, loan(1, 1, status="Returned"))
+    P.write_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 3, loan(2, 3))  # was returned
+    P.delete_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 7)
+    expected = sorted((raw[0], slot) for slot, raw in P.iter_records(P.BORROW_FILE, P.BORROW_STRUCT)
+                      if P.is_active_borrow(P.unpack_str(raw[5])))
+    assert P.active_loans() == expected
+
+def test_report_follows_returns(data_dir, monkeypatch):
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(1), book(2)])
+    P.add_records(P.MEMBER_FILE, P.MEMBER_STRUCT, [member(1), member(2)])
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(1, 1), loan(2, 1), loan(2, 2)])
+    P.update_loan(1, {"status": "Returned", "date_return": "2025-01-10"})
+    for numpy_path in (True, False):
+        if not numpy_path:
+            monkeypatch.setattr(P, "np", None)
+        P.generate_report()
+        borrows = report_lines("borrows_report.txt")
+        assert [line.split("|")[0].strip() for line in borrows if line.startswith("MemberID")] == \
+               ["MemberID: 1", "MemberID: 2"]
+        assert "- Total Borrowed Books : 2\n" in borrows
+        assert "- Borrowed Now      : 2\n" in report_lines("books_report.txt")
+
+@pytest.mark.parametrize("numpy_path", [True, False])
+def test_reports_come_from_one_state(data_dir, monkeypatch, numpy_path):
+    # a loan written while the books report is being written waits for both reports
+    if numpy_path:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(P, "np", None)
+    add_library()
+    write_books_report = P.write_books_report
+    writer = threading.Thread(target=P.add_record, args=(P.BORROW_FILE, P.BORROW_STRUCT, loan(1, 1)))
+
+    def books_report_then_loan(*args):
+        write_books_report(*args)
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+
+    monkeypatch.setattr(P, "write_books_report", books_report_then_loan)
+    active = P.total_borrowed()
+    P.generate_report()
+    writer.join()
+    assert f"- Total Borrowed Books : {active}\n" in report_lines("borrows_report.txt")
+    assert P.total_borrowed() == active + 1
@@ -0,0 +1,50 @@
+import Project as P
+from conftest import book, member
+
+def found_ids(results) -> list:
+    return [raw[0] for _, raw in results]
+
+def add_catalogue():
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [
+        book(1, title="Python Programming", author="Guido"),
+        book(2, title="Programming Pearls", author="Bentley"),
+        book(3, title="แฮร์รี่ พอตเตอร์กับศิลาอาถรรพ์", author="J.K. Rowling"),
+        book(4, title="ความสุขของกะทิ", author="งามพรรณ เวชชาชีวะ"),
+        book(5, title="ＰＹＴＨＯＮ Cookbook", author="Beazley"),
+    ])
+
+def test_word_prefixes(data_dir):
+    add_catalogue()
+    assert found_ids(P.search_books("program")) == [1, 2]
+    assert found_ids(P.search_books("python")) == [1, 5]  # full-width letters are normalized
+    assert found_ids(P.search_books("programming pyth")) == [1]
+    assert found_ids(P.search_books("gramming")) == []  # Latin words match from their start
+
+def test_thai_substrings(data_dir):
+    add_catalogue()
+    assert found_ids(P.search_books("พอตเตอร์")) == [3]
+    assert found_ids(P.search_books("สุข")) == [4]
+    assert found_ids(P.search_books("ศิลา rowling")) == [3]
+
+def test_short_terms_are_checked(data_dir):
+    add_catalogue()
+    assert found_ids(P.search_books("J")) == [3]  # no token: scans the table
+    assert found_ids(P.search_books("python c")) == [5]
+
+def test_follows_updates_and_deletes(data_dir):
+    add_catalogue()
+    P.write_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 0, book(1, title="Learning Rust"))
+    P.delete_record_at(P.BOOK_FILE, P.BOOK_STRUCT, 1)
+    assert found_ids(P.search_books("program")) == []
+    assert found_ids(P.search_books("rust")) == [1]
+
+def test_limit_and_members(data_dir):
+    P.add_records(P.MEMBER_FILE, P.MEMBER_STRUCT, [member(i, name=f"Somchai {i}") for i in range(1, 21)])
+    assert len(P.search_members("somchai", limit=5)) == 5
+    assert found_ids(P.search_members("m7@example")) == [7]
+
+def test_index_built_from_spilled_runs(data_dir, monkeypatch):
+    monkeypatch.setattr(P, "INDEX_SORT_CHUNK", 16)
+    P.add_records(P.BOOK_FILE, P.BOOK_STRUCT, [book(i) for i in range(1, 101)], update_indexes=False)
+    assert found_ids(P.search_books("book 42")) == [42]
+    assert len(P.search_books("author")) == 100
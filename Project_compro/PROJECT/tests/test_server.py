@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+
+import Project as P
+import server
+from conftest import book, loan, member
+
+BOOK_ROW = {"book_id": 1, "title": "Book 1", "author": "A", "publisher": "P", "year_pub": 2001,
+            "category": "Novel", "language": "Thai", "shelf_no": "S1", "total_copies": 1}
+
+def op(name, **args):
+    return server.run_op({"op": name, "args": args})
+
+def test_row_ops(data_dir):
+    assert op("add_book", row=BOOK_ROW)["title"] == "Book 1"
+    with pytest.raises(ValueError):
+        op("add_book", row=BOOK_ROW)
+    assert op("update_book", book_id=1, changes={"title": "Renamed"})["title"] == "Renamed"
+    assert op("find_book", book_id=1)["title"] == "Renamed"
+    op("delete_book", book_id=1)
+    assert op("find_book", book_id=1) is None
+    with pytest.raises(ValueError):
+        op("delete_book", book_id=1)
+
+def test_borrow_and_loans(data_dir):
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1, total_copies=1))
+    P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(1))
+    op("borrow", member_id=1, book_ids=[1], date_out="2025-01-05", date_due="2025-01-19")
+    assert op("availability", book_id=1) == {"book_id": 1, "total_copies": 1, "borrowed": 1, "available": 0}
+    with pytest.raises(ValueError):
+        op("borrow", member_id=1, book_ids=[1], date_out="2025-01-05", date_due="2025-01-19")
+    loans = op("member_loans", member_id=1)
+    assert [(l["book_id"], l["slot"]) for l in loans] == [(1, 0)]
+    assert op("update_loan", slot=0, expected=loans[0], changes={"status": "Returned"})["status"] == "Returned"
+    assert op("availability", book_id=1)["available"] == 1
+
+def test_loan_edits_check_the_expected_loan(data_dir):
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(1, 1), loan(2, 2), loan(3, 3)])
+    seen = op("member_loans", member_id=3)[0]
+    P.delete_record_at(P.BORROW_FILE, P.BORROW_STRUCT, 0)
+    P.compact_file(P.BORROW_FILE, P.BORROW_STRUCT)  # loan 3 moves from slot 2 to slot 1
+    with pytest.raises(ValueError):
+        op("delete_loan", slot=1, expected=op("member_loans", member_id=2)[0])
+    with pytest.raises(ValueError):
+        op("update_loan", slot=seen["slot"], expected=seen, changes={"status": "Returned"})
+    with pytest.raises(ValueError):
+        op("delete_loan", slot=1, expected={"member_id": 3})
+    op("delete_loan", slot=1, expected=seen)
+    assert [raw[0] for _, raw in P.iter_records(P.BORROW_FILE, P.BORROW_STRUCT)] == [2]
+
+def test_unknown_op(data_dir):
+    with pytest.raises(ValueError):
+        server.run_op({"op": "drop_tables"})
+
+@pytest.mark.parametrize("request_", [
+    ["find_book", 1],                                         # not an object
+    {"op": "find_book", "args": [1]},                          # args not an object
+    {"op": "find_book", "args": {}},                           # missing argument
+    {"op": "find_book", "args": {"book_id": 1, "x": 2}},       # unknown argument
+    {"op": "find_book", "args": {"book_id": "1"}},             # wrong type
+    {"op": "find_book", "args": {"book_id": True}},            # booleans are not numbers
+    {"op": "borrow", "args": {"member_id": 1, "book_ids": [1, "2"], "date_out": "2025-01-05",
+                              "date_due": "2025-01-19"}},      # array element
+])
+def test_arguments_are_checked(data_dir, request_):
+    with pytest.raises(ValueError):
+        server.run_op(request_)
+    assert not P.record_count(P.BORROW_FILE, P.BORROW_STRUCT)
+
+def test_optional_arguments(data_dir):
+    assert op("overdue") == []
+    assert op("overdue", as_of=None) == []
+    assert op("compute_fines", as_of="2025-01-01", rate=2) == {"overdue": 0, "changed": 0}
+
+def test_history_is_limited(data_dir):
+    P.add_records(P.BORROW_FILE, P.BORROW_STRUCT, [loan(i, i) for i in range(1, 6)])
+    page = op("history", limit=3)
+    assert ([row["member_id"] for row in page["rows"]], page["more"]) == ([1, 2, 3], True)
+    assert op("history", limit=5)["more"] is False
+    assert len(op("history")["rows"]) == 5
+
+def test_report_is_returned(data_dir):
+    P.add_record(P.BOOK_FILE, P.BOOK_STRUCT, book(1))
+    P.add_record(P.MEMBER_FILE, P.MEMBER_STRUCT, member(1))
+    P.add_record(P.BORROW_FILE, P.BORROW_STRUCT, loan(1, 1))
+    report = op("report")
+    assert "- Borrowed Now      : 1" in report["books"]
+    assert "MemberID: 1 " in report["borrows"]
+    assert not list(data_dir.glob("*_report.txt"))
+
+def exchange(requests) -> list:
+    # send requests (bytes are sent as they are) over one connection to a
+    # running server, return the replies
+    async def session():
+        srv = await asyncio.start_server(lambda r, w: server.handle_client(r, w, None), "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*srv.sockets[0].getsockname()[:2])
+        replies = []
+        for request in requests:
+            writer.write(request if isinstance(request, bytes) else json.dumps(request).encode() + b"\n")
+            replies.append(json.loads(await reader.readline()))
+        writer.close()
+        srv.close()
+        return replies
+    return asyncio.run(session())
+
+def test_errors_are_replies(data_dir):
+    # a failing request answers {"ok": false} and the connection stays usable
+    replies = exchange([{"op": "find_book", "args": {"book_id": 1}}, {"op": "nope"},
+                        {"op": "find_book", "args": {"book_id": "x"}}, {"op": "ping"}])
+    assert [reply["ok"] for reply in replies] == [True, False, False, True]
+    assert replies[1]["error"] == "unknown op 'nope'"
+    assert replies[2]["error"].startswith("book_id:")
+
+def test_internal_errors_are_replies(data_dir, monkeypatch, capsys):
+    monkeypatch.setitem(server.OPS, "boom", (lambda: 1 / 0, {}))
+    replies = exchange([{"op": "boom"}, {"op": "ping"}])
+    assert replies == [{"ok": False, "error": "ZeroDivisionError: division by zero"},
+                       {"ok": True, "result": "pong"}]
+    assert "ZeroDivisionError" in capsys.readouterr().err  # logged on the server
+
+def test_overlong_line_is_answered(data_dir):
+    # longer than the stream limit (64 KiB): an error reply, then the next request
+    huge = json.dumps({"op": "search_books", "args": {"query": "x" * 200_000}}).encode() + b"\n"
+    replies = exchange([huge, {"op": "ping"}])
+    assert replies[0]["ok"] is False
+    assert replies[1] == {"ok": True, "result": "pong"}
@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+import Project as P
+from conftest import loan, restart
+
+F, ST = P.BORROW_FILE, P.BORROW_STRUCT
+
+def setup_loans(*rows):
+    # durable rows and an empty log, so only the simulated records get replayed
+    P.add_records(F, ST, list(rows))
+    P.checkpoint_table(F)
+
+def log_only(slot: int, raw: tuple):
+    # a crash after the log record is durable but before the data file write
+    with P.table_lock(F, exclusive=True):
+        P.log_write(F, slot * ST.size, ST.pack(*raw))
+
+def test_replay_redoes_logged_overwrite(data_dir):
+    setup_loans(loan(1, 10), loan(2, 20), loan(3, 30))
+    log_only(1, loan(7, 20, status="Returned"))
+    restart()
+
+    assert P.recover_table(F, ST) == 1
+    assert P.decode_record(P.read_record_at(F, ST, 1))[:2] == (7, 20)
+    # the derived tables are rebuilt from the replayed file
+    assert P.index_lookup(F, ST, "member", 2) == []
+    assert P.index_lookup(F, ST, "member", 7) == [1]
+    assert P.borrowed_count(20) == 0
+
+def test_recovery_is_idempotent(data_dir):
+    setup_loans(loan(1, 10), loan(2, 20))
+    log_only(0, loan(5, 10))
+    restart()
+    P.recover_table(F, ST)
+    restart()
+
+    assert P.recover_table(F, ST) == 0
+    assert [P.decode_record(raw)[0] for _, raw in P.iter_records(F, ST)] == [5, 2]
+
+def test_unlogged_append_is_cut(data_dir):
+    P.add_records(F, ST, [loan(1, 10), loan(2, 20)])
+    with open(F, "ab") as f:
+        f.write(ST.pack(*loan(3, 30)))
+    restart()
+
+    P.recover_table(F, ST)
+    assert P.record_count(F, ST) == 2
+    assert P.find_records(F, ST, "member", 3) == []
+
+def test_torn_partial_record_is_cut(data_dir):
+    P.add_records(F, ST, [loan(1, 10), loan(2, 20)])
+    with open(F, "ab") as f:
+        f.write(ST.pack(*loan(3, 30))[:ST.size // 2])
+    restart()
+
+    P.recover_table(F, ST)
+    assert os.path.getsize(F) == 2 * ST.size
+    assert [P.decode_record(raw)[0] for _, raw in P.iter_records(F, ST)] == [1, 2]
+
+def test_torn_log_tail_is_ignored(data_dir):
+    setup_loans(loan(1, 10), loan(2, 20))
+    log_only(0, loan(5, 10))
+    log_only(1, loan(6, 20))
+    wal = P.wal_for(F).path
+    restart()
+    with open(wal, "r+b") as f:
+        f.truncate(os.path.getsize(wal) - 3)  # the second record was being written
+
+    assert P.recover_table(F, ST) == 1
+    assert [P.decode_record(raw)[0] for _, raw in P.iter_records(F, ST)] == [5, 2]
+
+def test_corrupt_log_record_stops_replay(data_dir):
+    setup_loans(loan(1, 10), loan(2, 20))
+    size = os.path.getsize(P.wal_for(F).path)
+    log_only(0, loan(5, 10))
+    log_only(1, loan(6, 20))
+    wal = P.wal_for(F).path
+    restart()
+    with open(wal, "r+b") as f:
+        f.seek(size + P.WAL_RECORD.size)  # payload of the first unapplied record
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    # neither the damaged record nor anything after it is trusted
+    assert P.recover_table(F, ST) == 0
+    assert [P.decode_record(raw)[0] for _, raw in P.iter_records(F, ST)] == [1, 2]
+
+def test_checkpoint_empties_log(data_dir):
+    P.add_records(F, ST, [loan(i, i) for i in range(50)])
+    P.checkpoint_table(F)
+
+    records = list(P.wal_for(F).records())
+    assert records == [(P.WAL_CHECKPOINT, os.path.getsize(F), b"")]
+    restart()
+    assert P.recover_table(F, ST) == 0
+    assert P.record_count(F, ST) == 50
+
+def test_overwrite_is_logged_durably_first(data_dir):
+    # in-place writes sync their log records before touching the data file,
+    # not only when the table lock is released
+    setup_loans(loan(1, 10), loan(2, 20))
+    wal = P.wal_for(F)
+    with P.table_lock(F, exclusive=True):
+        P.write_record_at(F, ST, 0, loan(1, 10, status="Returned"))
+        assert wal._synced == wal._appended
+        P.compute_fines("2025-03-01")
+        assert wal._synced == wal._appended
+
+def test_log_is_committed_when_a_section_raises(data_dir):
+    setup_loans(loan(1, 10))
+    wal = P.wal_for(F)
+    with pytest.raises(RuntimeError):
+        with P.table_lock(F, exclusive=True):
+            P.add_records(F, ST, [loan(2, 20)])  # appends commit on release
+            raise RuntimeError("desk crashed")
+    assert wal._synced == wal._appended
+    assert P.record_count(F, ST) == 2